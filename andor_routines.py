@@ -5,19 +5,94 @@ if DEBUGGING:
 else:
     import evora.andor as andor
 import time
+from concurrent.futures import Future
+
+DRV_SUCCESS = 20002
+DRV_ACQUIRING = 20072
+
+# Milliseconds to block in waitForAcquisitionTimeOut per poll of an acquisition
+WAIT_POLL_MS = 100
 
 # biases: Readout noise from camera (effectively 0 s exposure)
 # flats: take an image with even lighting (i.e. the white paint of the dome)
 # darks: image while shutter closed
 
 
-def startup():
+def image_geometry(detector_dim, hbin=1, vbin=1, roi=None):
+    '''
+    Validates binning and a region of interest against the detector.
+
+    Parameters:
+    - detector_dim: tuple of the detector dimensions, from getDetector
+    - hbin, vbin: horizontal and vertical binning
+    - roi: optional dict with the 1-based, inclusive 'hstart', 'hend',
+      'vstart' and 'vend' unbinned pixels to read. The whole detector is read
+      if omitted. The width and height must be multiples of the binning.
+
+    Returns:
+    - dict with 'hbin', 'vbin', 'hstart', 'hend', 'vstart', 'vend' as taken
+      by setImage, and 'dim', the dimensions of the binned image read out
+
+    Raises ValueError if the geometry is not valid.
+    '''
+    width, height = detector_dim
+    hbin, vbin = int(hbin), int(vbin)
+    if not 1 <= hbin <= width or not 1 <= vbin <= height:
+        raise ValueError(f'Binning must be between 1 and the detector size {width}x{height}.')
+
+    if roi is None:
+        roi = {}
+    try:
+        hstart = int(roi.get('hstart', 1))
+        hend = int(roi.get('hend', width))
+        vstart = int(roi.get('vstart', 1))
+        vend = int(roi.get('vend', height))
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError('Invalid region of interest.')
+
+    if not 1 <= hstart <= hend <= width or not 1 <= vstart <= vend <= height:
+        raise ValueError(f'Region of interest must lie within the detector {width}x{height}.')
+    if (hend - hstart + 1) % hbin != 0 or (vend - vstart + 1) % vbin != 0:
+        raise ValueError('Region of interest size must be a multiple of the binning.')
+
+    return {
+        'hbin': hbin,
+        'vbin': vbin,
+        'hstart': hstart,
+        'hend': hend,
+        'vstart': vstart,
+        'vend': vend,
+        'dim': ((hend - hstart + 1) // hbin, (vend - vstart + 1) // vbin),
+    }
+
+
+def setImageGeometry(geometry):
+    '''
+    Sets the binning and region of interest from an image_geometry dict.
+    '''
+    andor.setImage(
+        geometry['hbin'],
+        geometry['vbin'],
+        geometry['hstart'],
+        geometry['hend'],
+        geometry['vstart'],
+        geometry['vend'],
+    )
+
+
+def startup(hbin=1, vbin=1, roi=None):
     '''
     Initializes the camera and sets the acquisition mode to single scan.
 
+    Parameters:
+    - hbin, vbin, roi: initial binning and region of interest, see image_geometry
+
     Returns:
     - dimensions: tuple of the image dimensions
     '''
+    global _readout_modes
+    _readout_modes = None
+
     # implement with config values
     andor.initialize()
     andor.setAcquisitionMode(1)
@@ -26,7 +101,7 @@ def startup():
     image_dimensions = andor.getDetector()["dimensions"]
 
     andor.setShutter(1, 0, 50, 50)
-    andor.setImage(1, 1, 1, image_dimensions[0], 1, image_dimensions[1])
+    setImageGeometry(image_geometry(image_dimensions, hbin, vbin, roi))
 
     return {"dimensions": image_dimensions, "status": 20002}
 
@@ -63,12 +138,295 @@ def deactivateCooling(fan_mode_high=False):
     return 20002
 
 
-def acquisition(dim, exposure_time=0.1):
+# Amplifier type passed to the speed functions; the iKon-M only has a
+# conventional amplifier
+CONVENTIONAL_AMPLIFIER = 0
+
+# The readout modes don't change while the camera is initialized, so they
+# are read once. Cleared by startup.
+_readout_modes = None
+
+
+def readoutModes():
+    '''
+    Lists the readout speeds and pre-amp gains the camera supports.
+
+    Returns:
+    - dict with 'channels', a list with the horizontal shift speeds (MHz) of
+      each A-D channel, 'vsspeeds', the vertical shift speeds (microseconds
+      per row), 'fastest_vsspeed', the index of the fastest vertical speed
+      recommended, and 'preamp_gains', the pre-amp gain factors
+    '''
+    global _readout_modes
+    if _readout_modes is None:
+        channels = []
+        for channel in range(andor.getNumberADChannels()['number']):
+            count = andor.getNumberHSSpeeds(channel, CONVENTIONAL_AMPLIFIER)['number']
+            channels.append([
+                andor.getHSSpeed(channel, CONVENTIONAL_AMPLIFIER, index)['speed']
+                for index in range(count)
+            ])
+
+        _readout_modes = {
+            'channels': channels,
+            'vsspeeds': [
+                andor.getVSSpeed(index)['speed']
+                for index in range(andor.getNumberVSSpeeds()['number'])
+            ],
+            'fastest_vsspeed': andor.getFastestRecommendedVSSpeed()['index'],
+            'preamp_gains': [
+                andor.getPreAmpGain(index)['gain']
+                for index in range(andor.getNumberPreAmpGains()['number'])
+            ],
+        }
+
+    return _readout_modes
+
+
+def setReadout(readout='slow'):
+    '''
+    Sets the readout speeds and pre-amp gain.
+
+    Parameters:
+    - readout: 'fast', the fastest horizontal speed with the highest usable
+      gain, for focus and real time frames; 'slow', the slowest, lowest noise
+      horizontal speed at unity gain, for science frames; or a dict of
+      'channel', 'hsspeed', 'vsspeed' and 'preamp' indices into readoutModes,
+      where omitted entries take their 'slow' value
+
+    Returns:
+    - dict with the 'mode' ('fast', 'slow' or 'custom'), the indices set, and
+      'hsspeed_mhz', 'vsspeed_us' and 'preamp_gain', the values they select
+
+    Raises ValueError if the readout is not valid.
+    '''
+    modes = readoutModes()
+    gains = range(len(modes['preamp_gains']))
+
+    def available(channel, hsspeed, preamp):
+        return andor.isPreAmpGainAvailable(
+            channel, CONVENTIONAL_AMPLIFIER, hsspeed, preamp
+        )['available']
+
+    if readout == 'fast':
+        channel, hsspeed = 0, 0
+        preamp = max((pa for pa in gains if available(channel, hsspeed, pa)), default=None)
+        if preamp is None:
+            raise ValueError('No pre-amp gain is available at the fastest speed.')
+        settings = {'mode': 'fast', 'channel': channel, 'hsspeed': hsspeed, 'preamp': preamp}
+    elif readout == 'slow':
+        settings = {'mode': 'slow', 'channel': 0, 'hsspeed': len(modes['channels'][0]) - 1, 'preamp': 0}
+    elif isinstance(readout, dict):
+        try:
+            channel = int(readout.get('channel', 0))
+            hsspeeds = modes['channels'][channel] if channel >= 0 else []
+            settings = {
+                'mode': 'custom',
+                'channel': channel,
+                'hsspeed': int(readout.get('hsspeed', len(hsspeeds) - 1)),
+                'vsspeed': int(readout.get('vsspeed', modes['fastest_vsspeed'])),
+                'preamp': int(readout.get('preamp', 0)),
+            }
+        except (IndexError, TypeError, ValueError):
+            raise ValueError('Invalid readout.')
+
+        if not 0 <= settings['hsspeed'] < len(hsspeeds):
+            raise ValueError(f'Horizontal speed must be an index below {len(hsspeeds)}.')
+        if not 0 <= settings['vsspeed'] < len(modes['vsspeeds']):
+            raise ValueError(f"Vertical speed must be an index below {len(modes['vsspeeds'])}.")
+        if settings['preamp'] not in gains or not available(
+            settings['channel'], settings['hsspeed'], settings['preamp']
+        ):
+            raise ValueError('Pre-amp gain is not available at this speed.')
+    else:
+        raise ValueError("Readout must be 'fast', 'slow' or a dict of indices.")
+
+    settings.setdefault('vsspeed', modes['fastest_vsspeed'])
+
+    andor.setADChannel(settings['channel'])
+    andor.setHSSpeed(CONVENTIONAL_AMPLIFIER, settings['hsspeed'])
+    andor.setVSSpeed(settings['vsspeed'])
+    andor.setPreAmpGain(settings['preamp'])
+
+    settings['hsspeed_mhz'] = modes['channels'][settings['channel']][settings['hsspeed']]
+    settings['vsspeed_us'] = modes['vsspeeds'][settings['vsspeed']]
+    settings['preamp_gain'] = modes['preamp_gains'][settings['preamp']]
+    return settings
+
+
+class AcquisitionWait:
+    '''
+    Tracks an acquisition until the camera has finished reading it out.
+
+    poll() is called repeatedly from the thread that owns the camera (see
+    camera_actor.CameraActor) and returns True once the image is ready.
+    Each call blocks for at most WAIT_POLL_MS, so other commands and aborts
+    can be interleaved with the wait.
+
+    future resolves to a dict with 'aborted' and 'elapsed', the measured
+    exposure + readout time in seconds.
+    '''
+
+    def __init__(self):
+        self.future = Future()
+        self.start_time = None
+
+    def started(self):
+        self.start_time = time.monotonic()
+
+    def poll(self):
+        andor.waitForAcquisitionTimeOut(WAIT_POLL_MS)
+        if andor.getStatus()['status'] == DRV_ACQUIRING:
+            return False
+
+        self.finish(aborted=False)
+        return True
+
+    def abort(self):
+        andor.abortAcquisition()
+        self.finish(aborted=True)
+
+    def finish(self, aborted):
+        self.future.set_result({'aborted': aborted, 'elapsed': self.elapsed()})
+
+    def fail(self, error):
+        self.future.set_exception(error)
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+
+class SeriesWait(AcquisitionWait):
+    '''
+    Retrieves the frames of a kinetic series as they become available.
+
+    Each frame is put on frame_queue as a tuple (index, data) as soon as the
+    camera has it, so it can be written while the camera keeps exposing. Only
+    as many frames as there is room for on the queue are retrieved per poll;
+    the rest wait in the camera's circular buffer. None is put on the queue
+    once no more frames will follow.
+
+    The acquisition mode, number of kinetics and exposure time must already
+    be set. future resolves to a dict with 'aborted', 'frames' (the number
+    of frames retrieved) and 'elapsed'.
+
+    Parameters:
+    - dim: tuple of the image dimensions
+    - count: number of frames in the series
+    - frame_queue: queue.Queue the frames are put on
+    '''
+
+    def __init__(self, dim, count, frame_queue):
+        super().__init__()
+        self.dim = dim
+        self.count = count
+        self.frame_queue = frame_queue
+        self.retrieved = 0
+
+    def poll(self):
+        andor.waitForAcquisitionTimeOut(WAIT_POLL_MS)
+
+        room = self.frame_queue.maxsize - self.frame_queue.qsize()
+        if self.frame_queue.maxsize <= 0:
+            room = self.count
+        if room <= 0:
+            return False
+
+        new_images = andor.getNumberNewImages()
+        if new_images['status'] == DRV_SUCCESS:
+            first = new_images['first']
+            last = min(new_images['last'], first + room - 1)
+            images = andor.getImages16(first, last, self.dim)
+            for offset, frame in enumerate(images['data']):
+                self.frame_queue.put((images['validfirst'] - 1 + offset, frame))
+            self.retrieved = images['validlast']
+            if self.retrieved < self.count:
+                return False
+        elif andor.getStatus()['status'] == DRV_ACQUIRING:
+            return False
+
+        # either every frame is in, or the acquisition ended without them
+        self.finish(aborted=False)
+        return True
+
+    def finish(self, aborted):
+        self.frame_queue.put(None)
+        self.future.set_result({
+            'aborted': aborted,
+            'frames': self.retrieved,
+            'elapsed': self.elapsed(),
+        })
+
+    def fail(self, error):
+        self.frame_queue.put(None)
+        super().fail(error)
+
+
+def setup_capture(imgtype, exptype, exptime, expnum=1, hbin=1, vbin=1, roi=None, readout=None):
+    '''
+    Configures the camera for a capture requested through /capture.
+
+    Parameters:
+    - imgtype: 'Bias', 'Dark', 'Flat' or 'Object'
+    - exptype: 'Single', 'Real Time' or 'Series'
+    - exptime: exposure time in seconds
+    - expnum: number of frames of a series
+    - hbin, vbin, roi: binning and region of interest, see image_geometry
+    - readout: see setReadout. Defaults to 'fast' for real time frames and
+      'slow' otherwise
+
+    Returns:
+    - settings: the image_geometry of the capture, whose 'dim' holds the
+      dimensions of the image that will be read out, and 'readout', the
+      readout settings returned by setReadout
+    '''
+    settings = image_geometry(andor.getDetector()['dimensions'], hbin, vbin, roi)
+    if readout is None:
+        readout = 'fast' if exptype == 'Real Time' else 'slow'
+
+    # check if acquisition is already in progress
+    if andor.getStatus()['status'] == DRV_ACQUIRING:
+        raise RuntimeError('Acquisition already in progress.')
+
+    # handle img type
+    if imgtype == 'Bias' or imgtype == 'Dark':
+        # Keep shutter closed during biases and darks
+        andor.setShutter(1, 2, 50, 50)
+    else:
+        andor.setShutter(1, 0, 50, 50)
+    setImageGeometry(settings)
+    settings['readout'] = setReadout(readout)
+
+    # handle exposure type
+    # refer to pg 41 - 45 of sdk for acquisition mode info
+    if exptype == 'Single':
+        andor.setAcquisitionMode(1)
+        andor.setExposureTime(exptime)
+
+    elif exptype == 'Real Time':
+        # this uses 'run till abort' mode - how do we abort it?
+        andor.setAcquisitionMode(1)
+        andor.setExposureTime(exptime)
+        # andor.setKineticCycleTime(0)
+
+    elif exptype == 'Series':
+        andor.setAcquisitionMode(3)
+        andor.setNumberKinetics(expnum)
+        andor.setExposureTime(exptime)
+        # zero selects the shortest cycle time the camera supports
+        andor.setKineticCycleTime(0)
+
+    return settings
+
+
+def acquisition(dim, exposure_time=0.1, out=None):
     '''
     Acquires an image with the given dimensions and exposure time.
 
     Parameters:
     - dim: tuple of the image dimensions
+    - out: optional C-contiguous uint16 array of shape (dim[1], dim[0]) to
+      read the image into, e.g. a buffer reused between exposures
 
     Returns:
     - data: the acquired image data
@@ -76,27 +434,30 @@ def acquisition(dim, exposure_time=0.1):
     andor.setExposureTime(exposure_time)
     andor.startAcquisition()
 
-    time.sleep(exposure_time + 0.5)
-    # while (camera_status == 20072):
-    #     camera_status = andor.getStatus()
+    wait = AcquisitionWait()
+    wait.started()
+    while not wait.poll():
+        pass
 
-    return {"data": andor.getAcquiredData(dim)["data"], "status": 20002}
+    return {"data": andor.getAcquiredData16(dim, out=out)["data"], "status": 20002}
 
 
-def acquireBias(dim):
+def acquireBias(dim, hbin=1, vbin=1, roi=None):
     '''
     Acquires a bias image.
 
     Parameters:
-    - dim: tuple of the image dimensions
+    - dim: tuple of the detector dimensions
+    - hbin, vbin, roi: binning and region of interest, see image_geometry
 
     Returns:
     - image: the acquired bias image
     '''
+    geometry = image_geometry(dim, hbin, vbin, roi)
     andor.setShutter(1, 2, 50, 50)
-    andor.setImage(1, 1, 1, dim[0], 1, dim[1])
+    setImageGeometry(geometry)
 
-    image = acquisition(dim, exposure_time=0.0)
+    image = acquisition(geometry['dim'], exposure_time=0.0)
     andor.setShutter(1, 0, 50, 50)
 
     return image
@@ -1,16 +1,19 @@
-import asyncio
 import atexit
 import json
 import logging
 import os
+import queue
 import sys
 import re
+import threading
 import time
 import typing
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
 from glob import glob
 
 import numpy
+from astropy import units as u
 from astropy.io import fits
 from astropy.time import Time
 from flask import (
@@ -22,10 +25,30 @@ from flask import (
     send_from_directory,
 )
 from flask_cors import CORS
-from ambient_api.ambientapi import AmbientAPI
 
-from andor_routines import acquisition, activateCooling, deactivateCooling, startup
+from andor_routines import (
+    DRV_ACQUIRING,
+    AcquisitionWait,
+    SeriesWait,
+    acquisition,
+    activateCooling,
+    deactivateCooling,
+    readoutModes,
+    setup_capture,
+    startup,
+)
+from camera_actor import CameraActor
+from evora import instrumentation
+from evora._error_codes import AndorCameraError
 from evora.debug import DEBUGGING
+from filter_wheel import DummyFilterWheel, FilterWheel, FilterWheelError
+from fits_writer import COMPRESSION_TYPES, FitsWriter
+from focus import analysis as focus_analysis
+import metrics
+from sequence_allocator import SequenceAllocator
+from sequencer import Sequencer
+from telemetry import TelemetrySampler
+from weather import FakeAmbientAPI, WeatherPoller, ambient_client
 
 if DEBUGGING:
     from evora.dummy import Dummy as andor  # andor
@@ -47,45 +70,121 @@ FILTER_DICT_REVERSE = {0: 'Ha', 1: 'B', 2: 'V', 3: 'g', 4: 'r', 5: 'i'}
 
 DEFAULT_PATH = '/data/ecam'
 
-api = AmbientAPI()
-
 # If we're debugging, use a local directory instead - create if doesn't exist
 if DEBUGGING:
     DEFAULT_PATH = './' + DEFAULT_PATH
     os.makedirs(os.path.dirname(DEFAULT_PATH), exist_ok=True)
 
-DUMMY_FILTER_POSITION = 0
+# The focus analysis workers are forked, so they are started before any of
+# the threads below
+focus_analysis.start()
+
+# Maximum number of series frames held in memory waiting to be written
+SERIES_QUEUE_SIZE = 8
+
+# Maximum number of frames queued for the FITS writer
+WRITER_QUEUE_SIZE = 8
+
+# Writes series frames while the waiter thread keeps retrieving them
+_series_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='series-writer')
+
+# Tile compression of frames whose capture does not choose one: 'rice',
+# 'hcompress', or unset to write them uncompressed
+FITS_COMPRESSION = os.environ.get('EVORA_FITS_COMPRESSION') or None
+
+fits_writer = FitsWriter(max_queued=WRITER_QUEUE_SIZE, compression=FITS_COMPRESSION)
+
+metrics.register_gauge(
+    'evora_writer_queue_depth',
+    'Frames waiting to be written to FITS files.',
+    lambda: fits_writer.queue_depth,
+)
+
+# Allocates ecam-NNNN.fits names, keeping the last number of the night in memory
+file_sequence = SequenceAllocator()
+
+# Every camera call goes through the actor, which owns the SDK
+camera = CameraActor(andor, on_call=metrics.observe_camera_command)
+
+# Times every SDK call made through the instrumented wrapper
+instrumentation.add_listener(metrics.observe_sdk_call)
+
+# Seconds between background reads of the TEC temperature and camera status
+TELEMETRY_PERIOD = 2.0
+
+telemetry = TelemetrySampler(camera, period=TELEMETRY_PERIOD)
+
+# Seconds between reads of the weather station, and after which a reading is stale
+WEATHER_PERIOD = 60.0
+WEATHER_TTL = 300.0
+
+weather = WeatherPoller(
+    FakeAmbientAPI if DEBUGGING else ambient_client,
+    period=WEATHER_PERIOD,
+    ttl=WEATHER_TTL,
+)
+
+# Keeps one connection to the wheel controller and caches its position. When
+# debugging, setting EVORA_WHEEL_HOST connects to a simulated controller
+# (server.py) instead of using the in-process dummy.
+if DEBUGGING and 'EVORA_WHEEL_HOST' not in os.environ:
+    filter_wheel = DummyFilterWheel(on_command=metrics.observe_wheel_command)
+else:
+    filter_wheel = FilterWheel(on_command=metrics.observe_wheel_command)
+
+# Moves the filter wheel in the background, one move at a time, so moves
+# overlap camera setup, readout and writing
+_wheel_mover = ThreadPoolExecutor(max_workers=1, thread_name_prefix='filter-wheel')
+
+# The filter name and future of the latest move
+_filter_move = None
+_filter_move_lock = threading.Lock()
+
+
+def start_filter_move(filter_name):
+    '''Starts moving the filter wheel to a filter by name.
+
+    Returns a `concurrent.futures.Future` resolving once the wheel is in
+    position. A move to the same filter that is already under way is reused,
+    and no move is made if the wheel is known to be there already.
+
+    '''
+
+    global _filter_move
+
+    with _filter_move_lock:
+        if _filter_move is not None and not _filter_move[1].done():
+            if _filter_move[0] == filter_name:
+                return _filter_move[1]
+        elif filter_wheel.position == FILTER_DICT[filter_name] and not filter_wheel.moving:
+            future = Future()
+            future.set_result(None)
+            return future
+
+        future = _wheel_mover.submit(filter_wheel.move, FILTER_DICT[filter_name])
+        _filter_move = (filter_name, future)
+        return future
 
-ABORT_FLAG = False
 
 def getFilePath(file):
     """
-    Formats the given file name to be valid.
-    If the file contains invalid characters or is empty, image.fits will be used.
+    Formats the given file name to be valid and reserves it in tonight's directory.
+    If the file contains invalid characters or is empty, the next ecam-NNNN.fits
+    in the sequence will be used.
     if the file already exists, it will be saved as:
         name(0), name(1), name(2), ..., name(n)
+    The reserved file is created empty and replaced when the frame is written.
     """
 
-    default_image_name = "ecam-{seq:04d}.fits"
-
     date = Time.now().utc.isot.split("T")[0].replace("-", "")
 
     path = os.path.join(DEFAULT_PATH, date)
     os.makedirs(path, exist_ok=True)
 
     invalid_characters = [":", "<", ">", "/", "\\", '"', "|", "?", "*", ".."]
-    # if invalid filename, use image.fits
+    # if invalid filename, use the next number in the sequence
     if file is None or file == "" or any(c in file for c in invalid_characters):
-        all_files = list(sorted(glob(os.path.join(path, "ecam-*.fits"))))
-        if len(all_files) == 0:
-            seq = 1
-        else:
-            match = re.search(r"ecam\-([0-9]+)", all_files[-1])
-            if match:
-                seq = int(match.group(1)) + 1
-            else:
-                seq = 1
-        file = default_image_name.format(seq=seq)
+        return file_sequence.reserve(path)
 
     # ensure extension is .fits
     if file[-1] == ".":
@@ -94,56 +193,482 @@ def getFilePath(file):
         file += ".fits"
 
     # ensure nothing gets overwritten
-    num = 0
-    length = len(file[0:-5])
-    while os.path.isfile(f"{DEFAULT_PATH}/{file}"):
-        file = file[0:length] + f"({num})" + file[-5:]
-        num += 1
+    return file_sequence.reserve_name(path, file)
+
+
+def release_if_unwritten(job):
+    '''Gives back the name reserved for a `fits_writer.WriteJob` if its write fails.'''
+
+    def release(future):
+        if future.exception() is not None:
+            file_sequence.release(job.file_name)
+
+    job.future.add_done_callback(release)
+    return job
 
-    return os.path.join(path, file)
 
+def build_header(req, date_obs, focus, temperature, settings):
+    '''Builds the FITS header for a capture request.
 
-async def send_to_wheel(command: str):
-    '''Sends a command to the filter wheel and parses the reply.
+    ``settings`` are the binning, region of interest and readout of the
+    capture, as returned by ``andor_routines.setup_capture``.
+
+    '''
+
+    hbin, vbin = settings['hbin'], settings['vbin']
+    hstart, vstart = settings['hstart'], settings['vstart']
+    readout = settings['readout']
+
+    header = fits.Header()
+    header['DATE-OBS'] = date_obs.isot
+    header['COMMENT'] = req['comment']
+    header['INSTRUME'] = 'iKon-M 934 CCD DU934P-BEX2-DD'
+    header['XBINNING'] = (hbin, 'Horizontal binning')
+    header['YBINNING'] = (vbin, 'Vertical binning')
+    header['XPIXSZ'] = (str(13 * hbin), 'Binned pixel width [microns]')
+    header['YPIXSZ'] = (str(13 * vbin), 'Binned pixel height [microns]')
+    header['FOCALLEN'] = '5766'
+
+    # map image pixels back to unbinned detector pixels (IRAF convention)
+    header['CCDSEC'] = (
+        f"[{hstart}:{settings['hend']},{vstart}:{settings['vend']}]",
+        'Detector section read out',
+    )
+    header['LTV1'] = ((hbin + 1 - 2 * hstart) / (2 * hbin), 'Offset to detector x')
+    header['LTV2'] = ((vbin + 1 - 2 * vstart) / (2 * vbin), 'Offset to detector y')
+    header['LTM1_1'] = (1 / hbin, 'Detector to image x scale')
+    header['LTM2_2'] = (1 / vbin, 'Detector to image y scale')
+
+    header['READOUT'] = (readout['mode'], 'Readout mode (fast, slow or custom)')
+    header['HSSPEED'] = (readout['hsspeed_mhz'], 'Horizontal shift speed [MHz]')
+    header['VSSPEED'] = (readout['vsspeed_us'], 'Vertical shift speed [us/row]')
+    header['PREAMP'] = (readout['preamp_gain'], 'Pre-amp gain factor')
+
+    if DEBUGGING:
+        # frames of the simulated sky carry its WCS
+        header.update(andor.sky.wcs_header(hbin, vbin, hstart, vstart))
+
+    header['EXPTIME'] = (
+        float(req['exptime']),
+        'Exposure Time (Seconds)',
+    )
+    header['EXP_TYPE'] = (
+        str(req['exptype']),
+        'Exposure Type (Single, Real Time, or Series)',
+    )
+    header['IMAGETYP'] = (
+        str(req['imgtype']),
+        'Image Type (Bias, Flat, Dark, or Object)',
+    )
+    header['FILTER'] = (str(req['filtype']), 'Filter (Ha, B, V, g, r)')
+    header['CCD-TEMP'] = (
+        str(f'{temperature:.3f}'),
+        'CCD Temperature during Exposure',
+    )
+    header['FOCUS'] = (
+        focus,
+        'Relative focus position [microns]'
+    )
+
+    return header
+
+
+def write_series(frame_queue, header, count, cycle_time, cube=False, compression=''):
+    '''Writes the frames of a kinetic series as they arrive on frame_queue.
 
     Parameters
     ----------
-    command
-        The string to send to the filter wheel server.
+    frame_queue
+        The queue ``acquire_series`` puts ``(index, data)`` tuples on,
+        terminated by ``None``.
+    header
+        The header of the series. ``DATE-OBS`` is that of the first frame.
+    count
+        The number of frames in the series.
+    cycle_time
+        The kinetic cycle time, used to compute the ``DATE-OBS`` of each frame.
+    cube
+        If true, write all frames to a single FITS cube instead of one file
+        per frame.
+    compression
+        The compression of each frame, as for `FitsWriter.submit`. Cubes
+        are written uncompressed.
 
     Returns
     -------
-    res
-        A tuple of response status as a boolean, and the additional reply
-        as a string (the reply string will be empty if no additional reply is
-        provided).
+    file_names
+        The paths of the files written.
 
     '''
 
-    reader, writer = await asyncio.open_connection('72.233.250.84', 9999)
-    writer.write((command + '\n').encode())
-    await writer.drain()
+    date_obs = Time(header['DATE-OBS'])
+
+    if not cube:
+        # hand each frame to the FITS writer; submit blocks while it is busy
+        jobs = []
+        while (item := frame_queue.get()) is not None:
+            index, frame = item
+            frame_header = header.copy()
+            frame_header['DATE-OBS'] = (date_obs + index * cycle_time * u.s).isot
+            frame_header['FRAMENUM'] = (index + 1, 'Frame number within the series')
+            jobs.append(release_if_unwritten(
+                fits_writer.submit(
+                    getFilePath(None), frame, frame_header, overwrite=True, compression=compression
+                )
+            ))
+
+        wait(job.future for job in jobs)
+        return [job.file_name for job in jobs if job.status == 'written']
+
+    file_name = None
+    stream = None
+    written = 0
+    failed = False
+    try:
+        while (item := frame_queue.get()) is not None:
+            index, frame = item
+            if stream is None:
+                # reserved once there is a frame to write
+                file_name = getFilePath(None)
+                # The cube is streamed to disk plane by plane. Its uint16 data is
+                # stored as int16 with BZERO = 32768, as astropy does for uint16.
+                cube_header = fits.Header([
+                    ('SIMPLE', True),
+                    ('BITPIX', 16),
+                    ('NAXIS', 3),
+                    ('NAXIS1', frame.shape[1]),
+                    ('NAXIS2', frame.shape[0]),
+                    ('NAXIS3', count),
+                    ('EXTEND', True),
+                    ('BZERO', 32768),
+                    ('BSCALE', 1),
+                ])
+                cube_header.extend(header)
+                stream = fits.StreamingHDU(file_name, cube_header)
+            stream.write((frame ^ 0x8000).view(numpy.int16))
+            written += 1
+
+        if stream is None:
+            return []
+
+        if written < count:
+            # keep the file valid if the series was cut short
+            logging.warning(f'Series ended after {written} of {count} frames')
+            blank = numpy.full(frame.shape, -32768, dtype=numpy.int16)
+            for _ in range(count - written):
+                stream.write(blank)
+    except Exception:
+        logging.exception(f'Failed to write {file_name}')
+        # keep consuming so the acquisition never blocks on a full queue
+        while item is not None:
+            item = frame_queue.get()
+        failed = True
+        return []
+    finally:
+        if stream is not None:
+            stream.close()
+        if failed and file_name is not None:
+            # the partial cube is not kept
+            file_sequence.release(file_name)
+
+    return [file_name]
+
+
+def current_temperature():
+    '''Returns the latest sampled TEC temperature and status.'''
+    latest = telemetry.latest()
+    if latest is None or latest['temperature'] is None:
+        return camera.cached('getStatusTEC')
+    return {
+        'temperature': latest['temperature'],
+        'status': latest['tec_status'],
+        'age': latest['temperature_age'],
+    }
+
+
+def validate_capture(req):
+    '''Returns why a capture request is invalid, or None if it is valid.'''
+
+    if 'exptime' not in req or 3600 < float(req['exptime']) <= 0:
+        return 'Invalid or missing exposure time.'
+    if 'exptype' not in req or req['exptype'] not in ['Single', 'Real Time', 'Series']:
+        return 'Invalid or missing exposure type'
+    if 'imgtype' not in req or req['imgtype'] not in ['Bias', 'Dark', 'Flat', 'Object']:
+        return 'Invalid or missing image type.'
+    if req.get('filtype', req.get('filter')) not in FILTER_DICT:
+        return 'Invalid or missing filter type.'
+    if 'comment' not in req:
+        return 'Missing comment.'
+    if req['exptype'] == 'Series' and int(req.get('expnum', 0)) < 1:
+        return 'Invalid or missing number of exposures.'
+    if 'filtype' in req and req.get('filter', req['filtype']) != req['filtype']:
+        return 'Target filter does not match the filter type.'
+    if 'next_filter' in req and req['next_filter'] not in FILTER_DICT:
+        return 'Invalid next filter.'
+    if req.get('compression', 'none') not in ['none', *COMPRESSION_TYPES]:
+        return 'Invalid compression.'
+    if req.get('cube', False) and req.get('compression', 'none') != 'none':
+        return 'Series cubes cannot be compressed.'
+
+    return None
+
+
+def requested_compression(req):
+    '''Returns the compression argument of fits_writer.submit for a capture.'''
+    if 'compression' not in req:
+        return ''  # the writer's default
+    return None if req['compression'] == 'none' else req['compression']
+
+
+def capture(req):
+    '''Takes the capture described by a validated capture request.
+
+    Blocks until the frame has been read out and, unless
+    ``req['wait_for_write']`` is false, written. Used by ``/capture`` and by
+    the sequencer.
+
+    If ``req['filter']`` is given the filter wheel is moved there while the
+    camera is set up, and the exposure starts once it is in position. If
+    ``req['next_filter']`` is given the wheel starts moving there as soon as
+    the exposure has ended, while the frame is read out and written, ahead of
+    the next capture.
 
-    received = (await reader.readline()).decode()
-    writer.close()
-    await writer.wait_closed()
+    Parameters
+    ----------
+    req
+        The capture request, as accepted by `validate_capture`.
 
-    parts = received.split(',')
+    Returns
+    -------
+    payload
+        The reply of ``/capture``.
+
+    '''
 
-    status = parts[0] == 'OK'
+    exptype = req['exptype']
+    if exptype == 'Real Time':
+        req['exptime'] = 1
+    if 'filter' in req:
+        req.setdefault('filtype', req['filter'])
+
+    if camera.snapshot()['acquiring']:
+        return {'message': 'Acquisition already in progress.', 'status': 2}
+
+    filter_moved = start_filter_move(req['filter']) if 'filter' in req else None
+
+    # seconds spent in each phase of the capture, reported with the reply
+    timings = {}
+
+    start_time = time.monotonic()
+    try:
+        settings = camera.call(
+            setup_capture,
+            req['imgtype'],
+            exptype,
+            float(req['exptime']),
+            expnum=int(req.get('expnum', 1)),
+            hbin=req.get('hbin', 1),
+            vbin=req.get('vbin', 1),
+            roi=req.get('roi'),
+            readout=req.get('readout'),
+        )
+    except (RuntimeError, ValueError) as err:
+        return {'message': str(err), 'status': 2}
+    dim = settings['dim']
+    timings['setup'] = time.monotonic() - start_time
 
-    if len(parts) > 1:
-        reply = parts[1]
+    comment = req['comment']
+
+    focus_match = re.match(r'^focus\s*[:=]\s*(-?[0-9\.]+)$', comment)
+    if focus_match is not None:
+        focus = float(focus_match.group(1))
     else:
-        reply = ''
+        focus = ''
+
+    if DEBUGGING:
+        # the simulated sky follows the filter and focus of the capture
+        andor.sky.filter_name = req['filtype']
+        if focus != '':
+            andor.sky.focus = focus
+
+    # the shutter only opens once the wheel is in position
+    filter_wait = 0.0
+    if filter_moved is not None:
+        start_time = time.monotonic()
+        try:
+            filter_moved.result()
+        except FilterWheelError as err:
+            return {'message': f'Filter wheel failed: {err}', 'status': 2}
+        filter_wait = time.monotonic() - start_time
+    timings['filter'] = filter_wait
+
+    if exptype == 'Series':
+        return capture_series(req, settings, focus, timings)
+
+    date_obs = Time.now()
+
+    # resolves as soon as the camera reports the image is ready
+    start_time = time.monotonic()
+    try:
+        acquired = camera.start_acquisition(AcquisitionWait()).result()
+    except RuntimeError as err:
+        # another request started an acquisition since the check above
+        return {'message': str(err), 'status': 2}
+    if acquired['aborted']:
+        return {'message': str('Capture aborted'), 'status': 1}
+    timings['expose'] = time.monotonic() - start_time
+
+    if 'next_filter' in req:
+        start_filter_move(req['next_filter'])
+
+    # read out straight into a uint16 array; no further conversion needed
+    start_time = time.monotonic()
+    try:
+        img = camera.call('getAcquiredData16', dim)
+    except AndorCameraError as err:
+        # the SDK raises, where the dummy returns the status, for a readout
+        # that lost a race with an abort
+        camera.submit('setShutter', 1, 0, 50, 50)
+        return {'message': str(err), 'status': 2}
+    timings['readout'] = time.monotonic() - start_time
+
+    if img['status'] == 20002:
+        # use astropy here to write a fits file
+        camera.submit('setShutter', 1, 0, 50, 50)  # closes shutter
+
+        # reserved only now that there is a frame to write
+        file_name = (
+            f'{DEFAULT_PATH}/temp.fits'
+            if exptype == 'Real Time'
+            else getFilePath(None)
+        )
+        # home_filter() # uncomment if using filter wheel
+        start_time = time.monotonic()
+        header = build_header(
+            req, date_obs, focus, current_temperature()['temperature'], settings
+        )
+        timings['header'] = time.monotonic() - start_time
 
-    return status, reply
+        start_time = time.monotonic()
+        job = fits_writer.submit(
+            file_name, img['data'], header, overwrite=True, compression=requested_compression(req)
+        )
+        if exptype != 'Real Time':
+            release_if_unwritten(job)
+
+        payload = {
+            'filename': os.path.basename(file_name),
+            'url': file_name,
+            'message': 'Capture Successful',
+            'status': 0,
+            'elapsed': acquired['elapsed'],
+            'filter_wait': filter_wait,
+            'timings': timings,
+            'write_id': job.id,
+        }
+
+        # Unless asked not to, reply once the file can be loaded. The
+        # camera is free for the next exposure either way.
+        if not req.get('wait_for_write', True):
+            metrics.observe_capture(req['exptype'], timings)
+            return payload
+
+        try:
+            job.future.result()
+        except Exception as err:
+            return {'message': f'Failed to write: {err}', 'status': 2}
+        # includes any wait for earlier frames queued ahead of this one
+        timings['write'] = time.monotonic() - start_time
+
+        metrics.observe_capture(req['exptype'], timings)
+        return payload
+
+    else:
+        camera.submit('setShutter', 1, 0, 50, 50)
+        # home_filter()  # uncomment if using filter wheel
+        return {'message': str('Capture Unsuccessful'), 'status': 2}
+
+
+def capture_series(req, settings, focus, timings):
+    '''
+    Runs a kinetic series that has been set up by capture.
+
+    ``timings`` holds the seconds spent so far in each phase; those of the
+    series are added and reported with the reply.
+
+    Frames are retrieved as the camera produces them and written by the
+    series writer while the camera keeps exposing, either each to its own
+    file or, if req['cube'] is true, as planes of a single FITS cube.
+    '''
+
+    count = int(req['expnum'])
+    cube = bool(req.get('cube', False))
+
+    # read before starting; the temperature is recorded once for the series
+    header = build_header(
+        req, Time.now(), focus, current_temperature()['temperature'], settings
+    )
+    cycle_time = camera.call('getAcquisitionTimings')['kinetic']
+    if cycle_time <= 0:
+        cycle_time = float(req['exptime'])
+
+    frame_queue = queue.Queue(maxsize=SERIES_QUEUE_SIZE)
+    written = _series_writer.submit(
+        write_series, frame_queue, header, count, cycle_time, cube, requested_compression(req)
+    )
+    start_time = time.monotonic()
+    try:
+        acquired = camera.start_acquisition(
+            SeriesWait(settings['dim'], count, frame_queue)
+        ).result()
+    except RuntimeError as err:
+        # another request started an acquisition since capture checked
+        frame_queue.put(None)
+        written.result()
+        return {'message': str(err), 'status': 2}
+    camera.submit('setShutter', 1, 0, 50, 50)  # closes shutter
+    # frames are retrieved and written while the series is exposing
+    timings['expose'] = time.monotonic() - start_time
+
+    start_time = time.monotonic()
+    file_names = written.result()
+    timings['write'] = time.monotonic() - start_time
+
+    if acquired['aborted']:
+        return {
+            'message': f'Capture aborted after {acquired["frames"]} of {count} frames',
+            'filenames': [os.path.basename(name) for name in file_names],
+            'status': 1,
+        }
+    if acquired['frames'] < count or not file_names:
+        return {
+            'message': f'Only {acquired["frames"]} of {count} frames were acquired',
+            'filenames': [os.path.basename(name) for name in file_names],
+            'status': 2,
+        }
+
+    metrics.observe_capture(req['exptype'], timings)
+    return {
+        'filename': os.path.basename(file_names[-1]),
+        'url': file_names[-1],
+        'filenames': [os.path.basename(name) for name in file_names],
+        'message': 'Capture Successful',
+        'status': 0,
+        'elapsed': acquired['elapsed'],
+        'timings': timings,
+    }
+
+
+# Runs observing plans server-side, one exposure after the other
+sequencer = Sequencer(capture, validate=validate_capture, abort=camera.abort)
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
     CORS(app)
+    # request latencies, and /metrics for Prometheus
+    metrics.install(app)
 
     logging.basicConfig(level=logging.DEBUG)
 
@@ -156,33 +681,73 @@ def create_app(test_config=None):
 
     @app.route('/getStatus')
     def getStatus():
-        return jsonify(andor.getStatus())
+        latest = telemetry.latest()
+        if latest is None:
+            return jsonify(camera.cached('getStatus'))
+        # the actor knows about acquisitions sooner than the next sample does
+        status = DRV_ACQUIRING if camera.snapshot()['acquiring'] else latest['status']
+        return jsonify({
+            'status': status,
+            'funcstatus': latest['funcstatus'],
+            'age': latest['age'],
+        })
+
+    @app.route('/readoutModes')
+    def route_readoutModes():
+        '''
+        Lists the readout speeds and pre-amp gains a capture's ``readout``
+        may select, as indices into these lists.
+        '''
+        try:
+            return jsonify(camera.call(readoutModes))
+        except Exception as err:
+            return jsonify({'message': str(err), 'status': 2})
 
     @app.route('/')
     def index():
-        tempData = andor.getStatusTEC()['temperature']
+        tempData = current_temperature()['temperature']
         return render_template('index.html', tempData=tempData)
 
     @app.route('/initialize')
     def route_initialize():
-        status = startup()
-        activateCooling()  # make this a part of a separate route later
+        status = camera.call(startup)
+        camera.call(activateCooling)  # make this a part of a separate route later
         return status
 
     @app.route('/shutdown')
     def route_shutdown():
-        deactivateCooling()  # same here
-        while not DEBUGGING and andor.getStatusTEC()['temperature'] < -10:
-            print('waiting to warm: ', andor.getStatusTEC()['temperature'])
+        camera.call(deactivateCooling)  # same here
+        while not DEBUGGING and (temperature := camera.call('getStatusTEC')['temperature']) < -10:
+            print('waiting to warm: ', temperature)
             time.sleep(5)
         # We assume the fan should always be on. Testing to turn it off did not work.
-        status = andor.shutdown()
+        status = camera.call('shutdown')
         return {'status': status}
 
     @app.route('/getTemperature')
     def route_getTemperature():
-        print(andor.getStatusTEC())
-        return jsonify(andor.getStatusTEC())
+        return jsonify(current_temperature())
+
+    @app.route('/getTemperatureHistory')
+    def route_getTemperatureHistory():
+        '''
+        Returns the sampled TEC temperature history, downsampled into at most
+        `buckets` equal time intervals, and no more than there are samples,
+        with the min, max and mean temperature of each. The window is given either as `start` and `end` Unix times or
+        as the last `window` seconds.
+        '''
+
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+        window = request.args.get('window', type=float)
+        buckets = request.args.get('buckets', 200, type=int)
+
+        if window is not None:
+            start = time.time() - window
+        if buckets < 1:
+            return jsonify({'error': 'buckets must be positive.'}), 400
+
+        return jsonify(telemetry.downsample(start, end, buckets=buckets))
 
     @app.route('/setTemperature', methods=['POST'])
     def route_setTemperature():
@@ -190,7 +755,7 @@ def create_app(test_config=None):
             req = request.get_json(force=True)
 
             try:
-                valid_range: dict = andor.getRangeTEC()
+                valid_range: dict = camera.cached('getRangeTEC')
                 req_temperature = int(req['temperature'])
                 if req_temperature < valid_range['min'] or req_temperature > valid_range['max']:
                     app.logger.info(
@@ -198,7 +763,7 @@ def create_app(test_config=None):
                     )
                     return str(-999)  # indicates tempreature was out of range
                 app.logger.info(f'Setting temperature to: {req_temperature:.2f} [C]')
-                andor.setTargetTEC(req_temperature)
+                camera.call('setTargetTEC', req_temperature)
             except ValueError:
                 app.logger.info(
                     'Post request received a parameter of invalid type (must be int)'
@@ -208,7 +773,7 @@ def create_app(test_config=None):
 
     @app.route('/testLongExposure')
     def route_testLongExposure():
-        acquisition((1024, 1024), exposure_time=10)
+        camera.call(acquisition, (1024, 1024), exposure_time=10)
         return str('Finished Acquiring after 10s')
     
     @app.route('/getFocus')
@@ -220,7 +785,7 @@ def create_app(test_config=None):
         return jsonify({'message':'Not implemented'})
     
     @app.route("/capture", methods=["POST"])
-    async def route_capture():
+    def route_capture():
         '''
         Attempts to take a picture with the camera. Uses the 'POST' method
         to take in form requests from the front end.
@@ -229,191 +794,161 @@ def create_app(test_config=None):
         JS9's display.
         filename, url, message, status
         status: 0 - success, 1 - aborted, 2 - failed
-        '''
-
-        global ABORT_FLAG
 
-        ABORT_FLAG = False
+        Optional fields: 'hbin', 'vbin' and 'roi' select binning and a region
+        of interest; 'readout' is 'fast', 'slow' or a dict of indices from
+        /readoutModes, and defaults to 'fast' for Real Time and 'slow' otherwise.
+        'filter' moves the wheel there before the exposure, and 'next_filter'
+        starts moving it on once the exposure has ended. 'trace' adds the SDK
+        calls made during the capture to the reply, as 'sdk_trace'.
+        'compression' is 'rice', 'hcompress' or 'none', and defaults to
+        EVORA_FITS_COMPRESSION; see /writerStatus for the ratio achieved.
+        '''
 
         if request.method == 'POST':
             req = request.get_json(force=True)
             req = json.loads(req)
 
-            # validate parameters
-            if 'exptime' not in req or 3600 < float(req['exptime']) <= 0:
-                return {'message': 'Invalid or missing exposure time.', 'status': 2}
-            if 'exptype' not in req or req['exptype'] not in ['Single', 'Real Time', 'Series']:
-                return {'message': 'Invalid or missing exposure type', 'status': 2}
-            if 'imgtype' not in req or req['imgtype'] not in ['Bias', 'Dark', 'Flat', 'Object']:
-                return {'message': 'Invalid or missing image type.', 'status': 2}
-            if 'filtype' not in req or req['filtype'] not in FILTER_DICT:
-                return {'message': 'Invalid or missing filter type.', 'status': 2}
-            if 'comment' not in req:
-                return {'message': 'Missing comment.', 'status': 2}
-            
-
-            dim = andor.getDetector()['dimensions']
-
-            # check if acquisition is already in progress
-            status = andor.getStatus()
-            if status['status'] == 20072:
-                return {'message': 'Acquisition already in progress.', 'status': 2}
-
-            # handle img type
-            if req['imgtype'] == 'Bias' or req['imgtype'] == 'Dark':
-                # Keep shutter closed during biases and darks
-                andor.setShutter(1, 2, 50, 50)
-                andor.setImage(1, 1, 1, dim[0], 1, dim[1])
-            else:
-                andor.setShutter(1, 0, 50, 50)
-                andor.setImage(1, 1, 1, dim[0], 1, dim[1])
-
-            # handle exposure type
-            # refer to pg 41 - 45 of sdk for acquisition mode info
-            exptype = req['exptype']
-            if exptype == 'Single':
-                andor.setAcquisitionMode(1)
-                andor.setExposureTime(float(req['exptime']))
-
-            elif exptype == 'Real Time':
-                # this uses 'run till abort' mode - how do we abort it?
-                andor.setAcquisitionMode(1)
-                andor.setExposureTime(1)
-                # andor.setKineticCycleTime(0)
-                req['exptime'] = 1
-
-            elif exptype == 'Series':
-                andor.setAcquisitionMode(3)
-                andor.setNumberKinetics(int(req['expnum']))
-                andor.setExposureTime(float(req['exptime']))
-
-            file_name = (
-                f'{DEFAULT_PATH}/temp.fits'
-                if exptype == 'Real Time'
-                else getFilePath(None)
-            )
-
-            date_obs = Time.now()
-
-            andor.startAcquisition()
-            status = andor.getStatus()
-            # todo: review parallelism, threading behavior is what we want?
-            # while status == 20072:
-            #     status = andor.getStatus()
-            #     app.logger.info('Acquisition in progress')
-
-            start_time = datetime.now()
-
-            while (datetime.now() - start_time).total_seconds() < float(req["exptime"]):
-                if ABORT_FLAG:
-                    andor.abortAcquisition()
-                    return {'message': str('Capture aborted'), 'status': 1}
-                await asyncio.sleep(0.1)
-
-            # An additional delay because the camera may not have totally finished
-            # acquiring after exptime.
-            await asyncio.sleep(0.5)
-            
-            img = andor.getAcquiredData(
-                dim
-            )  # TODO: throws an error here! gotta wait for acquisition
-
-            comment = req['comment']
-
-            focus_match = re.match(r'^focus\s*[:=]\s*(-?[0-9\.]+)$', comment)
-            if focus_match is not None:
-                focus = float(focus_match.group(1))
-            else:
-                focus = ''
-
-            if img['status'] == 20002:
-                # use astropy here to write a fits file
-                andor.setShutter(1, 0, 50, 50)  # closes shutter
-                # home_filter() # uncomment if using filter wheel
-                hdu = fits.PrimaryHDU(img['data'].astype(numpy.uint16))
-                hdu.header['DATE-OBS'] = date_obs.isot
-                hdu.header['COMMENT'] = comment
-                hdu.header['INSTRUME'] = 'iKon-M 934 CCD DU934P-BEX2-DD'
-                hdu.header['XBINNING'] = '1'
-                hdu.header['YBINNING'] = '1'
-                hdu.header['XPIXSZ'] = '13'
-                hdu.header['YPIXSZ'] = '13'
-                hdu.header['FOCALLEN'] = '5766'
-
-                hdu.header['EXPTIME'] = (
-                    float(req['exptime']),
-                    'Exposure Time (Seconds)',
-                )
-                hdu.header['EXP_TYPE'] = (
-                    str(req['exptype']),
-                    'Exposure Type (Single, Real Time, or Series)',
-                )
-                hdu.header['IMAGETYP'] = (
-                    str(req['imgtype']),
-                    'Image Type (Bias, Flat, Dark, or Object)',
-                )
-                hdu.header['FILTER'] = (str(req['filtype']), 'Filter (Ha, B, V, g, r)')
-                hdu.header['CCD-TEMP'] = (
-                    str(f'{andor.getStatusTEC()["temperature"]:.3f}'),
-                    'CCD Temperature during Exposure',
-                )
-                hdu.header['FOCUS'] = (
-                    focus,
-                    'Relative focus position [microns]'
-                )
-                try:
-                    hdu.writeto(file_name, overwrite=True)
-                except:
-                    print('Failed to write')
-
-                return {
-                    'filename': os.path.basename(file_name),
-                    'url': file_name,
-                    'message': 'Capture Successful',
-                    'status': 0
-                }
-
-            else:
-                andor.setShutter(1, 0, 50, 50)
-                # home_filter()  # uncomment if using filter wheel
-                return {'message': str('Capture Unsuccessful'), 'status': 2}
+            error = validate_capture(req)
+            if error is not None:
+                return {'message': error, 'status': 2}
+
+            if sequencer.running:
+                return {'message': 'A sequence is in progress.', 'status': 2}
+
+            if not req.get('trace', False):
+                return capture(req)
+
+            with instrumentation.trace() as sdk_trace:
+                reply = capture(req)
+            reply['sdk_trace'] = sdk_trace.serialize()
+            return reply
+
+    @app.route('/sdkStats')
+    def route_sdk_stats():
+        '''
+        Returns the count, latency and non-success codes of each SDK function
+        called so far, and the latest calls with their arguments.
+        '''
+        recent = request.args.get('recent', instrumentation.RECENT_CALLS, type=int)
+        stats = instrumentation.stats(recent)
+        stats['backend'] = 'dummy' if DEBUGGING else 'andor'
+        return jsonify(stats)
+
+    @app.route('/resetSdkStats')
+    def route_reset_sdk_stats():
+        instrumentation.reset()
+        return jsonify({'message': 'SDK statistics reset', 'status': 0})
+
+    @app.route('/writerStatus')
+    def route_writer_status():
+        '''
+        Returns the status of the FITS writer and its recent jobs, or of a
+        single job if an id is given.
+        '''
+
+        job_id = request.args.get('id', type=int)
+        if job_id is None:
+            return jsonify(fits_writer.status())
+
+        status = fits_writer.status(job_id)
+        if status is None:
+            return jsonify({'error': f'Unknown write id {job_id}.'}), 404
+        return jsonify(status)
+
+    @app.route('/sequence', methods=['POST'])
+    def route_sequence():
+        '''
+        Starts running a plan, a list of steps each with a 'filter',
+        'imgtype', 'exptime', 'count' and optionally 'binning', 'roi',
+        'readout' and 'comment'. Progress is reported by /sequenceStatus.
+        '''
+
+        plan = request.get_json(force=True)
+        if isinstance(plan, dict):
+            plan = plan.get('steps')
+
+        if camera.snapshot()['acquiring']:
+            return {'message': 'Acquisition already in progress.', 'status': 2}
+        try:
+            sequencer.submit(plan)
+        except (RuntimeError, ValueError) as err:
+            return {'message': str(err), 'status': 2}
+
+        return {'message': 'Sequence started', 'status': 0, **sequencer.status_report()}
+
+    @app.route('/sequenceStatus')
+    def route_sequence_status():
+        '''Returns the progress and timing of the plan and of each step.'''
+        return jsonify(sequencer.status_report())
+
+    @app.route('/pauseSequence')
+    def route_pause_sequence():
+        '''Pauses the plan once the current exposure has finished.'''
+        if not sequencer.pause():
+            return {'message': 'No sequence is running.', 'status': 2}
+        return {'message': 'Pausing sequence', 'status': 0}
+
+    @app.route('/resumeSequence')
+    def route_resume_sequence():
+        if not sequencer.resume():
+            return {'message': 'No sequence is paused.', 'status': 2}
+        return {'message': 'Resuming sequence', 'status': 0}
+
+    @app.route('/abortSequence')
+    def route_abort_sequence():
+        '''Stops the plan, aborting the exposure in progress.'''
+        if not sequencer.abort():
+            return {'message': 'No sequence is running.', 'status': 2}
+        return {'message': 'Aborting sequence', 'status': 0}
+
+    @app.route('/reorderSequence', methods=['POST'])
+    def route_reorder_sequence():
+        '''Reorders the steps that have not started, given their ids in order.'''
+        req = request.get_json(force=True)
+        try:
+            sequencer.reorder(req['order'])
+        except (KeyError, TypeError, ValueError) as err:
+            return {'message': f'Invalid order: {err}', 'status': 2}
+        return {'message': 'Sequence reordered', 'status': 0, **sequencer.status_report()}
 
     @app.route('/abort')
     async def route_abort_capture():
         '''Abort exposure.'''
 
-        global ABORT_FLAG
-
-        ABORT_FLAG = True
+        camera.abort()
 
         return {'message': 'Aborting exposure'}
 
     @app.route('/getFilterWheel')
-    async def route_get_filter_wheel():
-        '''Returns the position of the filter wheel.'''
-        if DEBUGGING:
-            return jsonify({'success': True, 'filter': FILTER_DICT_REVERSE[DUMMY_FILTER_POSITION], 'error': ''})
+    def route_get_filter_wheel():
+        '''
+        Returns the position of the filter wheel, as last known unless
+        'refresh' is given.
+        '''
 
-        status, reply = await send_to_wheel('get')
+        refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
         filter_name = None
         error = ''
 
-        if status:
+        try:
+            filter_name = FILTER_DICT_REVERSE[filter_wheel.get_position(refresh=refresh)]
             success = True
-            filter_pos = int(reply)
-            filter_name = FILTER_DICT_REVERSE[filter_pos]
-        else:
+        except (FilterWheelError, KeyError) as err:
             success = False
-            error = reply
+            error = str(err)
 
-        return jsonify({'success': success, 'filter': filter_name, 'error': error})
+        return jsonify({
+            'success': success,
+            'filter': filter_name,
+            'moving': filter_wheel.moving,
+            'error': error,
+        })
 
     @app.route('/setFilterWheel', methods=['POST'])
-    async def route_set_filter_wheel():
+    def route_set_filter_wheel():
         '''Moves the filter wheel to a given position by filter name.'''
 
-        global DUMMY_FILTER_POSITION
-
         payload = dict(
             message='',
             success=False,
@@ -435,63 +970,72 @@ def create_app(test_config=None):
             payload['error'] = f'Unknown filter {filter}.'
             return jsonify(payload)
 
-        filter_num = FILTER_DICT[filter]
-
-        if DEBUGGING:
-            await asyncio.sleep(2)
-            DUMMY_FILTER_POSITION = filter_num
-            payload['success'] = True
+        try:
+            filter_wheel.move(FILTER_DICT[filter])
+        except FilterWheelError as err:
+            payload['error'] = str(err)
             return jsonify(payload)
 
-        status, reply = await send_to_wheel(f'move {filter_num}')
-
-        payload['success'] = status
-        if status:
-            payload['message'] = f'Filter wheel moved to filter {filter}.'
-        else:
-            payload['error'] = reply
-
+        payload['success'] = True
+        payload['message'] = f'Filter wheel moved to filter {filter}.'
         return jsonify(payload)
 
     @app.route('/homeFilterWheel')
-    async def route_home_filter_wheel():
+    def route_home_filter_wheel():
         '''Homes the filter wheel.'''
 
-        global DUMMY_FILTER_POSITION
-
-        if DEBUGGING:
-            await asyncio.sleep(2)
-            DUMMY_FILTER_POSITION = 0
-            return dict(message='', success=True, error='')
-
         payload = dict(
             message='',
             success=False,
             error='',
         )
 
-        status, reply = await send_to_wheel('home')
-        payload['success'] = status
-        if status:
-            payload['message'] = 'Filter wheel has been homed.'
-        else:
-            payload['error'] = reply
-        print(payload)
+        try:
+            filter_wheel.home()
+        except FilterWheelError as err:
+            payload['error'] = str(err)
+            return jsonify(payload)
+
+        payload['success'] = True
+        payload['message'] = 'Filter wheel has been homed.'
         return jsonify(payload)
-    
+
     @app.route('/getWeatherData')
     def route_get_weather_data():
-        devices = api.get_devices()
-        device = devices[0]
-        time.sleep(1)
-        data = device.last_data
-        return data
+        '''
+        Returns the last reading of the weather station, with its 'age' in
+        seconds and whether it is 'stale'.
+        '''
+        latest = weather.latest()
+        if latest['data'] is None:
+            return jsonify({'error': latest['error'] or 'No weather data yet.'}), 503
+        return jsonify({
+            **latest['data'],
+            'age': latest['age'],
+            'stale': latest['stale'],
+            'error': latest['error'],
+        })
+
+    @app.route('/getWeatherHistory')
+    def route_get_weather_history():
+        '''
+        Returns the weather readings between 'start' and 'end' (Unix times),
+        optionally only the comma-separated 'fields'.
+        '''
+        fields = request.args.get('fields')
+        return jsonify(weather.history(
+            start=request.args.get('start', type=float),
+            end=request.args.get('end', type=float),
+            fields=fields.split(',') if fields else None,
+        ))
 
     return app
 
 
 def OnExitApp():
-    andor.shutdown()
+    fits_writer.join()
+    filter_wheel.close()
+    camera.call('shutdown')
 
 
 atexit.register(OnExitApp)
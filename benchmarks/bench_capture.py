@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+'''
+Measures end-to-end capture throughput by driving the Flask app through its
+test client, against the dummy camera unless --hardware is given.
+
+Each scenario runs in its own process and reports frames per second, the
+latency of each capture phase (setup, filter, expose, readout, header,
+write) and the peak RSS of its process. Results can be saved as JSON and
+compared with an earlier run:
+
+    python benchmarks/bench_capture.py --output before.json
+    python benchmarks/bench_capture.py --compare before.json
+
+Files are written to a temporary directory, which is removed afterwards.
+'''
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ['single', 'bias', 'series', 'cube', 'realtime']
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def capture(client, **req):
+    req.setdefault('filtype', 'r')
+    req.setdefault('comment', '')
+    # /capture expects a JSON encoded string as its body
+    reply = client.post('/capture', json=json.dumps(req)).get_json()
+    if reply['status'] != 0:
+        raise RuntimeError(f'Capture failed: {reply["message"]}')
+    return reply
+
+
+def run_scenario(client, name, frames, exptime):
+    if name == 'single':
+        requests = [dict(exptype='Single', imgtype='Object', exptime=exptime)] * frames
+    elif name == 'bias':
+        requests = [dict(exptype='Single', imgtype='Bias', exptime=0)] * frames
+    elif name == 'series':
+        requests = [dict(exptype='Series', imgtype='Object', exptime=exptime, expnum=frames)]
+    elif name == 'cube':
+        requests = [dict(exptype='Series', imgtype='Object', exptime=exptime, expnum=frames, cube=True)]
+    elif name == 'realtime':
+        # Real Time frames always expose for 1 s
+        requests = [dict(exptype='Real Time', imgtype='Object', exptime=1)] * frames
+
+    timings = []
+    start_time = time.perf_counter()
+    for req in requests:
+        timings.append(capture(client, **req)['timings'])
+    seconds = time.perf_counter() - start_time
+
+    phases = {}
+    for phase in sorted({phase for timing in timings for phase in timing}):
+        values = numpy.array([timing[phase] for timing in timings if phase in timing])
+        phases[phase] = {
+            'mean': float(values.mean()),
+            'median': float(numpy.median(values)),
+            'p95': float(numpy.percentile(values, 95)),
+            'max': float(values.max()),
+        }
+
+    return {
+        'frames': frames,
+        'exptime': 1 if name == 'realtime' else (0 if name == 'bias' else exptime),
+        'seconds': seconds,
+        'fps': frames / seconds,
+        'phases': phases,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def print_results(results, baseline=None):
+    for name, result in results['scenarios'].items():
+        base = (baseline or {}).get('scenarios', {}).get(name)
+        line = f'{name:>9}: {result["fps"]:7.2f} frames/s  peak RSS {result["peak_rss_mb"]:7.1f} MB'
+        if base:
+            line += f'  ({result["fps"] / base["fps"] - 1:+.1%} frames/s vs baseline)'
+        print(line)
+
+        for phase, stats in result['phases'].items():
+            line = (
+                f'{"":>11}{phase:<8} median {stats["median"] * 1e3:8.2f} ms'
+                f'  p95 {stats["p95"] * 1e3:8.2f} ms  max {stats["max"] * 1e3:8.2f} ms'
+            )
+            base_stats = (base or {}).get('phases', {}).get(phase)
+            if base_stats and base_stats['median'] > 0:
+                line += f'  ({stats["median"] / base_stats["median"] - 1:+.1%} median)'
+            print(line)
+
+
+def run_worker(name, frames, exptime):
+    '''Runs one scenario against a fresh app, as the only one of this process.'''
+
+    # the app writes to ./data/ecam when debugging
+    workdir = tempfile.mkdtemp(prefix='evora-bench-')
+    os.chdir(workdir)
+    try:
+        import app  # noqa: E402
+
+        logging.getLogger().setLevel(logging.WARNING)
+        client = app.app.test_client()
+        client.get('/initialize')
+
+        # one unmeasured capture to warm up imports and caches
+        capture(client, exptype='Single', imgtype='Object', exptime=exptime)
+
+        result = run_scenario(client, name, frames, exptime)
+        app.fits_writer.join()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def spawn_worker(name, frames, args):
+    # ru_maxrss is the high-water mark of a whole process, so each scenario
+    # runs in a process of its own for its peak to be its own
+    command = [
+        sys.executable, os.path.abspath(__file__), '--worker', name,
+        '--frames', str(frames), '--exptime', str(args.exptime),
+    ]
+    if args.hardware:
+        command.append('--hardware')
+    process = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'Scenario {name} failed with exit code {process.returncode}')
+    # the result is the last line, after anything the app printed
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--frames', type=int, default=20, help='frames per scenario')
+    parser.add_argument('--realtime-frames', type=int, default=3)
+    parser.add_argument('--exptime', type=float, default=0.1)
+    parser.add_argument('--output', help='save the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--hardware', action='store_true', help='use the real camera')
+    parser.add_argument('--worker', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ['EVORA_DEBUG'] = '0' if args.hardware else '1'
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.frames, args.exptime)))
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    results = {
+        'commit': git_commit(),
+        'time': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'hardware': args.hardware,
+        'scenarios': {},
+    }
+    for name in args.scenarios:
+        frames = args.realtime_frames if name == 'realtime' else args.frames
+        results['scenarios'][name] = spawn_worker(name, frames, args)
+
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''
+Compares the cost of picking the next ecam-NNNN.fits name as a night's
+directory grows, between the previous glob + sort of the directory and
+SequenceAllocator.
+
+Run from the root of the repository:
+
+    python benchmarks/bench_sequence_allocator.py
+'''
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from glob import glob
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sequence_allocator import SequenceAllocator  # noqa: E402
+
+
+def glob_next_name(path):
+    '''The name selection getFilePath used to do on every capture.'''
+    all_files = list(sorted(glob(os.path.join(path, 'ecam-*.fits'))))
+    if len(all_files) == 0:
+        seq = 1
+    else:
+        match = re.search(r'ecam\-([0-9]+)', all_files[-1])
+        seq = int(match.group(1)) + 1 if match else 1
+    file_path = os.path.join(path, f'ecam-{seq:04d}.fits')
+    open(file_path, 'a').close()
+    return file_path
+
+
+def time_per_call(func, path, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func(path)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 100, 1000, 5000, 20000])
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f'{"files":>8} {"glob + sort [ms]":>18} {"allocator [ms]":>16}')
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as glob_dir, tempfile.TemporaryDirectory() as alloc_dir:
+            for directory in (glob_dir, alloc_dir):
+                for seq in range(1, size + 1):
+                    open(os.path.join(directory, f'ecam-{seq:04d}.fits'), 'w').close()
+
+            glob_time = time_per_call(glob_next_name, glob_dir, args.calls)
+
+            allocator = SequenceAllocator()
+            allocator.reserve(alloc_dir)  # the one-off scan at startup
+            alloc_time = time_per_call(allocator.reserve, alloc_dir, args.calls)
+
+        print(f'{size:>8} {glob_time * 1e3:>18.3f} {alloc_time * 1e3:>16.3f}')
+
+
+if __name__ == '__main__':
+    main()
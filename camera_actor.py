@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+# Command priorities, lower runs first. Commands of equal priority run in the
+# order they were submitted.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Results of these calls are kept so they can be answered from memory
+CACHED_CALLS = ['getStatus', 'getStatusTEC', 'getDetector', 'getRangeTEC']
+
+
+class CameraActor:
+    '''Owns the camera and runs every SDK call on a single thread.
+
+    The Andor SDK is not re-entrant, so instead of calling ``andor`` from
+    request threads, calls are submitted to the actor as commands and run one
+    at a time on its thread. Each submission returns a
+    `concurrent.futures.Future` for its result.
+
+    While an acquisition is in progress the actor alternates between running
+    queued commands and polling the acquisition, so status reads and aborts
+    are not held up by a long exposure. Aborts are submitted with
+    ``PRIORITY_HIGH`` and jump ahead of other queued commands.
+
+    Parameters
+    ----------
+    andor
+        The camera module, `evora.andor` or `evora.dummy.Dummy`.
+    on_call
+        Optional ``on_call(name, seconds, error)`` called after each command
+        with its duration and the exception it raised, if any, to collect
+        metrics.
+
+    '''
+
+    def __init__(self, andor, on_call=None):
+        self.andor = andor
+        self.on_call = on_call
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._acquisition = None
+
+        self._state = {}
+        self._state_lock = threading.Lock()
+        # the queued call of each cached read, shared by everyone waiting on it
+        self._pending_reads = {}
+
+        self._thread = threading.Thread(target=self._run, name='camera-actor', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, priority=PRIORITY_NORMAL, **kwargs):
+        '''Queues a call to run on the camera thread.
+
+        Parameters
+        ----------
+        func
+            The name of an ``andor`` function, or a callable such as one of
+            the routines in `andor_routines`, which may use ``andor`` freely
+            since it runs on the camera thread.
+        args, kwargs
+            The arguments of the call.
+        priority
+            One of ``PRIORITY_HIGH``, ``PRIORITY_NORMAL`` or ``PRIORITY_LOW``.
+
+        Returns
+        -------
+        future
+            A `concurrent.futures.Future` resolving to the return value of the
+            call, or raising its exception.
+
+        '''
+
+        future = Future()
+        self._queue.put((priority, next(self._sequence), future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, priority=PRIORITY_NORMAL, **kwargs):
+        '''Runs a call on the camera thread and blocks until it returns.'''
+        return self.submit(func, *args, priority=priority, **kwargs).result()
+
+    async def run(self, func, *args, priority=PRIORITY_NORMAL, **kwargs):
+        '''Runs a call on the camera thread and awaits its result.'''
+        future = self.submit(func, *args, priority=priority, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    def cached(self, name, timeout=0.5):
+        '''Returns a fresh result of a cheap read, or the last one if busy.
+
+        Parameters
+        ----------
+        name
+            One of ``CACHED_CALLS``.
+        timeout
+            Seconds to wait for the camera thread before falling back to the
+            last known result.
+
+        While a read is queued behind a long call, such as a readout, later
+        reads of the same name wait on it rather than queueing another.
+
+        '''
+
+        with self._state_lock:
+            future = self._pending_reads.get(name)
+            if future is None or future.done():
+                future = self._pending_reads[name] = self.submit(name)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            with self._state_lock:
+                if name in self._state:
+                    return self._state[name]['value']
+            return future.result()
+
+    def snapshot(self):
+        '''Returns the last known camera state without touching the camera.'''
+
+        with self._state_lock:
+            state = {name: dict(entry) for name, entry in self._state.items()}
+        state['acquiring'] = self._acquisition is not None
+        return state
+
+    def start_acquisition(self, wait, priority=PRIORITY_NORMAL):
+        '''Starts an acquisition and polls it on the camera thread.
+
+        Parameters
+        ----------
+        wait
+            An `andor_routines.AcquisitionWait` (or subclass) that decides
+            when the acquisition has completed.
+
+        Returns
+        -------
+        future
+            ``wait.future``, resolving once the acquisition has completed or
+            has been aborted.
+
+        '''
+
+        def begin():
+            if self._acquisition is not None:
+                raise RuntimeError('Acquisition already in progress.')
+            self.andor.startAcquisition()
+            wait.started()
+            self._acquisition = wait
+
+        def check_started(started):
+            if started.exception() is not None:
+                wait.future.set_exception(started.exception())
+
+        self.submit(begin, priority=priority).add_done_callback(check_started)
+        return wait.future
+
+    def abort(self):
+        '''Aborts the acquisition in progress, ahead of any queued command.'''
+
+        def abort_acquisition():
+            if self._acquisition is None:
+                return False
+            acquisition, self._acquisition = self._acquisition, None
+            acquisition.abort()
+            return True
+
+        return self.submit(abort_acquisition, priority=PRIORITY_HIGH)
+
+    def _run(self):
+        while True:
+            if self._acquisition is None:
+                command = self._queue.get()
+            else:
+                try:
+                    command = self._queue.get_nowait()
+                except queue.Empty:
+                    self._poll_acquisition()
+                    continue
+            self._execute(*command)
+
+    def _poll_acquisition(self):
+        try:
+            done = self._acquisition.poll()
+        except Exception as err:
+            logging.exception('Acquisition failed')
+            self._acquisition.fail(err)
+            done = True
+
+        if done:
+            self._acquisition = None
+
+    def _execute(self, priority, sequence, future, func, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        start_time = time.perf_counter()
+        try:
+            if callable(func):
+                result = func(*args, **kwargs)
+            else:
+                result = getattr(self.andor, func)(*args, **kwargs)
+        except Exception as err:
+            self._observe(func, start_time, err)
+            future.set_exception(err)
+            return
+        self._observe(func, start_time)
+
+        if func in CACHED_CALLS:
+            with self._state_lock:
+                self._state[func] = {'value': result, 'time': time.time()}
+
+        future.set_result(result)
+
+    def _observe(self, func, start_time, error=None):
+        if self.on_call is not None:
+            name = getattr(func, '__name__', repr(func)) if callable(func) else func
+            self.on_call(name, time.perf_counter() - start_time, error)
@@ -1,6 +1,8 @@
 # import andor_wrapper as wrapper
 import evora.andor_wrapper as wrapper
-from evora._error_codes import ERROR_CODES
+from evora import instrumentation
+from evora._error_codes import AndorCameraError
+from evora.debug import RECORD
 
 # from error_codes import ERROR_CODES
 # this wrapper layer adds in error cases only
@@ -14,26 +16,31 @@ EXCLUDE = [
     "__spec__",
     "getStatus",
     "getRangeTEC",
+    "waitForAcquisitionTimeOut",
+    "getNumberNewImages",
 ]
 
 RETURNS_DICT = [
     "getDetector",
     "getAcquiredData",
+    "getAcquiredData16",
+    "getMostRecentImage16",
+    "getImages16",
+    "getTotalNumberImagesAcquired",
     "getStatusTEC",
     "getAcquisitionTimings",
+    "getNumberADChannels",
+    "getNumberHSSpeeds",
+    "getHSSpeed",
+    "getNumberVSSpeeds",
+    "getVSSpeed",
+    "getFastestRecommendedVSSpeed",
+    "getNumberPreAmpGains",
+    "getPreAmpGain",
+    "isPreAmpGainAvailable",
 ]
 
 
-class AndorCameraError(Exception):
-    def __init__(self, error_code):
-        self.error_code = error_code
-        super().__init__(ERROR_CODES[self.error_code])
-
-    def __str__(self):
-        error_info = ERROR_CODES[self.error_code]
-        return f"({self.error_code}) {error_info[0]}. {error_info[1]}"
-
-
 def errorDecorator(pybind11_func):
     def wrapped_function(*args, **kwargs):
         error_code = pybind11_func(*args, **kwargs)
@@ -56,15 +63,30 @@ def errorDecoratorDict(pybind11_func):
     return wrapped_function
 
 
+def instrumented(name):
+    # every call is timed and its status code counted, see evora.instrumentation
+    return instrumentation.instrument(name, getattr(wrapper, name))
+
+
 # iterate through the roster of andor_wrapper
 for exposedName in dir(wrapper):
     if exposedName not in EXCLUDE:
         if exposedName in RETURNS_DICT:
-            globals()[exposedName] = errorDecoratorDict(getattr(wrapper, exposedName))
+            globals()[exposedName] = errorDecoratorDict(instrumented(exposedName))
         else:
-            globals()[exposedName] = errorDecorator(getattr(wrapper, exposedName))
+            globals()[exposedName] = errorDecorator(instrumented(exposedName))
 
 # edge cases
-globals()["getStatus"] = getattr(wrapper, "getStatus")
-globals()["getStatusTEC"] = getattr(wrapper, "getStatusTEC")
-globals()["getRangeTEC"] = getattr(wrapper, "getRangeTEC")
+globals()["getStatus"] = instrumented("getStatus")
+globals()["getStatusTEC"] = instrumented("getStatusTEC")
+globals()["getRangeTEC"] = instrumented("getRangeTEC")
+# returns DRV_NO_NEW_DATA when the timeout elapses, which is not an error
+globals()["waitForAcquisitionTimeOut"] = instrumented("waitForAcquisitionTimeOut")
+# returns DRV_NO_NEW_DATA when every image has already been retrieved
+globals()["getNumberNewImages"] = instrumented("getNumberNewImages")
+
+# EVORA_RECORD=<file> records every call, to be replayed offline (see evora.replay)
+if RECORD:
+    from evora.replay import Recorder
+
+    recorder = Recorder(RECORD)
@@ -5,21 +5,52 @@
 
 namespace py = pybind11;
 
-// GetAcquiredData originally modifies an array of long (at_32) to acquire the imaging data.
-// helper func. below to convert it into a returned value, in matrix form.
-//
-std::vector<std::vector<at_32>> reshapeImageData(at_32* imageData, int imageWidth, int imageHeight) {
-	auto out = std::vector<std::vector<at_32>>();
-	for (auto row = 0; row < imageHeight; row++) {
-		out.push_back(std::vector<at_32>(imageWidth));
-	}
-	for (auto row = 0; row < imageHeight; row++) {
-		for (auto col = 0; col < imageWidth; col++) {
-			out[row][col] = imageData[row * imageWidth + col];
+// The readout functions fill a flat buffer of pixels. frameBuffer returns the
+// C-contiguous NumPy array the SDK should write into, so a frame lands in its final
+// Python object without any intermediate copy. If the caller supplies `out` it is
+// validated and filled in place, which lets frames be read into a reusable pool of
+// buffers; otherwise a new array of the given shape is allocated.
+template <typename T>
+py::array_t<T, py::array::c_style> frameBuffer(py::object& out, std::vector<py::ssize_t> shape) {
+	py::ssize_t size = 1;
+	for (auto extent : shape) {
+		if (extent <= 0) {
+			throw py::value_error("Image dimensions must be positive");
 		}
+		size *= extent;
+	}
+
+	if (out.is_none()) {
+		return py::array_t<T, py::array::c_style>(shape);
+	}
+	if (!py::isinstance<py::array_t<T, py::array::c_style>>(out)) {
+		throw py::type_error("out must be a C-contiguous array of the readout dtype");
+	}
+	auto buffer = out.cast<py::array_t<T, py::array::c_style>>();
+	if (buffer.size() != size) {
+		throw py::value_error("out does not match the image dimensions");
+	}
+	return buffer;
+}
+
+template <typename T, typename ReadoutFunc>
+py::dict readFrame(ReadoutFunc readout, py::tuple& dim, py::object& out) {
+	int imageWidth = dim[0].cast<int>();
+	int imageHeight = dim[1].cast<int>();
+	auto imageData = frameBuffer<T>(out, {imageHeight, imageWidth});
+
+	T* buffer = imageData.mutable_data();
+	unsigned int status;
+	{
+		py::gil_scoped_release release;
+		status = readout(buffer, imageWidth * imageHeight);
 	}
 
-	return out;
+	py::dict result;
+	result["data"] = imageData;
+	result["status"] = status;
+
+	return result;
 }
 
 
@@ -82,27 +113,93 @@ PYBIND11_MODULE(andor_wrapper, m) {
     m.def("setShutter", 		&SetShutter,		    "Initialize camera shutter");
     m.def("setImage",   		&SetImage,		        "Set image dimensions");
     m.def("startAcquisition",	&StartAcquisition,	    "Acquire CCD data");
-    m.def("waitForAcquisition",	&WaitForAcquisition,	"Wait until an acquisition event occurs");
+    m.def("waitForAcquisition",
+                                [](void) {
+                                    py::gil_scoped_release release;
+                                    return WaitForAcquisition();
+                                },	                    "Wait until an acquisition event occurs");
+    m.def("waitForAcquisitionTimeOut",
+                                [](int timeout_ms) {
+                                    py::gil_scoped_release release;
+                                    return WaitForAcquisitionTimeOut(timeout_ms);
+                                },                      "Wait up to timeout_ms for an acquisition event",
+        py::arg("timeout_ms")
+    );
+    m.def("cancelWait",         &CancelWait,            "Wake up a thread blocked in waitForAcquisition");
     m.def("abortAcquisition",	&AbortAcquisition,	    "Abort current acquisition if there is one");
-    m.def("getAcquiredData",	
-                                [](py::tuple& dim) {
-                                    int imageWidth, imageHeight;
-                                    imageWidth = dim[0].cast<int>();
-                                    imageHeight = dim[1].cast<int>();
-	                                at_32* imageDataArray = new at_32[imageWidth * imageHeight];
-                                    int status = GetAcquiredData(imageDataArray, imageWidth * imageHeight);
-                                    py::array imageDataMatrix = py::cast(reshapeImageData(
-                                                imageDataArray,
-                                                imageWidth,
-                                                imageHeight
-                                    ));
+    m.def("getAcquiredData",
+                                [](py::tuple& dim, py::object out) {
+                                    return readFrame<at_32>(&GetAcquiredData, dim, out);
+                                },     					"Return CCD data as 32-bit integers",
+        py::arg("dim"), py::arg("out") = py::none()
+    );
+    m.def("getAcquiredData16",
+                                [](py::tuple& dim, py::object out) {
+                                    return readFrame<WORD>(&GetAcquiredData16, dim, out);
+                                },     					"Return CCD data as 16-bit unsigned integers",
+        py::arg("dim"), py::arg("out") = py::none()
+    );
+    m.def("getMostRecentImage16",
+                                [](py::tuple& dim, py::object out) {
+                                    return readFrame<WORD>(&GetMostRecentImage16, dim, out);
+                                },     					"Return the most recent image as 16-bit unsigned integers",
+        py::arg("dim"), py::arg("out") = py::none()
+    );
 
+    m.def("getNumberNewImages",
+                                [](void) {
+                                    at_32 first, last;
+                                    first = -1;
+                                    last = -1;
+
+                                    int status;
+                                    status = GetNumberNewImages(&first, &last);
                                     py::dict out;
-                                    out["data"] = imageDataMatrix;
+                                    out["first"] = first;
+                                    out["last"] = last;
                                     out["status"] = status;
-                                    
+
+                                    return out;
+                                },                      "Get the range of images in the circular buffer not yet retrieved");
+    m.def("getTotalNumberImagesAcquired",
+                                [](void) {
+                                    at_32 index;
+                                    index = -1;
+
+                                    int status;
+                                    status = GetTotalNumberImagesAcquired(&index);
+                                    py::dict out;
+                                    out["index"] = index;
+                                    out["status"] = status;
+
                                     return out;
-                                },     					"Return CCD data");		// converted into a NumPy array.
+                                },                      "Get the number of images acquired since the start of the acquisition");
+    m.def("getImages16",
+                                [](at_32 first, at_32 last, py::tuple& dim, py::object out) {
+                                    int imageWidth = dim[0].cast<int>();
+                                    int imageHeight = dim[1].cast<int>();
+                                    auto imageData = frameBuffer<WORD>(out, {last - first + 1, imageHeight, imageWidth});
+
+                                    WORD* buffer = imageData.mutable_data();
+                                    at_32 validFirst, validLast;
+                                    validFirst = -1;
+                                    validLast = -1;
+                                    unsigned int status;
+                                    {
+                                        py::gil_scoped_release release;
+                                        status = GetImages16(first, last, buffer, imageData.size(), &validFirst, &validLast);
+                                    }
+
+                                    py::dict result;
+                                    result["data"] = imageData;
+                                    result["validfirst"] = validFirst;
+                                    result["validlast"] = validLast;
+                                    result["status"] = status;
+
+                                    return result;
+                                },                      "Return images first to last of the circular buffer as 16-bit unsigned integers",
+        py::arg("first"), py::arg("last"), py::arg("dim"), py::arg("out") = py::none()
+    );
 
     m.def("coolerOn",		    &CoolerON,	        	"Turn on Thermoelectric Cooler (TEC)");
     m.def("coolerOff",		    &CoolerOFF,	            "Turn off Thermoelectric Cooler (TEC)");
@@ -139,4 +236,139 @@ PYBIND11_MODULE(andor_wrapper, m) {
     m.def("setFanMode",		    &SetFanMode,		    "Set fan mode");
     m.def("setNumberKinetics",  &SetNumberKinetics,     "Set the number of scans to be taken during a single acquisition sequence");
     m.def("setKineticCycleTime",&SetKineticCycleTime,   "Set the kinetic cycle time");
+
+    m.def("setADChannel",       &SetADChannel,          "Set the A-D converter channel used for readout");
+    m.def("setHSSpeed",         &SetHSSpeed,            "Set the horizontal shift speed by amplifier type and index");
+    m.def("setVSSpeed",         &SetVSSpeed,            "Set the vertical shift speed by index");
+    m.def("setPreAmpGain",      &SetPreAmpGain,         "Set the pre-amp gain by index");
+    m.def("getNumberADChannels",
+                                [](void) {
+                                    int number;
+                                    number = -1;
+
+                                    int status;
+                                    status = GetNumberADChannels(&number);
+                                    py::dict out;
+                                    out["number"] = number;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Get the number of A-D converter channels");
+    m.def("getNumberHSSpeeds",
+                                [](int channel, int typ) {
+                                    int number;
+                                    number = -1;
+
+                                    int status;
+                                    status = GetNumberHSSpeeds(channel, typ, &number);
+                                    py::dict out;
+                                    out["number"] = number;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Get the number of horizontal shift speeds of a channel and amplifier type",
+        py::arg("channel"), py::arg("typ")
+    );
+    m.def("getHSSpeed",
+                                [](int channel, int typ, int index) {
+                                    float speed;
+                                    speed = -1;
+
+                                    int status;
+                                    status = GetHSSpeed(channel, typ, index, &speed);
+                                    py::dict out;
+                                    out["speed"] = speed;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Get a horizontal shift speed in MHz",
+        py::arg("channel"), py::arg("typ"), py::arg("index")
+    );
+    m.def("getNumberVSSpeeds",
+                                [](void) {
+                                    int number;
+                                    number = -1;
+
+                                    int status;
+                                    status = GetNumberVSSpeeds(&number);
+                                    py::dict out;
+                                    out["number"] = number;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Get the number of vertical shift speeds");
+    m.def("getVSSpeed",
+                                [](int index) {
+                                    float speed;
+                                    speed = -1;
+
+                                    int status;
+                                    status = GetVSSpeed(index, &speed);
+                                    py::dict out;
+                                    out["speed"] = speed;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Get a vertical shift speed in microseconds per pixel shift",
+        py::arg("index")
+    );
+    m.def("getFastestRecommendedVSSpeed",
+                                [](void) {
+                                    int index;
+                                    float speed;
+                                    index = -1;
+                                    speed = -1;
+
+                                    int status;
+                                    status = GetFastestRecommendedVSSpeed(&index, &speed);
+                                    py::dict out;
+                                    out["index"] = index;
+                                    out["speed"] = speed;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Get the fastest vertical shift speed that needs no voltage adjustment");
+    m.def("getNumberPreAmpGains",
+                                [](void) {
+                                    int number;
+                                    number = -1;
+
+                                    int status;
+                                    status = GetNumberPreAmpGains(&number);
+                                    py::dict out;
+                                    out["number"] = number;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Get the number of pre-amp gains");
+    m.def("getPreAmpGain",
+                                [](int index) {
+                                    float gain;
+                                    gain = -1;
+
+                                    int status;
+                                    status = GetPreAmpGain(index, &gain);
+                                    py::dict out;
+                                    out["gain"] = gain;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Get a pre-amp gain factor",
+        py::arg("index")
+    );
+    m.def("isPreAmpGainAvailable",
+                                [](int channel, int amplifier, int index, int pa) {
+                                    int available;
+                                    available = 0;
+
+                                    int status;
+                                    status = IsPreAmpGainAvailable(channel, amplifier, index, pa, &available);
+                                    py::dict out;
+                                    out["available"] = available == 1;
+                                    out["status"] = status;
+
+                                    return out;
+                                },                      "Check whether a pre-amp gain can be used with a channel, amplifier and horizontal speed",
+        py::arg("channel"), py::arg("amplifier"), py::arg("index"), py::arg("pa")
+    );
 }
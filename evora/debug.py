@@ -1 +1,17 @@
+import os
+
 DEBUGGING = False
+
+# EVORA_DEBUG=1 (or 0) overrides the setting above without editing this file,
+# e.g. to run the benchmarks against the dummy camera
+if 'EVORA_DEBUG' in os.environ:
+    DEBUGGING = os.environ['EVORA_DEBUG'].lower() in ('1', 'true', 'yes')
+
+# EVORA_RECORD=<file> records every evora.andor call to the file, and
+# EVORA_REPLAY=<file> replays such a recording through the dummy camera,
+# which it implies (see evora.replay)
+RECORD = os.environ.get('EVORA_RECORD')
+REPLAY = os.environ.get('EVORA_REPLAY')
+
+if REPLAY:
+    DEBUGGING = True
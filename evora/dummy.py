@@ -1,23 +1,34 @@
-import base64
 import threading
 import time
-from io import BytesIO
 
-from numpy import array, asarray
-from numpy.random import randint
-from PIL import Image
+from numpy import empty, int32, uint16
+
+from evora import instrumentation
+from evora.debug import REPLAY
+from evora.sky import SkySimulator
 
 # Replacement constants, taken from atmcdLXd.h
 DRV_SUCCESS = 20002
+DRV_NO_NEW_DATA = 20024
 DRV_TEMPERATURE_OFF = 20034
 DRV_TEMPERATURE_STABILIZED = 20036
 DRV_NOT_INITIALIZED = 20075
+DRV_P1INVALID = 20066
+DRV_P2INVALID = 20067
+DRV_P3INVALID = 20068
+DRV_P4INVALID = 20069
 DRV_ACQUIRING = 20072
 DRV_IDLE = 20073
 
 min_temp = -80.0
 max_temp = 50.0
 
+# readout speeds modelled on the iKon-M 934, which has a single A-D channel
+hs_speeds = (5.0, 3.0, 1.0, 0.05)  # MHz, fastest first
+vs_speeds = (2.25, 4.25, 8.25, 16.25, 32.25, 64.25)  # microseconds per row shift
+fastest_recommended_vs_speed = 1
+preamp_gains = (1.0, 2.0, 4.0)
+
 
 class Dummy:
     current_temp = 20.0
@@ -25,8 +36,28 @@ class Dummy:
     acquiring = False
     acquisition_mode = 1
     exp_time = 0.1
+    kinetic_cycle_time = 0.0
+    number_kinetics = 1
+    # seconds to read out a frame after its exposure; instant unless replaying
+    # a recording (see evora.replay)
+    readout_time = 0.0
+    images_acquired = 0
+    images_retrieved = 0
     dimensions = (1024, 1024)
-    __thread_stop = False
+    # hbin, vbin, hstart, hend, vstart, vend as last set by setImage
+    image = (1, 1, 1, 1024, 1, 1024)
+    ad_channel = 0
+    hs_speed = 0
+    vs_speed = fastest_recommended_vs_speed
+    preamp_gain = 0
+    shutter_open = True
+    # frames are rendered from a simulated star field; the app points it at
+    # the filter and focus of each capture
+    sky = SkySimulator(dimensions)
+    __thread_stop = threading.Event()
+    __acquisition_event = threading.Event()
+    # set by cancelWait until the wait it woke has returned
+    __wait_cancelled = False
 
     """
     SWIG notes
@@ -37,14 +68,20 @@ class Dummy:
 
     # todo: execute this in a separate thread to emulate locking during acquisition?
     @classmethod
-    def __emulate_acquisition(cls):
-        cls.acquiring = True
-        elapsed = 0.0
-        while (elapsed < cls.exp_time) and not cls.__thread_stop:
-            time.sleep(cls.exp_time)
-            elapsed += cls.exp_time
-        cls.acquiring = False
-        cls.__thread_stop = False
+    def __emulate_acquisition(cls, stop):
+        frames = cls.number_kinetics if cls.acquisition_mode == 3 else 1
+        cycle_time = max(cls.exp_time + cls.readout_time, cls.kinetic_cycle_time)
+        for _ in range(frames):
+            # returns early if abortAcquisition sets the stop event
+            if stop.wait(cycle_time):
+                break
+            cls.images_acquired += 1
+            cls.__acquisition_event.set()
+        # an aborted acquisition may already have been followed by another,
+        # whose state is not this thread's to end
+        if cls.__thread_stop is stop:
+            cls.acquiring = False
+            cls.__acquisition_event.set()
 
     # Andor SDK replacement functions with return values
     @classmethod
@@ -126,9 +163,17 @@ class Dummy:
         # for exp_time amount of time
         # other functions in the module will check if acquiring is False before proceeding
         if cls.initialized:
-            # acquiring = True
             if not cls.acquiring:
-                thread = threading.Thread(target=cls.__emulate_acquisition)
+                # set before the thread starts so getStatus never reports idle
+                # for an acquisition that has been started
+                cls.acquiring = True
+                cls.__acquisition_event.clear()
+                cls.__wait_cancelled = False
+                # each acquisition has its own stop event
+                cls.__thread_stop = threading.Event()
+                cls.images_acquired = 0
+                cls.images_retrieved = 0
+                thread = threading.Thread(target=cls.__emulate_acquisition, args=(cls.__thread_stop,))
                 thread.start()
                 return DRV_SUCCESS
             else:
@@ -140,44 +185,140 @@ class Dummy:
     def abortAcquisition(cls):
         if cls.initialized:
             cls.acquiring = False
-            cls.__thread_stop = True
+            cls.__thread_stop.set()
             return DRV_SUCCESS
         else:
             return DRV_NOT_INITIALIZED
 
     @classmethod
-    def getAcquiredData(cls, dim):
+    def waitForAcquisitionTimeOut(cls, timeout_ms):
+        # an event is raised for every image acquired and consumed by one wait
         if cls.initialized:
-            if not cls.acquiring:
-                data = randint(65535, size=dim)
-                # img = 'space.txt'
-                # if randint(0, 1000) >= 999:
-                #     img = 'server/evora/space0.txt'
+            if cls.__acquisition_event.wait(timeout_ms / 1000):
+                return cls.__consume_event()
+            return DRV_NO_NEW_DATA
+        else:
+            return DRV_NOT_INITIALIZED
 
-                # #time_sec = int(exp_time)
-                # #while time_sec:
-                # #    mins, secs = divmod(time_sec, 60)
-                # #    timer = '{:02d}:{:02d}'.format(mins, secs)
-                # #    print(timer, end="\r")
-                # #    time.sleep(1)
-                # #    time_sec -= 1
+    @classmethod
+    def waitForAcquisition(cls):
+        if cls.initialized:
+            cls.__acquisition_event.wait()
+            return cls.__consume_event()
+        else:
+            return DRV_NOT_INITIALIZED
 
-                # #import os
-                # #list = os.listdir('.')
+    @classmethod
+    def cancelWait(cls):
+        # wakes up any waiter, which returns DRV_NO_NEW_DATA as with the SDK
+        cls.__wait_cancelled = True
+        cls.__acquisition_event.set()
+        return DRV_SUCCESS
 
-                # with open(img) as f:
-                #     data = asarray(Image.open(BytesIO(base64.b64decode(f.read()))))
+    @classmethod
+    def __consume_event(cls):
+        cls.__acquisition_event.clear()
+        if cls.__wait_cancelled:
+            cls.__wait_cancelled = False
+            return DRV_NO_NEW_DATA
+        return DRV_SUCCESS
 
-                # This might not work, passing by reference is weird in Python
+    @classmethod
+    def __read_frame(cls, dim, out, dtype):
+        # Mirrors readFrame in andor_wrapper.cpp: the frame is returned as a
+        # C-contiguous (height, width) array, written into out if one is given.
+        width, height = int(dim[0]), int(dim[1])
+        if width <= 0 or height <= 0:
+            raise ValueError("Image dimensions must be positive")
+
+        if out is None:
+            out = empty((height, width), dtype=dtype)
+        else:
+            if out.dtype != dtype or not out.flags.c_contiguous:
+                raise TypeError("out must be a C-contiguous array of the readout dtype")
+            if out.size != width * height:
+                raise ValueError("out does not match the image dimensions")
 
-                return {"data": data, "status": DRV_SUCCESS}
+        if cls.initialized:
+            if not cls.acquiring:
+                cls.__render(out)
+                return {"data": out, "status": DRV_SUCCESS}
             else:
-                return {"data": array([], dtype="uint8"), "status": DRV_ACQUIRING}
+                return {"data": out, "status": DRV_ACQUIRING}
         else:
-            return {"data": array([], dtype="uint8"), "status": DRV_NOT_INITIALIZED}
+            return {"data": out, "status": DRV_NOT_INITIALIZED}
+
+    @classmethod
+    def __render(cls, out):
+        # Renders each (height, width) frame of out with the image set by setImage
+        hbin, vbin, hstart, hend, vstart, vend = cls.image
+        height, width = out.shape[-2:]
+        if ((hend - hstart + 1) // hbin, (vend - vstart + 1) // vbin) != (width, height):
+            # read with other dimensions than were set; render from the corner
+            hbin, vbin, hstart, hend, vstart, vend = 1, 1, 1, width, 1, height
+        for frame in out.reshape(-1, height, width):
+            cls.sky.render(
+                cls.exp_time,
+                cls.shutter_open,
+                region=(hstart, hend, vstart, vend),
+                binning=(hbin, vbin),
+                out=frame,
+            )
+
+    @classmethod
+    def getAcquiredData(cls, dim, out=None):
+        return cls.__read_frame(dim, out, int32)
+
+    @classmethod
+    def getAcquiredData16(cls, dim, out=None):
+        return cls.__read_frame(dim, out, uint16)
 
     # These functions do the same thing in this context
-    getMostRecentImage16 = getAcquiredData
+    getMostRecentImage16 = getAcquiredData16
+
+    @classmethod
+    def getNumberNewImages(cls):
+        if cls.initialized:
+            if cls.images_acquired > cls.images_retrieved:
+                return {
+                    "first": cls.images_retrieved + 1,
+                    "last": cls.images_acquired,
+                    "status": DRV_SUCCESS,
+                }
+            else:
+                return {"first": -1, "last": -1, "status": DRV_NO_NEW_DATA}
+        else:
+            return {"first": -1, "last": -1, "status": DRV_NOT_INITIALIZED}
+
+    @classmethod
+    def getTotalNumberImagesAcquired(cls):
+        if cls.initialized:
+            return {"index": cls.images_acquired, "status": DRV_SUCCESS}
+        else:
+            return {"index": -1, "status": DRV_NOT_INITIALIZED}
+
+    @classmethod
+    def getImages16(cls, first, last, dim, out=None):
+        width, height = int(dim[0]), int(dim[1])
+        frames = last - first + 1
+        if out is None:
+            out = empty((frames, height, width), dtype=uint16)
+        elif out.dtype != uint16 or not out.flags.c_contiguous:
+            raise TypeError("out must be a C-contiguous array of the readout dtype")
+        elif out.size != frames * width * height:
+            raise ValueError("out does not match the image dimensions")
+
+        if not cls.initialized:
+            return {"data": out, "validfirst": -1, "validlast": -1,
+                    "status": DRV_NOT_INITIALIZED}
+        if first <= cls.images_retrieved or last > cls.images_acquired:
+            return {"data": out, "validfirst": -1, "validlast": -1,
+                    "status": DRV_NO_NEW_DATA}
+
+        cls.__render(out)
+        cls.images_retrieved = last
+        return {"data": out, "validfirst": first, "validlast": last,
+                "status": DRV_SUCCESS}
 
     @classmethod
     def getAcquisitionTimings(cls):
@@ -186,7 +327,7 @@ class Dummy:
                 return {
                     "exposure": cls.exp_time,
                     "accumulate": -1.0,
-                    "kinetic": -1.0,
+                    "kinetic": max(cls.exp_time + cls.readout_time, cls.kinetic_cycle_time),
                     "status": DRV_SUCCESS,
                 }
             else:
@@ -194,23 +335,95 @@ class Dummy:
         else:
             return DRV_NOT_INITIALIZED
 
-    # def getNumberVSSpeeds(speeds):
-    #     return 1
+    @classmethod
+    def __readout_query(cls, **values):
+        if cls.initialized:
+            return dict(values, status=DRV_SUCCESS)
+        else:
+            return dict({key: -1 for key in values}, status=DRV_NOT_INITIALIZED)
 
-    # def getNumberVSAmplitudes(number):
-    #     return 1
+    @classmethod
+    def getNumberADChannels(cls):
+        return cls.__readout_query(number=1)
 
-    # def getVSSpeed(index, speed):
-    #     return 1
+    @classmethod
+    def getNumberHSSpeeds(cls, channel, typ):
+        if channel != 0:
+            return {"number": -1, "status": DRV_P1INVALID}
+        return cls.__readout_query(number=len(hs_speeds))
 
-    # def getFastestRecommendedVSSpeed(index, speeds):
-    #     return 1
+    @classmethod
+    def getHSSpeed(cls, channel, typ, index):
+        if channel != 0:
+            return {"speed": -1, "status": DRV_P1INVALID}
+        if not 0 <= index < len(hs_speeds):
+            return {"speed": -1, "status": DRV_P3INVALID}
+        return cls.__readout_query(speed=hs_speeds[index])
 
-    # def getNumberHSSpeeds(channel, typ, speeds):
-    #     return 1
+    @classmethod
+    def getNumberVSSpeeds(cls):
+        return cls.__readout_query(number=len(vs_speeds))
 
-    # def getHSSpeed(channel, typ, index, speed):
-    #     return 1
+    @classmethod
+    def getVSSpeed(cls, index):
+        if not 0 <= index < len(vs_speeds):
+            return {"speed": -1, "status": DRV_P1INVALID}
+        return cls.__readout_query(speed=vs_speeds[index])
+
+    @classmethod
+    def getFastestRecommendedVSSpeed(cls):
+        return cls.__readout_query(
+            index=fastest_recommended_vs_speed,
+            speed=vs_speeds[fastest_recommended_vs_speed],
+        )
+
+    @classmethod
+    def getNumberPreAmpGains(cls):
+        return cls.__readout_query(number=len(preamp_gains))
+
+    @classmethod
+    def getPreAmpGain(cls, index):
+        if not 0 <= index < len(preamp_gains):
+            return {"gain": -1, "status": DRV_P1INVALID}
+        return cls.__readout_query(gain=preamp_gains[index])
+
+    @classmethod
+    def isPreAmpGainAvailable(cls, channel, amplifier, index, pa):
+        if channel != 0:
+            return {"available": False, "status": DRV_P1INVALID}
+        if not 0 <= index < len(hs_speeds):
+            return {"available": False, "status": DRV_P3INVALID}
+        if not 0 <= pa < len(preamp_gains):
+            return {"available": False, "status": DRV_P4INVALID}
+        # the highest gain would saturate the converter at the fastest speed
+        return cls.__readout_query(available=not (index == 0 and pa == len(preamp_gains) - 1))
+
+    @classmethod
+    def __set_readout(cls, attribute, index, count, invalid=DRV_P1INVALID):
+        if not cls.initialized:
+            return DRV_NOT_INITIALIZED
+        if cls.acquiring:
+            return DRV_ACQUIRING
+        if not 0 <= index < count:
+            return invalid
+        setattr(cls, attribute, index)
+        return DRV_SUCCESS
+
+    @classmethod
+    def setADChannel(cls, channel):
+        return cls.__set_readout("ad_channel", channel, 1)
+
+    @classmethod
+    def setHSSpeed(cls, typ, index):
+        return cls.__set_readout("hs_speed", index, len(hs_speeds), DRV_P2INVALID)
+
+    @classmethod
+    def setVSSpeed(cls, index):
+        return cls.__set_readout("vs_speed", index, len(vs_speeds))
+
+    @classmethod
+    def setPreAmpGain(cls, index):
+        return cls.__set_readout("preamp_gain", index, len(preamp_gains))
 
     @classmethod
     def getDetector(cls):
@@ -308,9 +521,9 @@ class Dummy:
 
     @classmethod
     def setImage(cls, hbin, vbin, hstart, hend, vstart, vend):
-        # determine the specifics of the behavior later lol
         if cls.initialized:
             if not cls.acquiring:
+                cls.image = (hbin, vbin, hstart, hend, vstart, vend)
                 return DRV_SUCCESS
             else:
                 return DRV_ACQUIRING
@@ -319,9 +532,10 @@ class Dummy:
 
     @classmethod
     def setShutter(cls, typ, mode, closing_time, opening_time):
-        # determine the specifics of the behavior later lol
         if cls.initialized:
             if not cls.acquiring:
+                # mode 2 keeps the shutter closed, as for biases and darks
+                cls.shutter_open = mode != 2
                 return DRV_SUCCESS
             else:
                 return DRV_ACQUIRING
@@ -343,6 +557,7 @@ class Dummy:
     def setKineticCycleTime(cls, cycle_time):
         if cls.initialized:
             if not cls.acquiring:
+                cls.kinetic_cycle_time = cycle_time
                 return DRV_SUCCESS
             else:
                 return DRV_ACQUIRING
@@ -355,6 +570,7 @@ class Dummy:
     def setNumberKinetics(cls, number):
         if cls.initialized:
             if not cls.acquiring:
+                cls.number_kinetics = number
                 return DRV_SUCCESS
             else:
                 return DRV_ACQUIRING
@@ -362,3 +578,13 @@ class Dummy:
             return DRV_NOT_INITIALIZED
 
     # setTriggerMode = noop
+
+
+# calls are recorded like those of evora.andor, to compare simulated and real timings
+instrumentation.instrument_class(Dummy)
+
+# EVORA_REPLAY gives Dummy the latencies and temperature curve of a recording
+if REPLAY:
+    from evora.replay import install
+
+    install(Dummy, REPLAY)
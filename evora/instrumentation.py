@@ -0,0 +1,253 @@
+import os
+import reprlib
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from evora._error_codes import ERROR_CODES
+
+DRV_SUCCESS = 20002
+
+# Number of calls kept, with their arguments, for stats()["recent"]
+RECENT_CALLS = 200
+
+# Per-call recording is on unless EVORA_SDK_STATS=0; traces record regardless
+ENABLED = os.environ.get("EVORA_SDK_STATS", "1").lower() not in ("0", "false", "no")
+
+# arrays and long argument lists are abbreviated rather than copied
+_repr = reprlib.Repr()
+_repr.maxother = 80
+_repr.maxstring = 80
+
+_lock = threading.Lock()
+_functions = {}
+_recent = deque(maxlen=RECENT_CALLS)
+_traces = []
+_listeners = ()
+
+# Set while a thread is in an instrumented call, whose own calls to other
+# instrumented functions, such as Dummy.getRangeTEC's, are not SDK calls
+_local = threading.local()
+
+
+class Trace:
+    """
+    The SDK calls made while a trace is active, as returned by trace().
+
+    Calls are recorded whichever thread makes them, so a trace of a capture
+    also holds any status polls that ran during it.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.start = time.time()
+        self.end = None
+
+    def summary(self):
+        """Returns the count and total and max seconds of each function called."""
+        summary = {}
+        for call in self.calls:
+            entry = summary.setdefault(call["function"], {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["total"] += call["duration"]
+            entry["max"] = max(entry["max"], call["duration"])
+        return summary
+
+    def serialize(self):
+        end = self.end if self.end is not None else time.time()
+        return {
+            "seconds": end - self.start,
+            "sdk_seconds": sum(call["duration"] for call in self.calls),
+            "functions": self.summary(),
+            "calls": list(self.calls),
+        }
+
+
+def _code_name(code):
+    return ERROR_CODES.get(code, [str(code)])[0]
+
+
+def _status(result):
+    # SDK functions return a status code, alone or as the "status" of a
+    # dict; getStatus reports the camera state as "status" and its own code
+    # as "funcstatus"
+    if isinstance(result, dict):
+        result = result.get("funcstatus", result.get("status"))
+    if isinstance(result, int) and not isinstance(result, bool):
+        return result
+    return None
+
+
+def _record(name, args, kwargs, start, duration, code, error):
+    with _lock:
+        if ENABLED:
+            stats = _functions.get(name)
+            if stats is None:
+                stats = _functions[name] = {"count": 0, "total": 0.0, "max": 0.0, "codes": Counter()}
+            stats["count"] += 1
+            stats["total"] += duration
+            if duration > stats["max"]:
+                stats["max"] = duration
+            if error is not None:
+                stats["codes"][error] += 1
+            elif code is not None and code != DRV_SUCCESS:
+                stats["codes"][_code_name(code)] += 1
+
+        if ENABLED or _traces:
+            call = {
+                "function": name,
+                "args": [_repr.repr(arg) for arg in args]
+                + [f"{key}={_repr.repr(value)}" for key, value in kwargs.items()],
+                "time": start,
+                "duration": duration,
+                "code": _code_name(code) if code is not None else None,
+                "error": error,
+            }
+            if ENABLED:
+                _recent.append(call)
+            for active in _traces:
+                active.calls.append(call)
+
+
+def instrument(name, func):
+    """
+    Wraps an SDK function so each call is recorded under name.
+
+    Wrap the raw function, before any error checking, so the status codes it
+    returns are counted. Calls made from inside another instrumented call
+    are not recorded.
+
+    Parameters:
+    - name: the name of the SDK function
+    - func: the function to wrap
+    """
+
+    def instrumented(*args, **kwargs):
+        if (not ENABLED and not _traces and not _listeners) or getattr(_local, "active", False):
+            return func(*args, **kwargs)
+
+        _local.active = True
+        try:
+            return _call(name, func, args, kwargs)
+        finally:
+            _local.active = False
+
+    instrumented.__name__ = name
+    instrumented.__wrapped__ = func
+    return instrumented
+
+
+def _call(name, func, args, kwargs):
+    start = time.time()
+    start_counter = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as err:
+        duration = time.perf_counter() - start_counter
+        _record(name, args, kwargs, start, duration,
+                getattr(err, "error_code", None), type(err).__name__)
+        for listener in _listeners:
+            listener(name, args, kwargs, start, duration, None, err)
+        raise
+    duration = time.perf_counter() - start_counter
+    _record(name, args, kwargs, start, duration, _status(result), None)
+    for listener in _listeners:
+        listener(name, args, kwargs, start, duration, result, None)
+    return result
+
+
+def instrument_class(cls):
+    """
+    Instruments the public classmethods of a class standing in for the SDK,
+    such as evora.dummy.Dummy, in place.
+    """
+    for name, value in list(vars(cls).items()):
+        if isinstance(value, classmethod) and not name.startswith("_"):
+            setattr(cls, name, staticmethod(instrument(name, getattr(cls, name))))
+    return cls
+
+
+def add_listener(listener):
+    """
+    Calls listener(name, args, kwargs, start, duration, result, error) after
+    every SDK call, with the raw result, or the exception as error, as used
+    by evora.replay.Recorder.
+    """
+    global _listeners
+    with _lock:
+        _listeners = _listeners + (listener,)
+
+
+def error_name(result, error=None):
+    """
+    Returns what an SDK call failed with, as counted in stats(): the name of
+    the exception it raised or of the non-success status code it returned,
+    or None if it succeeded.
+    """
+    if error is not None:
+        return type(error).__name__
+    code = _status(result)
+    if code is not None and code != DRV_SUCCESS:
+        return _code_name(code)
+    return None
+
+
+def remove_listener(listener):
+    global _listeners
+    with _lock:
+        _listeners = tuple(item for item in _listeners if item is not listener)
+
+
+def stats(recent=RECENT_CALLS):
+    """
+    Returns the calls recorded so far.
+
+    Parameters:
+    - recent: number of the latest calls to include
+
+    Returns:
+    - a dict of "functions", holding the count, total, mean and max seconds
+      of each SDK function and the frequency of each non-success code or
+      exception it returned, and of the "recent" calls, oldest first
+    """
+    with _lock:
+        functions = {
+            name: {
+                "count": entry["count"],
+                "total": entry["total"],
+                "mean": entry["total"] / entry["count"],
+                "max": entry["max"],
+                "codes": dict(entry["codes"]),
+            }
+            for name, entry in _functions.items()
+        }
+        calls = list(_recent)[-recent:] if recent > 0 else []
+    return {"enabled": ENABLED, "functions": functions, "recent": calls}
+
+
+def reset():
+    with _lock:
+        _functions.clear()
+        _recent.clear()
+
+
+@contextmanager
+def trace():
+    """
+    Records every SDK call made inside the block, for example to break down a
+    single capture:
+
+        with instrumentation.trace() as sdk_trace:
+            capture(req)
+        print(sdk_trace.summary())
+    """
+    active = Trace()
+    with _lock:
+        _traces.append(active)
+    try:
+        yield active
+    finally:
+        with _lock:
+            _traces.remove(active)
+        active.end = time.time()
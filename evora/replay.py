@@ -0,0 +1,352 @@
+"""
+Records the SDK calls of a night on the camera and replays their timing
+offline through the dummy camera.
+
+Recording writes one JSON line per evora.andor call, with its start time,
+duration, arguments, return value and the CRC32 of any frame it returned:
+
+    EVORA_RECORD=night.jsonl python app.py
+
+Replaying selects the dummy camera, as DEBUGGING does, and gives it the
+behavior of the recorded camera: each SDK function takes as long as its
+recorded calls did, in turn, frames take the recorded readout time after
+their exposure, and after setTargetTEC the temperature and its status follow
+the recorded cooling curve instead of jumping to the target:
+
+    EVORA_REPLAY=night.jsonl python app.py
+
+The server is free to make different calls than it did when recording, so
+changes to it can be measured against the recorded hardware behavior.
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import socket
+import statistics
+import threading
+import time
+import zlib
+
+import numpy
+
+from evora import instrumentation
+
+DRV_SUCCESS = 20002
+DRV_ACQUIRING = 20072
+
+VERSION = 1
+
+# Functions whose duration is the wait for an acquisition, which the replayed
+# readout time reproduces, rather than latency of their own
+WAITS = ("waitForAcquisition", "waitForAcquisitionTimeOut")
+
+
+def _encode(value, checksum=False):
+    # arrays are reduced to their shape and dtype, and frames to a checksum
+    if isinstance(value, numpy.ndarray):
+        encoded = {"shape": list(value.shape), "dtype": str(value.dtype)}
+        if checksum:
+            encoded["crc32"] = zlib.crc32(numpy.ascontiguousarray(value))
+        return {"array": encoded}
+    if isinstance(value, dict):
+        return {str(key): _encode(item, checksum) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item, checksum) for item in value]
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+class Recorder:
+    """
+    Appends every SDK call to a JSON lines file, as they are made.
+
+    Parameters:
+    - path: the file to append to; each session starts with a header line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+        self._write({
+            "type": "header",
+            "version": VERSION,
+            "time": time.time(),
+            "host": socket.gethostname(),
+        })
+        instrumentation.add_listener(self.record)
+        atexit.register(self.close)
+
+    def record(self, name, args, kwargs, start, duration, result, error):
+        self._write({
+            "type": "call",
+            "function": name,
+            "time": start,
+            "duration": duration,
+            "args": _encode(args),
+            "kwargs": _encode(kwargs),
+            "result": _encode(result, checksum=True),
+            "error": None if error is None else {
+                "type": type(error).__name__,
+                "code": getattr(error, "error_code", None),
+                "message": str(error),
+            },
+        })
+
+    def close(self):
+        instrumentation.remove_listener(self.record)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, entry):
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+
+def load(path):
+    """Returns the calls of a recording, in the order they were made."""
+    calls = []
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                if entry.get("type") == "call":
+                    calls.append(entry)
+    calls.sort(key=lambda call: call["time"])
+    return calls
+
+
+def _readout_time(calls):
+    # The time single acquisitions took beyond their exposure, from the end
+    # of startAcquisition to the first call that saw the frame ready
+    overheads = []
+    exposure = None
+    mode = 1
+    start = None
+    for call in calls:
+        name, result = call["function"], call["result"]
+        if name == "setExposureTime" and result == DRV_SUCCESS:
+            exposure = float(call["args"][0])
+        elif name == "setAcquisitionMode" and result == DRV_SUCCESS:
+            mode = int(call["args"][0])
+        elif name == "startAcquisition":
+            start = call["time"] + call["duration"] if result == DRV_SUCCESS else None
+        elif name == "abortAcquisition":
+            start = None
+        elif start is not None:
+            end = None
+            if name in WAITS and result == DRV_SUCCESS:
+                end = call["time"] + call["duration"]
+            elif name == "getStatus" and isinstance(result, dict) and result.get("status") != DRV_ACQUIRING:
+                end = call["time"]
+            if end is not None:
+                if mode == 1 and exposure is not None:
+                    overheads.append(end - start - exposure)
+                start = None
+
+    return max(0.0, statistics.median(overheads)) if overheads else 0.0
+
+
+def _cooling_curves(calls):
+    # Each setTargetTEC starts a curve of the temperatures read after it, as
+    # the fraction of the way from the starting temperature to the target
+    # still to go, so it can be replayed between other temperatures
+    curves = []
+    curve = None
+    temperature = None
+    for call in calls:
+        name, result = call["function"], call["result"]
+        if name == "setTargetTEC" and result == DRV_SUCCESS:
+            curve = {
+                "target": float(call["args"][0]),
+                "start": temperature,
+                "time": call["time"],
+                "points": [],
+            }
+            curves.append(curve)
+        elif name == "getStatusTEC" and isinstance(result, dict):
+            if result.get("status") == DRV_ACQUIRING or result.get("temperature", -999) <= -999:
+                continue
+            temperature = float(result["temperature"])
+            if curve is not None:
+                if curve["start"] is None:
+                    curve["start"] = temperature
+                curve["points"].append((call["time"] - curve["time"], temperature, result["status"]))
+
+    replayable = []
+    for curve in curves:
+        if curve["start"] is None or abs(curve["start"] - curve["target"]) < 1 or not curve["points"]:
+            continue
+        elapsed, temperatures, status = zip(*curve["points"])
+        replayable.append({
+            "target": curve["target"],
+            "elapsed": list(elapsed),
+            "fraction": [
+                (value - curve["target"]) / (curve["start"] - curve["target"])
+                for value in temperatures
+            ],
+            "status": list(status),
+        })
+    return replayable
+
+
+class Replay:
+    """
+    The timing and cooling behavior of a recorded camera, applied to the
+    dummy camera by install.
+
+    Parameters:
+    - calls: the calls of a recording, as returned by load
+    """
+
+    def __init__(self, calls):
+        self.latencies = {}
+        for call in calls:
+            if call["function"] not in WAITS:
+                self.latencies.setdefault(call["function"], []).append(call["duration"])
+        self.readout_time = _readout_time(calls)
+        self.cooling_curves = _cooling_curves(calls)
+
+        # frames read back to back with the same checksum were stale
+        checksums = [
+            call["result"]["data"]["array"].get("crc32")
+            for call in calls
+            if isinstance(call["result"], dict) and isinstance(call["result"].get("data"), dict)
+        ]
+        self.frames = len(checksums)
+        self.repeated_frames = sum(a == b for a, b in zip(checksums, checksums[1:]))
+
+        self._calls = {}
+        self._curve = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load(path))
+
+    def latency(self, name):
+        """Returns the duration of the next recorded call of name, cycling through them."""
+        latencies = self.latencies.get(name)
+        if not latencies:
+            return 0.0
+        with self._lock:
+            index = self._calls.get(name, 0)
+            self._calls[name] = index + 1
+        return latencies[index % len(latencies)]
+
+    def delayed(self, name, func):
+        """Wraps func so each call lasts at least its recorded latency."""
+        if name in WAITS:
+            return func
+
+        def replayed(*args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            remaining = self.latency(name) - (time.perf_counter() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+            return result
+
+        return replayed
+
+    def temperature(self):
+        """
+        Returns the replayed (temperature, status), or None before the first
+        setTargetTEC or if the recording has no cooling curve.
+        """
+        with self._lock:
+            if self._curve is None:
+                return None
+            curve, start, target, start_time = self._curve
+
+        elapsed = time.time() - start_time
+        fraction = numpy.interp(elapsed, curve["elapsed"], curve["fraction"], left=1.0)
+        index = max(0, bisect.bisect_right(curve["elapsed"], elapsed) - 1)
+        return target + float(fraction) * (start - target), curve["status"][index]
+
+    def set_target(self, target, start):
+        """Starts replaying the recorded curve whose target is closest to target."""
+        if not self.cooling_curves:
+            return
+        curve = min(self.cooling_curves, key=lambda curve: abs(curve["target"] - target))
+        with self._lock:
+            self._curve = (curve, start, float(target), time.time())
+
+    def summary(self):
+        return {
+            "functions": len(self.latencies),
+            "calls": sum(len(latencies) for latencies in self.latencies.values()),
+            "readout_time": self.readout_time,
+            "cooling_curves": len(self.cooling_curves),
+            "frames": self.frames,
+            "repeated_frames": self.repeated_frames,
+        }
+
+
+def install(camera, path):
+    """
+    Replays a recording through a dummy camera class, in place.
+
+    Parameters:
+    - camera: evora.dummy.Dummy, after evora.instrumentation.instrument_class
+    - path: the recording
+
+    Returns:
+    - the Replay, also set as camera.replay
+    """
+    replay = Replay.from_file(path)
+    camera.readout_time = replay.readout_time
+
+    for name, value in list(vars(camera).items()):
+        if not isinstance(value, staticmethod):
+            continue
+        # the dummy's own function, below its instrumentation
+        func = getattr(value.__func__, "__wrapped__", value.__func__)
+
+        if name == "setTargetTEC":
+            func = _replay_set_target(camera, replay, func)
+        elif name == "getStatusTEC":
+            func = _replay_status_tec(replay, func)
+
+        setattr(camera, name, staticmethod(instrumentation.instrument(name, replay.delayed(name, func))))
+
+    camera.replay = replay
+    logging.info(f"Replaying {path}: {replay.summary()}")
+    return replay
+
+
+def _replay_set_target(camera, replay, set_target_tec):
+    def setTargetTEC(temperature):
+        replayed = replay.temperature()
+        start = replayed[0] if replayed is not None else camera.current_temp
+        result = set_target_tec(temperature)
+        if result == DRV_SUCCESS:
+            replay.set_target(temperature, start)
+        return result
+
+    return setTargetTEC
+
+
+def _replay_status_tec(replay, get_status_tec):
+    def getStatusTEC():
+        result = get_status_tec()
+        # the dummy's answer stands while acquiring or uninitialized
+        if result.get("status") != DRV_SUCCESS:
+            return result
+        replayed = replay.temperature()
+        if replayed is None:
+            return result
+        temperature, status = replayed
+        return {"status": status, "temperature": temperature}
+
+    return getStatusTEC
@@ -0,0 +1,219 @@
+import numpy
+
+# Relative throughput of each filter, including the detector response
+FILTER_THROUGHPUT = {"Ha": 0.08, "B": 0.55, "V": 0.8, "g": 0.85, "r": 1.0, "i": 0.75}
+
+# Expected electrons above which shot noise is drawn from a Gaussian
+POISSON_LIMIT = 10.0
+
+# Plate scale of the iKon-M (13 micron pixels) at the 5766 mm focal length
+PIXEL_SCALE = 206264.8 * 0.013 / 5766  # arcsec per pixel
+
+
+class SkySimulator:
+    """
+    Renders synthetic CCD frames of a star field for the Dummy camera.
+
+    A frame is the sum of a bias level, dark current, sky background and a
+    seeded catalog of stars with a Gaussian PSF, with Poisson and read noise
+    applied. The PSF widens as the simulated focuser position moves away from
+    best focus, and star and sky flux scale with the throughput of the
+    simulated filter, so focus and framing code can be exercised offline.
+    Rendering is vectorized; a full 1024x1024 frame takes about 50 ms, and
+    up to about 0.1 s through narrowband filters, where the sky is faint
+    enough that shot noise is drawn exactly.
+
+    Parameters:
+    - shape: (width, height) of the detector in pixels
+    - seed: seeds the star catalog and the noise
+    - stars: number of stars in the catalog
+    - brightest: flux of the brightest star in electrons per second
+    - magnitude_range: magnitudes spanned by the catalog below the brightest
+    - bias: bias level in ADU
+    - gain: electrons per ADU
+    - read_noise: read noise in electrons
+    - dark_current: electrons per pixel per second
+    - sky: sky background in electrons per pixel per second, unfiltered
+    - seeing: FWHM of the in-focus PSF in pixels
+    - best_focus: focuser position of best focus
+    - defocus: PSF sigma in pixels added per unit of focuser offset
+    - center: (ra, dec) in degrees of the detector center, or None for no WCS
+    """
+
+    def __init__(
+        self,
+        shape=(1024, 1024),
+        seed=0,
+        stars=300,
+        brightest=2e5,
+        magnitude_range=8.0,
+        bias=1000.0,
+        gain=1.0,
+        read_noise=8.0,
+        dark_current=0.01,
+        sky=20.0,
+        seeing=3.0,
+        best_focus=0.0,
+        defocus=0.1,
+        center=(83.8221, -5.3911),
+    ):
+        self.shape = tuple(shape)
+        self.bias = bias
+        self.gain = gain
+        self.read_noise = read_noise
+        self.dark_current = dark_current
+        self.sky = sky
+        self.seeing = seeing
+        self.best_focus = best_focus
+        self.defocus = defocus
+        self.center = center
+
+        # the simulated state of the telescope
+        self.focus = best_focus
+        self.filter_name = "r"
+
+        self._rng = numpy.random.default_rng(seed)
+
+        # N(<m) grows as 10^(0.3 m), so most stars are faint
+        u = self._rng.random(stars)
+        magnitudes = numpy.log10(u * (10 ** (0.3 * magnitude_range) - 1) + 1) / 0.3
+        self.stars = numpy.empty(
+            stars, dtype=[("x", "f8"), ("y", "f8"), ("flux", "f8")]
+        )
+        self.stars["x"] = self._rng.uniform(-0.5, self.shape[0] - 0.5, stars)
+        self.stars["y"] = self._rng.uniform(-0.5, self.shape[1] - 0.5, stars)
+        self.stars["flux"] = brightest * 10 ** (-0.4 * magnitudes)
+
+    def psf_sigma(self):
+        """Returns the sigma of the PSF in pixels at the current focus."""
+        seeing_sigma = self.seeing / 2.3548
+        return float(numpy.hypot(seeing_sigma, self.defocus * (self.focus - self.best_focus)))
+
+    def expected(self, exptime, shutter_open=True, region=None):
+        """
+        Returns the noiseless electrons collected by each pixel of a region.
+
+        Parameters:
+        - exptime: exposure time in seconds
+        - shutter_open: whether sky and stars reach the detector
+        - region: 1-based, inclusive (hstart, hend, vstart, vend) unbinned
+          pixels, the whole detector if None
+        """
+        if region is None:
+            region = (1, self.shape[0], 1, self.shape[1])
+        hstart, hend, vstart, vend = region
+        width, height = hend - hstart + 1, vend - vstart + 1
+
+        electrons = numpy.full(height * width, self.dark_current * exptime)
+        if not shutter_open or exptime <= 0:
+            return electrons.reshape(height, width)
+
+        throughput = FILTER_THROUGHPUT.get(self.filter_name, 1.0)
+        electrons += self.sky * throughput * exptime
+
+        sigma = self.psf_sigma()
+        radius = int(numpy.ceil(4 * sigma))
+
+        # star positions relative to the region, keeping those whose PSF reaches it
+        x = self.stars["x"] - (hstart - 1)
+        y = self.stars["y"] - (vstart - 1)
+        keep = (
+            (x > -radius - 1) & (x < width + radius)
+            & (y > -radius - 1) & (y < height + radius)
+        )
+        x, y = x[keep], y[keep]
+        flux = self.stars["flux"][keep] * throughput * exptime
+        if len(flux) == 0:
+            return electrons.reshape(height, width)
+
+        # A separable Gaussian stamp per star, normalized so each star
+        # deposits its whole flux
+        offsets = numpy.arange(-radius, radius + 1)
+        px = numpy.rint(x).astype(numpy.int64)[:, None] + offsets
+        py = numpy.rint(y).astype(numpy.int64)[:, None] + offsets
+        gx = numpy.exp(-0.5 * ((px - x[:, None]) / sigma) ** 2)
+        gy = numpy.exp(-0.5 * ((py - y[:, None]) / sigma) ** 2)
+        gx /= gx.sum(axis=1, keepdims=True)
+        gy /= gy.sum(axis=1, keepdims=True)
+        stamps = flux[:, None, None] * gy[:, :, None] * gx[:, None, :]
+
+        inside = (
+            ((py >= 0) & (py < height))[:, :, None]
+            & ((px >= 0) & (px < width))[:, None, :]
+        )
+        index = py[:, :, None] * width + px[:, None, :]
+        electrons += numpy.bincount(
+            index[inside], weights=stamps[inside], minlength=height * width
+        )
+
+        return electrons.reshape(height, width)
+
+    def render(self, exptime, shutter_open=True, region=None, binning=(1, 1), out=None):
+        """
+        Renders a noisy frame in ADU.
+
+        Parameters:
+        - exptime, shutter_open, region: see expected
+        - binning: (hbin, vbin); the region must be a multiple of it
+        - out: optional array of shape (height, width) of the binned frame to
+          render into
+
+        Returns:
+        - the frame, clipped to the 16-bit range
+        """
+        hbin, vbin = binning
+        electrons = self.expected(exptime, shutter_open, region)
+        height, width = electrons.shape[0] // vbin, electrons.shape[1] // hbin
+        if hbin != 1 or vbin != 1:
+            # charge is summed on chip before the single read of each superpixel
+            electrons = electrons.reshape(height, vbin, width, hbin).sum(axis=(1, 3))
+
+        # Shot noise is drawn exactly only for faint pixels; above
+        # POISSON_LIMIT electrons its Gaussian approximation is drawn together
+        # with the read noise, which is several times faster
+        bright = electrons >= POISSON_LIMIT
+        mean = numpy.where(bright, electrons, 0.0)
+        frame = self._rng.standard_normal(electrons.shape, dtype=numpy.float32)
+        frame *= numpy.sqrt(mean + self.read_noise ** 2)
+        frame += mean
+        faint = ~bright & (electrons > 0)
+        if faint.any():
+            frame[faint] += self._rng.poisson(electrons[faint])
+        frame /= self.gain
+        frame += self.bias
+        numpy.clip(frame, 0, 65535, out=frame)
+
+        if out is None:
+            out = numpy.empty(frame.shape, dtype=numpy.uint16)
+        numpy.copyto(out, frame.reshape(out.shape), casting="unsafe")
+        return out
+
+    def wcs_header(self, hbin=1, vbin=1, hstart=1, vstart=1):
+        """
+        Returns the FITS WCS keywords of a frame, or an empty dict if the
+        simulator has no center.
+
+        Parameters:
+        - hbin, vbin, hstart, vstart: the binning and origin of the frame on
+          the detector, as set by setImage
+        """
+        if self.center is None:
+            return {}
+
+        ra, dec = self.center
+        scale = PIXEL_SCALE / 3600
+        # detector center, mapped into binned image pixels
+        crpix1 = (self.shape[0] + 1) / 2 / hbin + (hbin + 1 - 2 * hstart) / (2 * hbin)
+        crpix2 = (self.shape[1] + 1) / 2 / vbin + (vbin + 1 - 2 * vstart) / (2 * vbin)
+        return {
+            "CTYPE1": "RA---TAN",
+            "CTYPE2": "DEC--TAN",
+            "CRVAL1": ra % 360,
+            "CRVAL2": max(-90.0, min(90.0, dec)),
+            "CRPIX1": crpix1,
+            "CRPIX2": crpix2,
+            "CD1_1": -scale * hbin,
+            "CD1_2": 0.0,
+            "CD2_1": 0.0,
+            "CD2_2": scale * vbin,
+        }
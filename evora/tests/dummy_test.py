@@ -0,0 +1,57 @@
+import numpy
+import pytest
+
+from evora.dummy import Dummy
+
+
+def setup_module():
+    Dummy.initialize()
+
+
+def test_getAcquiredData16_shape():
+    img = Dummy.getAcquiredData16((1024, 512))
+    assert img["status"] == 20002
+    assert img["data"].shape == (512, 1024)
+    assert img["data"].dtype == numpy.uint16
+    assert img["data"].flags.c_contiguous
+
+
+def test_getAcquiredData16_out():
+    buffer = numpy.zeros((512, 1024), dtype=numpy.uint16)
+    img = Dummy.getAcquiredData16((1024, 512), out=buffer)
+    assert img["data"] is buffer
+
+
+def test_getAcquiredData_out_wrong_dtype():
+    buffer = numpy.zeros((512, 1024), dtype=numpy.uint16)
+    with pytest.raises(TypeError):
+        Dummy.getAcquiredData((1024, 512), out=buffer)
+
+
+def test_getAcquiredData_out_wrong_size():
+    buffer = numpy.zeros((10, 10), dtype=numpy.int32)
+    with pytest.raises(ValueError):
+        Dummy.getAcquiredData((1024, 512), out=buffer)
+
+
+def test_wait_after_abort_waits_for_next_acquisition():
+    Dummy.setAcquisitionMode(1)
+    Dummy.setExposureTime(0.3)
+    assert Dummy.startAcquisition() == 20002
+    Dummy.cancelWait()
+    Dummy.abortAcquisition()
+
+    # the aborted acquisition's thread must not end this one
+    assert Dummy.startAcquisition() == 20002
+    assert Dummy.waitForAcquisitionTimeOut(100) == 20024
+    assert Dummy.getStatus()["status"] == 20072
+    assert Dummy.waitForAcquisitionTimeOut(2000) == 20002
+
+
+def test_cancelWait_wakes_waiter_without_a_frame():
+    Dummy.setAcquisitionMode(1)
+    Dummy.setExposureTime(1.0)
+    assert Dummy.startAcquisition() == 20002
+    Dummy.cancelWait()
+    assert Dummy.waitForAcquisitionTimeOut(2000) == 20024
+    Dummy.abortAcquisition()
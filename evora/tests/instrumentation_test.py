@@ -0,0 +1,134 @@
+import pytest
+
+from evora import instrumentation
+
+DRV_SUCCESS = 20002
+DRV_ACQUIRING = 20072
+
+
+class SDKError(Exception):
+    def __init__(self, error_code):
+        super().__init__(f"SDK error {error_code}")
+        self.error_code = error_code
+
+
+def fail():
+    raise SDKError(20013)
+
+
+@pytest.fixture(autouse=True)
+def reset(monkeypatch):
+    monkeypatch.setattr(instrumentation, "ENABLED", True)
+    instrumentation.reset()
+    yield
+    instrumentation.reset()
+
+
+def test_calls_counted_with_codes():
+    codes = iter([DRV_SUCCESS, {"status": DRV_ACQUIRING}, DRV_SUCCESS])
+    call = instrumentation.instrument("call", lambda *args: next(codes))
+    failing = instrumentation.instrument("failing", fail)
+    for _ in range(3):
+        call(1, 2)
+    with pytest.raises(SDKError):
+        failing()
+
+    stats = instrumentation.stats()
+    assert stats["functions"]["call"]["count"] == 3
+    assert stats["functions"]["call"]["codes"] == {"DRV_ACQUIRING": 1}
+    assert stats["functions"]["failing"]["codes"] == {"SDKError": 1}
+    assert [call["function"] for call in stats["recent"]] == ["call"] * 3 + ["failing"]
+    assert stats["recent"][0]["args"] == ["1", "2"]
+    assert stats["recent"][-1]["code"] == "DRV_ERROR_ACK"
+
+    assert len(instrumentation.stats(recent=1)["recent"]) == 1
+    instrumentation.reset()
+    assert instrumentation.stats()["functions"] == {}
+
+
+def test_getStatus_code_is_funcstatus():
+    # the camera state is the "status", the code of the call "funcstatus"
+    status = {"funcstatus": DRV_SUCCESS, "status": DRV_ACQUIRING}
+    call = instrumentation.instrument("getStatus", lambda: status)
+    call()
+    assert instrumentation.stats()["functions"]["getStatus"]["codes"] == {}
+
+
+def test_trace_records_when_disabled(monkeypatch):
+    monkeypatch.setattr(instrumentation, "ENABLED", False)
+    call = instrumentation.instrument("call", lambda: DRV_SUCCESS)
+    call()
+    with instrumentation.trace() as sdk_trace:
+        call()
+        call()
+    call()
+
+    assert sdk_trace.summary()["call"]["count"] == 2
+    assert sdk_trace.serialize()["seconds"] >= sdk_trace.serialize()["sdk_seconds"]
+    assert instrumentation.stats()["functions"] == {}
+
+
+def test_listener_gets_result_and_error():
+    calls = []
+
+    def listener(name, args, kwargs, start, duration, result, error):
+        calls.append((name, result, error))
+
+    call = instrumentation.instrument("call", lambda value: value)
+    failing = instrumentation.instrument("failing", fail)
+    instrumentation.add_listener(listener)
+    try:
+        call(DRV_ACQUIRING)
+        with pytest.raises(SDKError):
+            failing()
+    finally:
+        instrumentation.remove_listener(listener)
+    call(DRV_SUCCESS)
+
+    assert calls[0] == ("call", DRV_ACQUIRING, None)
+    assert calls[1][0] == "failing" and isinstance(calls[1][2], SDKError)
+    assert len(calls) == 2
+
+
+def test_error_name():
+    assert instrumentation.error_name(DRV_SUCCESS) is None
+    assert instrumentation.error_name({"status": DRV_ACQUIRING}) == "DRV_ACQUIRING"
+    assert instrumentation.error_name(None, SDKError(20013)) == "SDKError"
+    # results that are not status codes
+    assert instrumentation.error_name([1, 2]) is None
+
+
+def test_instrument_class():
+    class Camera:
+        @classmethod
+        def getTemperature(cls):
+            return {"status": DRV_SUCCESS, "temperature": -20}
+
+        @classmethod
+        def _private(cls):
+            return DRV_SUCCESS
+
+    instrumentation.instrument_class(Camera)
+    assert Camera.getTemperature()["temperature"] == -20
+    Camera._private()
+
+    assert list(instrumentation.stats()["functions"]) == ["getTemperature"]
+
+
+def test_nested_call_counted_once():
+    class Camera:
+        @classmethod
+        def getTemperatureRange(cls):
+            return {"status": DRV_SUCCESS, "min": -120, "max": -10}
+
+        @classmethod
+        def getRangeTEC(cls):
+            return cls.getTemperatureRange()
+
+    instrumentation.instrument_class(Camera)
+    Camera.getRangeTEC()
+    Camera.getTemperatureRange()
+
+    functions = instrumentation.stats()["functions"]
+    assert functions["getRangeTEC"]["count"] == 1
+    assert functions["getTemperatureRange"]["count"] == 1
@@ -0,0 +1,126 @@
+import json
+
+import numpy
+import pytest
+
+from evora import instrumentation, replay
+
+DRV_SUCCESS = 20002
+DRV_ACQUIRING = 20072
+DRV_TEMP_NOT_REACHED = 20037
+
+
+def call(function, time, result=DRV_SUCCESS, args=(), duration=0.0):
+    return {
+        "type": "call",
+        "function": function,
+        "time": time,
+        "duration": duration,
+        "args": list(args),
+        "kwargs": {},
+        "result": result,
+        "error": None,
+    }
+
+
+def frame(crc32):
+    array = {"shape": [4, 4], "dtype": "uint16", "crc32": crc32}
+    return {"status": DRV_SUCCESS, "data": {"array": array}}
+
+
+# A night of two 1 s exposures, each read 0.5 s after it ended, and a cooldown
+# from 20 to -20 degrees
+NIGHT = [
+    call("getStatusTEC", 0.0, {"status": DRV_SUCCESS, "temperature": 20.0}),
+    call("setTargetTEC", 1.0, args=[-20]),
+    call("getStatusTEC", 11.0, {"status": DRV_TEMP_NOT_REACHED, "temperature": 0.0}),
+    call("getStatusTEC", 21.0, {"status": DRV_SUCCESS, "temperature": -20.0}),
+    call("setAcquisitionMode", 30.0, args=[1]),
+    call("setExposureTime", 30.0, args=[1.0]),
+    call("startAcquisition", 31.0),
+    call("getStatus", 32.0, {"funcstatus": DRV_SUCCESS, "status": DRV_ACQUIRING}),
+    call("getStatus", 32.5, {"funcstatus": DRV_SUCCESS, "status": DRV_SUCCESS}),
+    call("getAcquiredData16", 32.6, frame(1), duration=0.2),
+    call("startAcquisition", 40.0),
+    call("waitForAcquisition", 40.0, duration=1.5),
+    call("getAcquiredData16", 41.6, frame(1), duration=0.4),
+]
+
+
+def test_recorder_writes_calls(tmp_path):
+    path = tmp_path / "night.jsonl"
+    read = instrumentation.instrument("getAcquiredData16", lambda dim: {
+        "status": DRV_SUCCESS, "data": numpy.ones(dim, dtype=numpy.uint16)})
+    recorder = replay.Recorder(str(path))
+    try:
+        read((4, 4))
+    finally:
+        recorder.close()
+    read((4, 4))
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines[0]["type"] == "header" and lines[0]["version"] == replay.VERSION
+
+    calls = replay.load(str(path))
+    assert len(calls) == 1
+    assert calls[0]["args"] == [[4, 4]]
+    array = calls[0]["result"]["data"]["array"]
+    assert array["shape"] == [4, 4] and array["dtype"] == "uint16" and "crc32" in array
+
+
+def test_replay_of_night():
+    night = replay.Replay(NIGHT)
+
+    assert night.readout_time == pytest.approx(0.5)
+    assert night.summary()["frames"] == 2 and night.repeated_frames == 1
+    # each call takes its recorded time in turn, and waits none
+    assert [night.latency("getAcquiredData16") for _ in range(3)] == [0.2, 0.4, 0.2]
+    assert night.latency("waitForAcquisition") == 0.0
+
+    curve, = night.cooling_curves
+    assert curve["target"] == -20
+    assert curve["fraction"] == [0.5, 0.0]
+    assert curve["status"] == [DRV_TEMP_NOT_REACHED, DRV_SUCCESS]
+
+
+def test_cooling_curve_replayed(monkeypatch):
+    night = replay.Replay(NIGHT)
+    assert night.temperature() is None
+
+    now = 1000.0
+    monkeypatch.setattr(replay.time, "time", lambda: now)
+    # from 10 to -30 degrees, along the recorded curve
+    night.set_target(-30, 10.0)
+    now += 10
+    assert night.temperature() == (pytest.approx(-10.0), DRV_TEMP_NOT_REACHED)
+    now += 100
+    assert night.temperature() == (pytest.approx(-30.0), DRV_SUCCESS)
+
+
+def test_install(tmp_path):
+    path = tmp_path / "night.jsonl"
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in NIGHT))
+
+    class Camera:
+        current_temp = 10.0
+        readout_time = 0.0
+
+        @classmethod
+        def setTargetTEC(cls, temperature):
+            return DRV_SUCCESS
+
+        @classmethod
+        def getStatusTEC(cls):
+            return {"status": DRV_SUCCESS, "temperature": cls.current_temp}
+
+    instrumentation.instrument_class(Camera)
+    installed = replay.install(Camera, str(path))
+
+    assert Camera.replay is installed
+    assert Camera.readout_time == pytest.approx(0.5)
+    assert Camera.getStatusTEC()["temperature"] == 10.0
+    Camera.setTargetTEC(-20)
+    # the cooldown has only just started
+    status = Camera.getStatusTEC()
+    assert status["temperature"] == pytest.approx(10.0, abs=1)
+    assert status["status"] == DRV_TEMP_NOT_REACHED
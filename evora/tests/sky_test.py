@@ -0,0 +1,60 @@
+import numpy
+import pytest
+
+from evora.sky import SkySimulator
+
+
+def test_seeded():
+    first = SkySimulator(shape=(64, 64), seed=3).render(1.0)
+    second = SkySimulator(shape=(64, 64), seed=3).render(1.0)
+    assert numpy.array_equal(first, second)
+    assert first.dtype == numpy.uint16 and first.shape == (64, 64)
+
+
+def test_dark_frame_is_bias_and_dark_current():
+    sky = SkySimulator(shape=(128, 128), dark_current=0.0, read_noise=2.0)
+    frame = sky.render(10.0, shutter_open=False)
+    assert frame.mean() == pytest.approx(sky.bias, abs=1)
+
+
+def test_star_flux_kept():
+    sky = SkySimulator(shape=(128, 128), stars=20, sky=0.0, dark_current=0.0)
+    total = sky.stars["flux"].sum() * 2.0
+    # stars near the edges spill part of their flux off the detector
+    assert 0.5 * total < sky.expected(2.0).sum() <= total * (1 + 1e-9)
+
+
+def test_region_and_binning():
+    sky = SkySimulator(shape=(128, 128))
+    whole = sky.expected(1.0)
+    region = sky.expected(1.0, region=(11, 50, 21, 40))
+    assert numpy.allclose(region, whole[20:40, 10:50])
+
+    binned = sky.render(1.0, region=(11, 50, 21, 40), binning=(2, 4))
+    assert binned.shape == (5, 20)
+
+
+def test_filter_and_focus():
+    sky = SkySimulator(shape=(64, 64))
+    r_band = sky.expected(1.0).sum()
+    sky.filter_name = "Ha"
+    assert sky.expected(1.0).sum() < 0.2 * r_band
+
+    in_focus = sky.psf_sigma()
+    sky.focus = sky.best_focus + 100
+    defocused = sky.psf_sigma()
+    assert defocused > in_focus
+    # either side of best focus alike
+    sky.focus = sky.best_focus - 100
+    assert sky.psf_sigma() == pytest.approx(defocused)
+
+
+def test_wcs_header():
+    sky = SkySimulator(shape=(1024, 1024))
+    header = sky.wcs_header()
+    assert header["CRPIX1"] == pytest.approx(512.5)
+    binned = sky.wcs_header(hbin=2, vbin=2)
+    assert binned["CRPIX1"] == pytest.approx(256.5)
+    assert binned["CD1_1"] == pytest.approx(2 * header["CD1_1"])
+
+    assert SkySimulator(shape=(64, 64), center=None).wcs_header() == {}
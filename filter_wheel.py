@@ -0,0 +1,219 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+# The wheel controller, overridable for testing against a simulated server
+DEFAULT_HOST = os.environ.get('EVORA_WHEEL_HOST', '72.233.250.84')
+DEFAULT_PORT = int(os.environ.get('EVORA_WHEEL_PORT', 9999))
+
+# Number of filter positions on the wheel
+POSITIONS = 6
+
+
+class FilterWheelError(Exception):
+    '''The filter wheel could not be reached or refused a command.'''
+
+
+class FilterWheel:
+    '''Client for the filter wheel controller.
+
+    Keeps one connection to the controller open and reuses it for every
+    command instead of connecting per command, reconnecting when it drops.
+    Commands are serialized, so callers on different threads never interleave
+    on the connection. The last known position is cached, so reading it does
+    not need a round trip.
+
+    The controller takes one command per line and answers ``OK[,<reply>]`` or
+    ``ERR,<message>``.
+
+    Parameters
+    ----------
+    host, port
+        The address of the controller.
+    timeout
+        Seconds to wait for connecting and for the reply to quick commands.
+    move_timeout
+        Seconds to wait for the reply to ``move`` and ``home``, which only
+        answer once the wheel has stopped.
+    on_command
+        Optional ``on_command(command, seconds, error)`` called after each
+        command with its round trip time and the `FilterWheelError` it
+        raised, if any, to collect metrics.
+
+    '''
+
+    def __init__(
+        self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=5.0, move_timeout=60.0, on_command=None
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.move_timeout = move_timeout
+        self.on_command = on_command
+
+        self.position = None
+        self.position_time = None
+        self.moving = False
+
+        self._socket = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def send(self, command, timeout=None):
+        '''Sends a command and returns the reply that follows ``OK``.
+
+        A connection that turns out to have dropped since the last command is
+        reopened and the command sent once more. A command that times out is
+        not retried, since the wheel may still be acting on it.
+
+        Raises
+        ------
+        FilterWheelError
+            If the controller cannot be reached, does not answer in time or
+            answers ``ERR``.
+
+        '''
+
+        start_time = time.perf_counter()
+        error = None
+        try:
+            return self._send(command, timeout)
+        except FilterWheelError as err:
+            error = err
+            raise
+        finally:
+            if self.on_command is not None:
+                self.on_command(command, time.perf_counter() - start_time, error)
+
+    def get_position(self, refresh=False):
+        '''Returns the filter position, from the cache unless ``refresh``.'''
+
+        if refresh or self.position is None:
+            try:
+                self._set_position(int(self.send('get')))
+            except ValueError:
+                raise FilterWheelError('Filter wheel returned an invalid position')
+        return self.position
+
+    def move(self, position):
+        '''Moves the wheel to ``position`` and blocks until it is there.'''
+        self._move(f'move {int(position)}', int(position))
+
+    def home(self):
+        '''Homes the wheel, which leaves it at position 0.'''
+        self._move('home', 0)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _move(self, command, position):
+        self.moving = True
+        try:
+            self.send(command, timeout=self.move_timeout)
+        except FilterWheelError:
+            # the wheel may have stopped anywhere
+            self.position = None
+            raise
+        finally:
+            self.moving = False
+        self._set_position(position)
+
+    def _set_position(self, position):
+        self.position = position
+        self.position_time = time.time()
+
+    def _send(self, command, timeout):
+        with self._lock:
+            try:
+                received = self._exchange(command, timeout or self.timeout)
+            except (BrokenPipeError, ConnectionError, EOFError) as err:
+                logging.warning(f'Filter wheel connection lost ({err}), reconnecting')
+                self._close()
+                try:
+                    received = self._exchange(command, timeout or self.timeout)
+                except (OSError, EOFError) as err:
+                    self._close()
+                    raise FilterWheelError(f'Filter wheel unreachable: {err}') from err
+            except OSError as err:
+                # includes timeouts; the reply could still arrive on this connection
+                self._close()
+                raise FilterWheelError(f'Filter wheel did not answer {command!r}: {err}') from err
+
+        status, _, reply = received.partition(',')
+        if status != 'OK':
+            raise FilterWheelError(reply or received)
+        return reply
+
+    def _exchange(self, command, timeout):
+        if self._socket is None:
+            self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._reader = self._socket.makefile('rb')
+
+        self._socket.settimeout(timeout)
+        self._socket.sendall((command + '\n').encode())
+        line = self._reader.readline()
+        if not line:
+            raise EOFError('connection closed by the filter wheel')
+        return line.decode().strip()
+
+    def _close(self):
+        if self._socket is not None:
+            try:
+                self._reader.close()
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._reader = None
+
+
+class DummyFilterWheel:
+    '''Stand-in for `FilterWheel` when debugging without the wheel.
+
+    Parameters
+    ----------
+    travel_time
+        Seconds a move or home takes.
+    on_command
+        As for `FilterWheel`, called after each move.
+
+    '''
+
+    def __init__(self, travel_time=2.0, on_command=None):
+        self.travel_time = travel_time
+        self.on_command = on_command
+
+        self.position = 0
+        self.position_time = time.time()
+        self.moving = False
+
+        self._lock = threading.Lock()
+
+    def get_position(self, refresh=False):
+        return self.position
+
+    def move(self, position):
+        position = int(position)
+        if not 0 <= position < POSITIONS:
+            raise FilterWheelError(f'Invalid filter position {position}')
+
+        start_time = time.perf_counter()
+        with self._lock:
+            self.moving = True
+            try:
+                time.sleep(self.travel_time)
+            finally:
+                self.moving = False
+            self.position = position
+            self.position_time = time.time()
+        if self.on_command is not None:
+            self.on_command(f'move {position}', time.perf_counter() - start_time, None)
+
+    def home(self):
+        self.move(0)
+
+    def close(self):
+        pass
@@ -0,0 +1,252 @@
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from astropy.io import fits
+
+# Tile compression algorithms a frame may be written with, by the names
+# captures use; both are lossless for integer data
+COMPRESSION_TYPES = {
+    'rice': 'RICE_1',
+    'hcompress': 'HCOMPRESS_1',
+}
+
+
+class WriteJob:
+    '''A FITS file waiting to be written, or that has been written.'''
+
+    def __init__(self, job_id, file_name, data, header, overwrite, compression=None):
+        self.id = job_id
+        self.file_name = file_name
+        self.data = data
+        self.header = header
+        self.overwrite = overwrite
+        self.compression = compression
+
+        self.status = 'queued'
+        self.error = ''
+        self.queued_at = time.time()
+        self.duration = None
+
+        # the size of the file once written, and how it was compressed
+        self.size = None
+        self.compression_ratio = None
+        self.compression_time = None
+
+        # resolves to the file name once written, or to the write error
+        self.future = Future()
+
+    def serialize(self):
+        return {
+            'id': self.id,
+            'filename': os.path.basename(self.file_name),
+            'url': self.file_name,
+            'status': self.status,
+            'error': self.error,
+            'queued_at': self.queued_at,
+            'duration': self.duration,
+            'compression': self.compression,
+            'size': self.size,
+            'compression_ratio': self.compression_ratio,
+            'compression_time': self.compression_time,
+        }
+
+
+class FitsWriter:
+    '''Writes FITS files from a bounded queue in background threads.
+
+    Captured frames are submitted together with their header and written
+    off the request thread, so the camera can start the next exposure while
+    the previous frame is still being serialized. When the queue is full
+    `submit` blocks, which keeps memory bounded if the disk falls behind.
+
+    Frames may be tile compressed, which the writer threads also do. A
+    compressed file has an empty primary HDU followed by a `CompImageHDU`
+    holding the frame and its header.
+
+    Parameters
+    ----------
+    max_queued
+        The number of frames that may wait to be written.
+    workers
+        The number of writer threads.
+    history
+        The number of finished jobs whose status is kept for `status`.
+    fsync
+        Whether to fsync each file before reporting it as written.
+    compression
+        The compression of frames submitted without one, a key of
+        `COMPRESSION_TYPES`, or None to write them uncompressed.
+
+    '''
+
+    def __init__(self, max_queued=8, workers=1, history=256, fsync=True, compression=None):
+        if compression is not None and compression not in COMPRESSION_TYPES:
+            raise ValueError(f'Unknown FITS compression {compression!r}')
+
+        self.fsync = fsync
+        self.history = history
+        self.compression = compression
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+        self._threads = [
+            threading.Thread(target=self._run, name=f'fits-writer-{n}', daemon=True)
+            for n in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def queue_depth(self):
+        '''The number of frames waiting to be written.'''
+        return self._queue.qsize()
+
+    def submit(self, file_name, data, header=None, overwrite=False, timeout=None, compression=''):
+        '''Queues a frame to be written.
+
+        ``data`` is written as is, so it must not be modified until the job
+        has completed.
+
+        Parameters
+        ----------
+        file_name
+            The path of the file to write.
+        data
+            The image data.
+        header
+            The `astropy.io.fits.Header` of the primary HDU.
+        overwrite
+            Whether an existing file may be replaced.
+        timeout
+            Seconds to wait for room in the queue before raising `queue.Full`.
+            Waits indefinitely if None.
+        compression
+            A key of `COMPRESSION_TYPES`, or None to write the frame
+            uncompressed. Defaults to the compression of the writer.
+
+        Returns
+        -------
+        job
+            The `WriteJob`. Its ``future`` resolves once the file is written.
+
+        '''
+
+        if compression == '':
+            compression = self.compression
+        elif compression is not None and compression not in COMPRESSION_TYPES:
+            raise ValueError(f'Unknown FITS compression {compression!r}')
+
+        with self._lock:
+            job = WriteJob(self._next_id, file_name, data, header, overwrite, compression)
+            self._next_id += 1
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+
+        try:
+            self._queue.put(job, timeout=timeout)
+        except queue.Full:
+            self._finish(job, error='Writer queue is full')
+            raise
+
+        return job
+
+    def status(self, job_id=None):
+        '''Returns the status of one job, or of the writer and recent jobs.'''
+
+        with self._lock:
+            if job_id is not None:
+                job = self._jobs.get(job_id)
+                return job.serialize() if job is not None else None
+
+            return {
+                'queue_depth': self.queue_depth,
+                'jobs': [job.serialize() for job in self._jobs.values()],
+            }
+
+    def join(self):
+        '''Blocks until every queued frame has been written.'''
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._write(job)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, job):
+        job.status = 'writing'
+        start_time = time.monotonic()
+
+        # Written next to the destination and renamed into place, so readers
+        # never see a partially written file.
+        partial_name = job.file_name + '.part'
+        try:
+            if not job.overwrite and os.path.exists(job.file_name):
+                raise FileExistsError(f'{job.file_name} already exists')
+
+            with open(partial_name, 'wb') as file:
+                if job.compression is None:
+                    fits.PrimaryHDU(job.data, header=job.header).writeto(file)
+                else:
+                    file.write(self._compress(job))
+                job.size = file.tell()
+                file.flush()
+                if self.fsync:
+                    os.fsync(file.fileno())
+            os.replace(partial_name, job.file_name)
+        except Exception as err:
+            logging.exception(f'Failed to write {job.file_name}')
+            if os.path.exists(partial_name):
+                os.remove(partial_name)
+            job.duration = time.monotonic() - start_time
+            self._finish(job, error=str(err), exception=err)
+            return
+
+        job.duration = time.monotonic() - start_time
+        self._finish(job)
+
+    def _compress(self, job):
+        # Compressed in memory first, so the time taken by compression is
+        # known apart from that of writing
+        start_time = time.monotonic()
+        hdul = fits.HDUList([
+            fits.PrimaryHDU(),
+            fits.CompImageHDU(
+                job.data, header=job.header, compression_type=COMPRESSION_TYPES[job.compression]
+            ),
+        ])
+        buffer = io.BytesIO()
+        hdul.writeto(buffer)
+        compressed = buffer.getvalue()
+        job.compression_time = time.monotonic() - start_time
+
+        job.compression_ratio = job.data.nbytes / len(compressed)
+        logging.debug(
+            f'Compressed {os.path.basename(job.file_name)} {job.compression_ratio:.2f}x'
+            f' with {job.compression} in {job.compression_time * 1e3:.0f} ms'
+        )
+        return compressed
+
+    def _finish(self, job, error='', exception=None):
+        # the frame is no longer needed once its fate is known
+        job.data = None
+
+        if error:
+            job.status = 'failed'
+            job.error = error
+            job.future.set_exception(exception or OSError(error))
+        else:
+            job.status = 'written'
+            job.future.set_result(job.file_name)
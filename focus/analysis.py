@@ -0,0 +1,275 @@
+"""
+Analyzes focus datapoints in a pool of worker processes.
+
+A datapoint is queued as a job and measured by a worker while the request
+that added it returns. Its metrics are then merged into its session in
+focuser position order, whatever order the jobs finish in, and the focus
+curves refit.
+"""
+
+import bisect
+import io
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from astropy.io import fits
+
+from focus import settings
+from focus.focus_assist import find_focus_position, stat_for_image
+
+# Number of jobs kept for polling, the oldest finished ones dropped first
+JOB_HISTORY = 256
+
+# Guards the sessions jobs are merged into and the jobs themselves
+lock = threading.Lock()
+
+_jobs = OrderedDict()
+_ids = itertools.count(1)
+_pool = None
+
+# Simulated sky measured instead of the requested files when debugging, one
+# per worker process
+_debug_sky = None
+
+
+class FocusJob:
+    """The analysis of one datapoint of a session."""
+
+    def __init__(self, job_id, session, filename, focuser_position, on_merge=None):
+        self.id = job_id
+        self.session = session
+        self.filename = filename
+        self.focuser_position = focuser_position
+        self.on_merge = on_merge
+
+        self.status = "queued"
+        self.error = ""
+        self.metrics = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "sid": self.session.id,
+            "filename": self.filename,
+            "focuserPosition": self.focuser_position,
+            "status": self.status,
+            "error": self.error,
+            "metrics": self.metrics,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def analyze(session):
+    fwhm_metrics = session.fwhm_metrics
+    focuser_positons = session.focuser_positons
+
+    hfd_curve_dps = {
+        "sep": [dp['sep'] for dp in session.hfd_metrics],
+        "my": [dp['my'] for dp in session.hfd_metrics],
+        "PHD": [dp['PHD'] for dp in session.hfd_metrics]
+    }
+    fwhm_min, hfd_min, fwhm_fit, hfd_fits = find_focus_position(
+        focuser_positons, fwhm_metrics, hfd_curve_dps)
+    session.fwhm_fit = fwhm_fit
+    session.hfd_fits = hfd_fits
+    session.predicted_min_fwhm = fwhm_min
+    session.predicted_min_hfd = hfd_min
+
+    return fwhm_min, hfd_min
+
+
+def measure(fits_file_url, simulated_focus=None):
+    """
+    Returns the median FWHM and HFDs of the sources of a frame. Runs in a
+    worker process.
+
+    When simulated_focus is given, a frame of the simulated sky at that
+    focuser position is measured instead of the file.
+    """
+    if simulated_focus is not None:
+        fits_file_url = simulated_frame(simulated_focus)
+
+    median_fwhm, median_sep_hfd, median_my_hfd, median_phd_hfd = stat_for_image(
+        fits_file_url)
+    return {
+        "fwhm": float(median_fwhm),
+        "hfd": {
+            "sep": float(median_sep_hfd),
+            "my": float(median_my_hfd),
+            "PHD": float(median_phd_hfd)
+        }
+    }
+
+
+def simulated_frame(focuser_position):
+    """Renders a frame of the simulated sky at a focuser position, as a FITS file object."""
+    global _debug_sky
+    if _debug_sky is None:
+        from evora.sky import SkySimulator
+        _debug_sky = SkySimulator(best_focus=settings.DEBUG_BEST_FOCUS)
+
+    _debug_sky.focus = focuser_position
+    file = io.BytesIO()
+    fits.PrimaryHDU(_debug_sky.render(settings.DEBUG_EXPTIME)).writeto(file)
+    file.seek(0)
+    return file
+
+
+def start():
+    """
+    Starts the worker processes, if not yet started.
+
+    The workers are forked, and a process forked while other threads run
+    inherits any lock they held, so call it before the server starts its
+    threads, as app.py does on import. Otherwise the workers are started by
+    the first job.
+
+    A pool broken by a dead worker is replaced from the thread of the job
+    that finds it broken, accepting that risk: the workers only measure
+    frames, and a spawned pool would import app.py again.
+    """
+    global _pool
+    with lock:
+        if _pool is None:
+            # Forked rather than spawned: a spawned worker imports the main
+            # module again, which is app.py when the server is run directly
+            # and would connect to the camera
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            _pool = ProcessPoolExecutor(settings.ANALYSIS_WORKERS, mp_context=context)
+            # a pool forks all of its workers on its first submit
+            _pool.submit(int)
+        return _pool
+
+
+def _executor():
+    return start()
+
+
+def _restart(broken):
+    global _pool
+    with lock:
+        # another job may have replaced it already
+        if _pool is not broken:
+            return
+        logging.warning("Focus analysis pool broken, restarting it")
+        broken.shutdown(wait=False)
+        _pool = None
+    start()
+
+
+def submit(session, filename, fits_file_url, focuser_position, on_merge=None):
+    """
+    Queues the analysis of a datapoint, to be merged into session when done.
+    on_merge(session) is then called under the lock, e.g. to store it.
+
+    Returns:
+    - the FocusJob
+    """
+    with lock:
+        job = FocusJob(next(_ids), session, filename, focuser_position, on_merge)
+        session.pending_jobs.append(job.id)
+        _jobs[job.id] = job
+        _forget_old_jobs()
+
+    simulated_focus = focuser_position if settings.DEBUG else None
+    try:
+        pool = _executor()
+        try:
+            future = pool.submit(measure, fits_file_url, simulated_focus)
+        except BrokenProcessPool:
+            # a worker died, which breaks the pool for every later job
+            _restart(pool)
+            future = _executor().submit(measure, fits_file_url, simulated_focus)
+    except Exception as err:
+        # the job would otherwise stay queued
+        with lock:
+            job.status = "failed"
+            job.error = str(err) or type(err).__name__
+            _finish(job)
+        raise
+    future.add_done_callback(partial(_merge, job))
+    return job
+
+
+def get(job_id):
+    """Returns the job of an id, or None if it is unknown or was forgotten."""
+    with lock:
+        return _jobs.get(job_id)
+
+
+def state(session):
+    """Returns session.serialize(), consistent with any merge in progress."""
+    with lock:
+        return session.serialize()
+
+
+def _forget_old_jobs():
+    for job_id in list(_jobs):
+        if len(_jobs) <= JOB_HISTORY:
+            break
+        if _jobs[job_id].finished.is_set():
+            del _jobs[job_id]
+
+
+def _merge(job, future):
+    # Called by the pool once a job has finished, from its own thread
+    try:
+        metrics = future.result()
+    except Exception as err:
+        logging.error(f"Analysis of {job.filename} failed: {err!r}")
+        with lock:
+            job.status = "failed"
+            job.error = str(err) or type(err).__name__
+            _finish(job)
+        return
+
+    logging.info(f"filename: {job.filename} focuser_position: {job.focuser_position} metrics: {metrics}")
+    with lock:
+        session = job.session
+        if session.deleted:
+            # reset while the job ran
+            job.status = "discarded"
+            job.metrics = metrics
+            _finish(job)
+            return
+
+        index = bisect.bisect_right(session.focuser_positons, job.focuser_position)
+        session.focuser_positons.insert(index, job.focuser_position)
+        session.fwhm_metrics.insert(index, metrics["fwhm"])
+        session.hfd_metrics.insert(index, metrics["hfd"])
+        session.files.insert(index, job.filename)
+        session.version += 1
+
+        job.status = "done"
+        job.metrics = metrics
+        if len(session.focuser_positons) >= 3:
+            try:
+                analyze(session=session)
+            except Exception as err:
+                logging.exception(f"Refitting the focus curves of session {session.id} failed")
+                job.error = f"Fit failed: {err}"
+        if job.on_merge is not None:
+            try:
+                job.on_merge(session)
+            except Exception:
+                logging.exception(f"Storing focus session {session.id} failed")
+        _finish(job)
+
+
+def _finish(job):
+    job.finished_at = time.time()
+    if job.id in job.session.pending_jobs:
+        job.session.pending_jobs.remove(job.id)
+    job.finished.set()
@@ -1,16 +1,17 @@
 from typing import Dict
 from flask import Response
 from flask import Flask, jsonify, make_response, send_file
-from datetime import datetime, timedelta
 from focus.models import FocusSession
 from focus import settings
 from flask import current_app, flash, jsonify, make_response, redirect, request, url_for
 
-from focus.focus_assist import find_focus_position, stat_for_image, plot_fit
+from focus import analysis
+from focus.storage import SessionStore
+from focus.focus_assist import focus_curves, plot_fit
 
-import random
-from glob import glob
 import logging
+import threading
+from collections import OrderedDict
 logging.basicConfig(level=logging.INFO)
 
 from flask import Blueprint
@@ -18,69 +19,96 @@ from flask import Blueprint
 blueprint = Blueprint('focus_assist', __name__)
 
 
-SessionStorage: {str: FocusSession} = {}
+SessionStorage = SessionStore(
+    settings.SESSION_MAX, settings.SESSION_TTL, settings.SESSION_DATABASE)
 
+# Longest a job poll waits for the job to finish, in seconds
+MAX_POLL_WAIT = 60
 
-def analyze(session):
-    fwhm_metrics = session.fwhm_metrics
-    focuser_positons = session.focuser_positons
+# Number of rendered plots kept, by session and version
+PLOT_CACHE_SIZE = 16
 
-    hfd_curve_dps = {
-        "sep": [dp['sep'] for dp in session.hfd_metrics],
-        "my": [dp['my'] for dp in session.hfd_metrics],
-        "PHD": [dp['PHD'] for dp in session.hfd_metrics]
-    }
-    fwhm_min, hfd_min, fwhm_fit, hfd_fits = find_focus_position(
-        focuser_positons, fwhm_metrics, hfd_curve_dps)
-    session.fwhm_fit = fwhm_fit
-    session.hfd_fits = hfd_fits
-    session.predicted_min_fwhm = fwhm_min
-    session.predicted_min_hfd = hfd_min
-
-    return fwhm_min, hfd_min
+_plots = OrderedDict()
+_plots_lock = threading.Lock()
 
 
 @blueprint.route('/plot/<sid>')
 def retrieve_plot(sid):
-    if sid not in SessionStorage:
+    """
+    Returns the focus curves of a session as a PNG, or with ?format=json as
+    their datapoints, fits and minima for the browser to draw. Either is
+    tagged with the session's version, so unchanged curves are answered
+    with 304 Not Modified.
+    """
+    session = SessionStorage.get(sid)
+    if session is None:
         return Response(status=404)
-    session = SessionStorage[sid]
-    fwhm_metrics = session.fwhm_metrics
-    focuser_positons = session.focuser_positons
-    fwhm_fit = session.fwhm_fit
-    hfd_fits = session.hfd_fits
-    hfd_curve_dps = {
-        "sep": [dp['sep'] for dp in session.hfd_metrics],
-        "my": [dp['my'] for dp in session.hfd_metrics],
-        "PHD": [dp['PHD'] for dp in session.hfd_metrics]
-    }
-    image = plot_fit(focuser_positons, fwhm_metrics,
-                     hfd_curve_dps, fwhm_fit, hfd_fits)
-    return Response(image, mimetype='image/png')
+    # jobs finishing meanwhile merge into the session
+    with analysis.lock:
+        etag = f"{session.id}-{session.created}-{session.version}"
+        fwhm_metrics = list(session.fwhm_metrics)
+        focuser_positons = list(session.focuser_positons)
+        fwhm_fit = session.fwhm_fit
+        hfd_fits = dict(session.hfd_fits)
+        hfd_curve_dps = {
+            "sep": [dp['sep'] for dp in session.hfd_metrics],
+            "my": [dp['my'] for dp in session.hfd_metrics],
+            "PHD": [dp['PHD'] for dp in session.hfd_metrics]
+        }
+
+    as_json = request.args.get('format') == 'json'
+    if as_json:
+        etag += "-json"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif as_json:
+        response = jsonify(focus_curves(focuser_positons, fwhm_metrics,
+                                        hfd_curve_dps, fwhm_fit, hfd_fits))
+    else:
+        with _plots_lock:
+            image = _plots.get(etag)
+            if image is not None:
+                _plots.move_to_end(etag)
+        if image is None:
+            image = plot_fit(focuser_positons, fwhm_metrics,
+                             hfd_curve_dps, fwhm_fit, hfd_fits)
+            with _plots_lock:
+                _plots[etag] = image
+                while len(_plots) > PLOT_CACHE_SIZE:
+                    _plots.popitem(last=False)
+        response = Response(image, mimetype='image/png')
+
+    response.set_etag(etag)
+    # cached, but checked against the session every time
+    response.cache_control.no_cache = True
+    return response
 
 
 @blueprint.route('/api/reset', methods=['POST'])
 def reset():
+    """Deletes a session. Its jobs still pending are dropped when they finish."""
     payload = request.get_json()
     sid = payload['sid']
-    if sid in SessionStorage:
-        del SessionStorage[sid]
+    SessionStorage.delete(sid)
     return jsonify({
     })
 
 
 @blueprint.route('/api/add_focus_datapoint', methods=['POST'])
 def add_focus_datapoint():
-    clean_old_sessions()
+    """
+    Queues the analysis of a frame and returns the state of its session at
+    once, with the queued job under "job". The frame's metrics are merged
+    into the session when the job finishes, which /api/focus_job/<job_id>
+    reports. With "wait": true, returns once the job has finished instead,
+    or after MAX_POLL_WAIT seconds.
+    """
     payload = request.get_json()
     sid = payload['sid']
-    if sid not in SessionStorage:
-        SessionStorage[sid] = FocusSession(id=sid)
-    session = SessionStorage[sid]
+    session = SessionStorage.get_or_create(sid)
 
     filename: str = payload['filename']
     focuser_position = int(payload['focuserPosition'])
-    session.focuser_positons.append(focuser_position)
 
     logging.info(f"filename: {filename} focuser_position: {focuser_position}")
 
@@ -89,32 +117,51 @@ def add_focus_datapoint():
     else:
         fits_file_url = filename
 
-    if settings.DEBUG:
-        images = glob(
-            '/Users/siyu/Proj/evora_autofocus/focus_test/manual/*.fits')
-        fits_file_url = random.choice(images)
-
-    median_fwhm, median_sep_hfd, median_my_hfd, median_phd_hfd = stat_for_image(
-        fits_file_url)
-    session.hfd_metrics.append({
-        "sep": median_sep_hfd,
-        "my": median_my_hfd,
-        "PHD": median_phd_hfd
-    })
-    session.fwhm_metrics.append(median_fwhm)
-    session.files.append(filename)
-    logging.info(
-        f"median_fwhm: {median_fwhm} median_sep_hfd: {median_sep_hfd} median_my_hfd: {median_my_hfd} median_phd_hfd: {median_phd_hfd}")
-    if len(session.focuser_positons) >= 3:
-        analyze(session=session)
-    return jsonify(session.serialize())
-
-
-def clean_old_sessions():
-    now = datetime.now()
+    job = analysis.submit(session, filename, fits_file_url, focuser_position,
+                          on_merge=SessionStorage.save)
+    if payload.get('wait'):
+        job.finished.wait(MAX_POLL_WAIT)
+    return job_reply(job)
+
+
+@blueprint.route('/api/focus_job/<int:job_id>')
+def focus_job(job_id):
+    """
+    Returns a job and the state of its session. With ?wait=<seconds>, waits
+    up to that long for the job to finish first.
+    """
+    job = analysis.get(job_id)
+    if job is None:
+        return Response(status=404)
+    wait = request.args.get('wait', 0, type=float)
+    if wait > 0:
+        job.finished.wait(min(wait, MAX_POLL_WAIT))
+    return job_reply(job)
 
-    for sid in list(SessionStorage):
-        timestamp = datetime.fromtimestamp(int(sid)/1000)
-        if now - timestamp > timedelta(days=30):
-            del SessionStorage[sid]
 
+@blueprint.route('/api/session/<sid>')
+def get_session(sid):
+    """Returns the state of a session, including one stored on an earlier night."""
+    session = SessionStorage.get(sid)
+    if session is None:
+        return Response(status=404)
+    return jsonify(analysis.state(session))
+
+
+@blueprint.route('/api/sessions')
+def list_sessions():
+    """
+    Returns a summary of the sessions created between ?since= and ?until=,
+    as Unix times, newest first, at most ?limit= of them.
+    """
+    return jsonify(SessionStorage.history(
+        since=request.args.get('since', type=float),
+        until=request.args.get('until', type=float),
+        limit=request.args.get('limit', 100, type=int),
+    ))
+
+
+def job_reply(job):
+    reply = analysis.state(job.session)
+    reply['job'] = job.serialize()
+    return jsonify(reply)
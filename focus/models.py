@@ -1,7 +1,12 @@
 from dataclasses import dataclass, field
+import io
 import json 
+import time
 import numpy as np
 
+# HFD methods measured for each datapoint, in the order they are stored
+HFD_METHODS = ("sep", "my", "PHD")
+
 
 @dataclass
 class FocusSession():
@@ -10,6 +15,7 @@ class FocusSession():
     fwhm_metrics: list = field(default_factory=list)   # list of values
     hfd_metrics: list = field(default_factory=list)   # list of dicts containing values for each method
     files: list = field(default_factory=list)
+    pending_jobs: list = field(default_factory=list)   # ids of datapoints still being analyzed
     
     fwhm_fit: np.ndarray = None
     hfd_fits: dict[np.ndarray] = field(default_factory=dict)
@@ -17,16 +23,76 @@ class FocusSession():
     predicted_min_fwhm: float = 0
     predicted_min_hfd: dict = field(default_factory=dict)
 
+    created: float = field(default_factory=time.time)
+    updated: float = field(default_factory=time.time)
+    version: int = 0   # bumped whenever a datapoint is added
+    deleted: bool = False   # set when reset, so late analysis results are dropped
+
     def serialize(self):
         return {
             "id": self.id,
-            "focuser_positons": self.focuser_positons,
-            "fwhm_metrics": self.fwhm_metrics,
-            "hfd_metrics": self.hfd_metrics,
-            "files": self.files,
+            "version": self.version,
+            "focuser_positons": list(self.focuser_positons),
+            "fwhm_metrics": list(self.fwhm_metrics),
+            "hfd_metrics": list(self.hfd_metrics),
+            "files": list(self.files),
+            "pending_jobs": list(self.pending_jobs),
             "fwhm_fit": list(self.fwhm_fit) if self.fwhm_fit is not None else None,
             "hfd_fits": {method: list(fit) for method, fit in self.hfd_fits.items()} if self.hfd_fits is not None else None,
             "predicted_min_fwhm": self.predicted_min_fwhm,
             "predicted_min_hfd": self.predicted_min_hfd
         }
-    
\ No newline at end of file
+
+    def to_npz(self):
+        """
+        Returns the session as the bytes of an .npz archive, with the metrics
+        of its datapoints as arrays rather than lists of dicts. Pending jobs
+        are left out.
+        """
+        hfd_fit_methods = list(self.hfd_fits or {})
+        file = io.BytesIO()
+        np.savez_compressed(
+            file,
+            id=np.array(self.id),
+            created=np.array(self.created),
+            updated=np.array(self.updated),
+            version=np.array(self.version),
+            focuser_positions=np.array(self.focuser_positons, dtype=np.int64),
+            fwhm_metrics=np.array(self.fwhm_metrics, dtype=np.float64),
+            hfd_methods=np.array(HFD_METHODS),
+            hfd_metrics=np.array(
+                [[dp[method] for method in HFD_METHODS] for dp in self.hfd_metrics],
+                dtype=np.float64).reshape(-1, len(HFD_METHODS)),
+            files=np.array(self.files, dtype=str),
+            fwhm_fit=np.array([] if self.fwhm_fit is None else self.fwhm_fit, dtype=np.float64),
+            hfd_fit_methods=np.array(hfd_fit_methods, dtype=str),
+            hfd_fits=np.array([self.hfd_fits[method] for method in hfd_fit_methods],
+                              dtype=np.float64) if hfd_fit_methods else np.empty((0, 0)),
+            predicted_min_fwhm=np.array(self.predicted_min_fwhm, dtype=np.float64),
+            predicted_min_hfd=np.array(
+                [self.predicted_min_hfd.get(method, np.nan) for method in hfd_fit_methods],
+                dtype=np.float64),
+        )
+        return file.getvalue()
+
+    @classmethod
+    def from_npz(cls, data):
+        """Returns the session stored by to_npz."""
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            hfd_methods = archive["hfd_methods"].tolist()
+            hfd_fit_methods = archive["hfd_fit_methods"].tolist()
+            fwhm_fit = archive["fwhm_fit"]
+            return cls(
+                id=str(archive["id"]),
+                created=float(archive["created"]),
+                updated=float(archive["updated"]),
+                version=int(archive["version"]) if "version" in archive.files else 0,
+                focuser_positons=archive["focuser_positions"].tolist(),
+                fwhm_metrics=archive["fwhm_metrics"].tolist(),
+                hfd_metrics=[dict(zip(hfd_methods, row)) for row in archive["hfd_metrics"].tolist()],
+                files=archive["files"].tolist(),
+                fwhm_fit=fwhm_fit if fwhm_fit.size else None,
+                hfd_fits=dict(zip(hfd_fit_methods, archive["hfd_fits"])),
+                predicted_min_fwhm=float(archive["predicted_min_fwhm"]),
+                predicted_min_hfd=dict(zip(hfd_fit_methods, archive["predicted_min_hfd"].tolist())),
+            )
@@ -1,6 +1,24 @@
+import os
+
 DEBUG = False
 
+# Focuser position of best focus and exposure time of simulated debug frames
+DEBUG_BEST_FOCUS = 0
+DEBUG_EXPTIME = 5.0
+
 BASEFILE_PATH = "http://72.233.250.83/data/ecam/"
 
+# Worker processes analyzing focus datapoints
+ANALYSIS_WORKERS = 2
+
+# Sessions kept in memory, and seconds each is kept since it was last used
+SESSION_MAX = 64
+SESSION_TTL = 30 * 24 * 3600
+# SQLite database storing every session across restarts, if set
+SESSION_DATABASE = os.environ.get("EVORA_FOCUS_DB")
+
 # SEP
-SEP_MIN_AREA = 40
\ No newline at end of file
+SEP_MIN_AREA = 40
+# FWHM: "batched" measures every source in one pass, "photutils" fits a
+# RadialProfile per source, which the batched estimate is validated against
+FWHM_METHOD = "batched"
@@ -0,0 +1,196 @@
+"""
+Keeps focus sessions in memory, a bounded number of them for a bounded time
+since they were last used, and optionally in a SQLite database, where they
+outlive their eviction from memory and restarts of the server.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from focus.models import FocusSession
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    datapoints INTEGER NOT NULL,
+    predicted_min_fwhm REAL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created);
+"""
+
+
+class SessionStore:
+    """
+    The focus sessions of the server, by id.
+
+    Sessions in memory are kept in the order they were last used, so that
+    both the least recently used session and the one unused for the longest
+    are the first, and expiring or evicting one takes constant time. Sessions
+    with analysis jobs still pending are never dropped.
+
+    Parameters:
+    - max_sessions: sessions kept in memory, the least recently used evicted
+      beyond it
+    - ttl: seconds a session is kept in memory since it was last used
+    - path: SQLite database storing every session, or None to keep them in
+      memory only
+    """
+
+    def __init__(self, max_sessions=64, ttl=30 * 24 * 3600, path=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.path = path
+
+        # id -> [session, time last used], least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.executescript(_SCHEMA)
+
+    def __contains__(self, sid):
+        return self.get(sid) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, sid):
+        """Returns the session of an id, loading it from the database if needed, or None."""
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            entry = self._sessions.get(sid)
+            if entry is not None:
+                entry[1] = now
+                self._sessions.move_to_end(sid)
+                return entry[0]
+
+            session = self._load(sid)
+            if session is not None:
+                self._add(session, now)
+            return session
+
+    def get_or_create(self, sid):
+        with self._lock:
+            session = self.get(sid)
+            if session is None:
+                session = FocusSession(id=sid)
+                self._add(session, time.time())
+            return session
+
+    def save(self, session):
+        """
+        Stores the current state of a session in the database, if any. Call it
+        with the session consistent, e.g. under focus.analysis.lock.
+
+        A session that was deleted, or replaced by another of the same id, is
+        not stored.
+        """
+        with self._lock:
+            entry = self._sessions.get(session.id)
+            if session.deleted or (entry is not None and entry[0] is not session):
+                return
+            session.updated = time.time()
+            if self._db is None:
+                return
+            data = session.to_npz()
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                (session.id, session.created, session.updated,
+                 len(session.focuser_positons), float(session.predicted_min_fwhm), data),
+            )
+            self._db.commit()
+
+    def delete(self, sid):
+        """Deletes a session, whose pending jobs are then dropped as they finish."""
+        with self._lock:
+            entry = self._sessions.pop(sid, None)
+            if entry is not None:
+                entry[0].deleted = True
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+                self._db.commit()
+
+    def history(self, since=None, until=None, limit=100):
+        """
+        Returns a summary of the sessions created between since and until,
+        as Unix times, newest first: from the database if any, else those in
+        memory.
+        """
+        since = float("-inf") if since is None else since
+        until = float("inf") if until is None else until
+        with self._lock:
+            if self._db is not None:
+                rows = self._db.execute(
+                    "SELECT id, created, updated, datapoints, predicted_min_fwhm FROM sessions"
+                    " WHERE created >= ? AND created <= ? ORDER BY created DESC LIMIT ?",
+                    (since, until, limit),
+                ).fetchall()
+            else:
+                rows = sorted(
+                    ((session.id, session.created, session.updated,
+                      len(session.focuser_positons), session.predicted_min_fwhm)
+                     for session, _ in self._sessions.values()
+                     if since <= session.created <= until),
+                    key=lambda row: row[1], reverse=True,
+                )[:limit]
+        return [
+            {
+                "id": sid,
+                "created": created,
+                "updated": updated,
+                "datapoints": datapoints,
+                "predicted_min_fwhm": predicted_min_fwhm,
+            }
+            for sid, created, updated, datapoints, predicted_min_fwhm in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _add(self, session, now):
+        self._sessions[session.id] = [session, now]
+        self._sessions.move_to_end(session.id)
+        checked = 0
+        while len(self._sessions) > self.max_sessions and checked < len(self._sessions):
+            sid = next(iter(self._sessions))
+            if sid == session.id:
+                break
+            self._drop(sid, now)
+            checked += 1
+
+    def _expire(self, now):
+        while self._sessions:
+            sid, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.ttl:
+                break
+            self._drop(sid, now)
+
+    def _drop(self, sid, now):
+        session = self._sessions[sid][0]
+        if session.pending_jobs:
+            # kept as if just used until its jobs are merged
+            self._sessions[sid][1] = now
+            self._sessions.move_to_end(sid)
+            return
+        del self._sessions[sid]
+        logging.info(f"Dropped focus session {sid} from memory")
+
+    def _load(self, sid):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT data FROM sessions WHERE id = ?", (sid,)).fetchone()
+        if row is None:
+            return None
+        return FocusSession.from_npz(row[0])
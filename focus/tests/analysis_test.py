@@ -0,0 +1,146 @@
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from flask import Flask
+
+import focus
+from focus import analysis, endpoints, settings
+from focus.models import FocusSession
+from focus.storage import SessionStore
+
+HFD = {'sep': 4.0, 'my': 5.0, 'PHD': 6.0}
+
+
+def finished(metrics):
+    future = Future()
+    future.set_result(metrics)
+    return future
+
+
+def queue(session, position, on_merge=None):
+    # a job as analysis.submit queues it, without a worker
+    job = analysis.FocusJob(position, session, f'{position}.fits', position, on_merge)
+    session.pending_jobs.append(job.id)
+    return job
+
+
+def test_jobs_merged_in_focuser_order():
+    session = FocusSession(id='merge')
+    merged = []
+    jobs = [queue(session, position, merged.append) for position in (0, 100, -100)]
+
+    # the jobs finish in another order than they were queued
+    for job in reversed(jobs):
+        fwhm = 2.0 + abs(job.focuser_position) / 100
+        analysis._merge(job, finished({'fwhm': fwhm, 'hfd': HFD}))
+
+    assert session.focuser_positons == [-100, 0, 100]
+    assert session.fwhm_metrics == [3.0, 2.0, 3.0]
+    assert session.files == ['-100.fits', '0.fits', '100.fits']
+    assert session.version == 3 and session.pending_jobs == []
+    assert merged == [session] * 3
+    assert all(job.status == 'done' and job.finished.is_set() for job in jobs)
+    # fitted once the third datapoint is in
+    assert session.predicted_min_fwhm == pytest.approx(0, abs=1)
+
+
+def test_failed_job_not_merged():
+    session = FocusSession(id='failed')
+    job = queue(session, 0)
+    future = Future()
+    future.set_exception(OSError('No such file'))
+    analysis._merge(job, future)
+
+    assert job.status == 'failed' and job.error == 'No such file'
+    assert session.focuser_positons == [] and session.version == 0
+    assert session.pending_jobs == []
+
+
+def test_job_of_reset_session_dropped(tmp_path):
+    store = SessionStore(path=str(tmp_path / 'sessions.sqlite3'))
+    reset = store.get_or_create('reset')
+    job = queue(reset, 0, store.save)
+    store.delete('reset')
+    session = store.get_or_create('reset')
+
+    analysis._merge(job, finished({'fwhm': 2.0, 'hfd': HFD}))
+
+    assert job.status == 'discarded' and job.finished.is_set()
+    assert reset.focuser_positons == [] and session.focuser_positons == []
+    # the reset session was not written back under its id
+    assert store.history() == []
+
+
+def test_workers_started_at_once():
+    pool = analysis.start()
+    assert analysis.start() is pool
+    assert len(pool._processes) == settings.ANALYSIS_WORKERS
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    focus.register_blueprint(app)
+    return app.test_client()
+
+
+def test_wait_for_datapoint_bounded(client, monkeypatch):
+    jobs = []
+
+    def submit(session, filename, fits_file_url, focuser_position, on_merge=None):
+        # a job that never finishes
+        jobs.append(queue(session, focuser_position))
+        return jobs[-1]
+
+    monkeypatch.setattr(analysis, 'submit', submit)
+    monkeypatch.setattr(endpoints, 'MAX_POLL_WAIT', 0.1)
+    start_time = time.monotonic()
+    reply = client.post('/api/add_focus_datapoint', json={
+        'sid': 'wait', 'filename': '/tmp/a.fits', 'focuserPosition': 10, 'wait': True,
+    }).get_json()
+
+    assert time.monotonic() - start_time < 5
+    assert reply['job']['status'] == 'queued'
+    assert reply['pending_jobs'] == [jobs[0].id]
+
+
+class Pool:
+    '''A pool whose submits raise ``error``, if any.'''
+
+    def __init__(self, error=None):
+        self.error = error
+        self.shut_down = False
+
+    def submit(self, func, *args):
+        if self.error is not None:
+            raise self.error
+        return Future()
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+def test_broken_pool_replaced(monkeypatch):
+    broken = Pool(BrokenProcessPool('A worker died'))
+    monkeypatch.setattr(analysis, '_pool', broken)
+    monkeypatch.setattr(analysis, 'ProcessPoolExecutor', lambda *args, **kwargs: Pool())
+    session = FocusSession(id='broken')
+    job = analysis.submit(session, 'a.fits', 'a.fits', 0)
+
+    assert broken.shut_down
+    assert isinstance(analysis._pool, Pool) and analysis._pool is not broken
+    assert job.status == 'queued' and session.pending_jobs == [job.id]
+
+
+def test_failed_submit_fails_job(monkeypatch):
+    shut_down = Pool(RuntimeError('cannot schedule new futures after shutdown'))
+    monkeypatch.setattr(analysis, '_pool', shut_down)
+    session = FocusSession(id='shut down')
+    with pytest.raises(RuntimeError):
+        analysis.submit(session, 'a.fits', 'a.fits', 0)
+
+    job = analysis.get(max(analysis._jobs))
+    assert job.status == 'failed' and job.finished.is_set()
+    assert session.pending_jobs == []
@@ -0,0 +1,20 @@
+import numpy
+import pytest
+from photutils.aperture import CircularAperture
+
+from evora.sky import SkySimulator
+from focus.focus_assist import APERTURE_R, calc_fwhm, calc_fwhms, extract_source
+
+
+@pytest.mark.filterwarnings('ignore')
+@pytest.mark.parametrize('focus', [0, 40])
+def test_calc_fwhms_matches_photutils(focus):
+    sky = SkySimulator(seed=2)
+    sky.focus = focus
+    sources, signal = extract_source(sky.render(5.0))
+    positions = numpy.column_stack([sources['x'], sources['y']])[:20]
+
+    fwhms = calc_fwhms(signal, positions)
+    expected = [calc_fwhm(signal, CircularAperture(tuple(p), r=APERTURE_R)) for p in positions]
+    numpy.testing.assert_allclose(fwhms, expected, rtol=0.02)
+    assert numpy.median(fwhms) == pytest.approx(numpy.median(expected), rel=0.005)
@@ -0,0 +1,52 @@
+import numpy
+import pytest
+from photutils.aperture import CircularAperture
+
+from evora.sky import SkySimulator
+from focus.focus_assist import APERTURE_R, calc_hfds
+
+
+def reference_hfd(signal, aperture):
+    # the per-pixel implementation calc_hfds replaces
+    roi_data = aperture.to_mask(method='subpixel').cutout(signal)
+    dist_weighted_flux = 0
+    dist_pix_pairs = []
+    for (y, x), pix in numpy.ndenumerate(roi_data):
+        dist = numpy.sqrt((y - aperture.r) ** 2 + (x - aperture.r) ** 2)
+        if dist < APERTURE_R:
+            dist_weighted_flux += pix * dist
+            dist_pix_pairs.append((dist, pix))
+    total_flux = numpy.sum(roi_data)
+    my_hfd = dist_weighted_flux / total_flux * 2
+
+    half_flux = total_flux / 2
+    dist_pix_pairs.sort(key=lambda pair: pair[0])
+    prev_dist, prev_pix = 0, 0
+    flux_acc = 0
+    for dist, pix in dist_pix_pairs:
+        flux_acc += pix
+        if flux_acc > half_flux:
+            break
+        prev_dist = dist
+        prev_pix = pix
+    s = (dist - prev_dist) / (pix - prev_pix)
+    phd_hfd = (prev_dist + (half_flux - prev_pix) * s) * 2
+    return my_hfd, phd_hfd
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('focus', [0, 30])
+def test_calc_hfds_matches_reference(focus):
+    sky = SkySimulator(seed=1, best_focus=0)
+    sky.focus = focus
+    signal = sky.render(5.0).astype(numpy.float32) - numpy.float32(sky.bias)
+
+    positions = sky.stars[['x', 'y']][:40].tolist()
+    # cutouts crossing the edge, and bounding box edges on pixel edges
+    positions += [(0.2, 3.1), (1023.4, 1020.0), (500.5, 400.5)]
+
+    my_hfd, phd_hfd = calc_hfds(signal, positions)
+    for i, position in enumerate(positions):
+        expected = reference_hfd(signal, CircularAperture(position, r=APERTURE_R))
+        numpy.testing.assert_allclose(my_hfd[i], expected[0], rtol=1e-12)
+        numpy.testing.assert_allclose(phd_hfd[i], expected[1], rtol=1e-12)
@@ -0,0 +1,29 @@
+import matplotlib.pyplot as plt
+import numpy
+
+from focus.focus_assist import focus_curves, plot_fit
+
+POSITIONS = [-200, -100, 0, 100, 200]
+
+
+def curves_args():
+    fwhm = [4.0 + (position - 20) ** 2 * 1e-4 for position in POSITIONS]
+    fwhm_fit = numpy.polyfit(POSITIONS, fwhm, 2)
+    hfd = {method: fwhm for method in ('sep', 'my', 'PHD')}
+    hfd_fits = {method: fwhm_fit for method in hfd}
+    return POSITIONS, fwhm, hfd, fwhm_fit, hfd_fits
+
+
+def test_focus_curves():
+    curves = focus_curves(*curves_args())
+    assert numpy.isclose(curves['fwhm']['minimum'], 20)
+    assert len(curves['fit_positions']) == len(curves['hfd']['PHD']['fit']) == 100
+
+    unfitted = focus_curves(POSITIONS[:2], [1.0, 2.0], {'sep': [1.0, 2.0]}, None, {})
+    assert unfitted['fwhm']['fit'] is None and unfitted['fit_positions'] is None
+
+
+def test_plot_fit_leaves_no_pyplot_figures():
+    image = plot_fit(*curves_args())
+    assert image.startswith(b'\x89PNG')
+    assert plt.get_fignums() == []
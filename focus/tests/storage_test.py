@@ -0,0 +1,78 @@
+import numpy
+
+from focus.models import FocusSession
+from focus.storage import SessionStore
+
+
+def fitted_session(sid):
+    session = FocusSession(id=sid)
+    session.focuser_positons = [-100, 0, 100]
+    session.fwhm_metrics = [3.0, 2.0, 3.1]
+    session.hfd_metrics = [{'sep': 4.0, 'my': 5.0, 'PHD': 6.0}] * 3
+    session.files = ['a.fits', 'b.fits', 'c.fits']
+    session.fwhm_fit = numpy.array([1e-4, 0.0, 2.0])
+    session.hfd_fits = {'sep': numpy.array([1.0, 2.0, 3.0])}
+    session.predicted_min_fwhm = 0.5
+    session.predicted_min_hfd = {'sep': -1.0}
+    return session
+
+
+def test_npz_round_trip():
+    for session in (FocusSession(id='empty'), fitted_session('fitted')):
+        restored = FocusSession.from_npz(session.to_npz())
+        assert restored.serialize() == session.serialize()
+        assert restored.created == session.created
+
+
+def test_least_recently_used_evicted():
+    store = SessionStore(max_sessions=2)
+    store.get_or_create('1')
+    store.get_or_create('2')
+    store.get('1')
+    store.get_or_create('3')
+    assert store.get('2') is None
+    assert store.get('1') is not None and store.get('3') is not None
+
+
+def test_expired_unless_pending(monkeypatch):
+    store = SessionStore(ttl=10)
+    now = 1000.0
+    monkeypatch.setattr('focus.storage.time.time', lambda: now)
+    store.get_or_create('idle')
+    store.get_or_create('busy').pending_jobs.append(1)
+
+    now += 11
+    assert store.get('idle') is None
+    assert store.get('busy') is not None
+
+
+def test_persisted(tmp_path):
+    path = str(tmp_path / 'sessions.sqlite3')
+    store = SessionStore(path=path)
+    session = fitted_session('1700000000000')
+    store.save(session)
+    store.close()
+
+    store = SessionStore(path=path)
+    assert store.get(session.id).serialize() == session.serialize()
+    assert [entry['id'] for entry in store.history()] == [session.id]
+    assert store.history(since=session.created + 1) == []
+
+
+def test_deleted_or_replaced_session_not_saved(tmp_path):
+    path = str(tmp_path / 'sessions.sqlite3')
+    store = SessionStore(path=path)
+    deleted = store.get_or_create('1')
+    deleted.focuser_positons.append(0)
+    store.delete('1')
+    store.save(deleted)
+    assert store.get('1') is None
+
+    session = store.get_or_create('1')
+    store.save(session)
+    replaced = fitted_session('1')
+    store.save(replaced)
+    store.close()
+
+    store = SessionStore(path=path)
+    assert store.get('1').serialize() == session.serialize()
@@ -105,7 +105,9 @@ def visualize_solution(solution_match, w, h) -> str:
 def solve_fits(file_path, position_hint=None) -> PlateSolvingResult:
     try:
         hdul = fits.open(file_path)
-        data = hdul[0].data
+        # tile compressed frames are in the first extension
+        hdu = hdul[0] if hdul[0].data is not None else hdul[1]
+        data = hdu.data
         data = data.astype(np.float32)
 
         stars_xy = extract_sources(data)
@@ -122,7 +124,7 @@ def solve_fits(file_path, position_hint=None) -> PlateSolvingResult:
     
         best_match = solution.best_match()
 
-        h,w = hdul[0].header['NAXIS1'], hdul[0].header['NAXIS2']
+        h,w = hdu.header['NAXIS1'], hdu.header['NAXIS2']
         visualization_url = visualize_solution(best_match, w, h)
         logging.info(f"{visualization_url=}")
 
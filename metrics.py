@@ -0,0 +1,250 @@
+import bisect
+import threading
+import time
+
+from evora import instrumentation
+
+# Upper bounds in seconds of the latency histogram buckets, spanning fast SDK
+# reads to long exposures
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0,
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Metric:
+    '''A named family of time series, one per combination of label values.'''
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        with self._lock:
+            series = {key: self._snapshot(value) for key, value in self._series.items()}
+        for key, value in sorted(series.items()):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _snapshot(self, value):
+        return value
+
+
+class Counter(Metric):
+    '''A value that only goes up, such as a number of calls.'''
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        return [f'{self.name}{_format_labels(key)} {value}']
+
+
+class Gauge(Metric):
+    '''A value read when the metrics are scraped, from a callable.'''
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def render(self):
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+            f'{self.name} {self.function()}',
+        ]
+
+
+class Histogram(Metric):
+    '''Counts observations, such as latencies, in cumulative buckets.'''
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # one count per bucket, then +Inf, then the sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def _snapshot(self, value):
+        return list(value)
+
+    def _render_series(self, key, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), value[:-1]):
+            cumulative += count
+            labels = _format_labels(key + (('le', bound),))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(key)} {value[-1]}')
+        lines.append(f'{self.name}_count{_format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    '''Holds metrics and renders them in the Prometheus text format.'''
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.register(Histogram(
+    'evora_http_request_duration_seconds',
+    'Time to handle an HTTP request.',
+    ('route', 'blueprint', 'method', 'status'),
+))
+CAPTURE_PHASE_DURATION = registry.register(Histogram(
+    'evora_capture_phase_duration_seconds',
+    'Time spent in each phase of a capture.',
+    ('exptype', 'phase'),
+))
+CAMERA_COMMAND_DURATION = registry.register(Histogram(
+    'evora_camera_command_duration_seconds',
+    'Time taken by commands run on the camera thread, each one or more SDK calls.',
+    ('command',),
+))
+CAMERA_COMMAND_ERRORS = registry.register(Counter(
+    'evora_camera_command_errors_total',
+    'Commands run on the camera thread that raised.',
+    ('command',),
+))
+SDK_CALL_DURATION = registry.register(Histogram(
+    'evora_sdk_call_duration_seconds',
+    'Time taken by each call to an SDK function.',
+    ('function',),
+))
+SDK_CALL_ERRORS = registry.register(Counter(
+    'evora_sdk_call_errors_total',
+    'SDK calls that raised or returned a status other than DRV_SUCCESS.',
+    ('function', 'error'),
+))
+WHEEL_COMMAND_DURATION = registry.register(Histogram(
+    'evora_filter_wheel_command_duration_seconds',
+    'Round trip time of filter wheel commands, including the move.',
+    ('command', 'result'),
+))
+
+
+def observe_request(route, blueprint, method, status, seconds):
+    REQUEST_DURATION.observe(
+        seconds, route=route, blueprint=blueprint or '', method=method, status=status
+    )
+
+
+def observe_capture(exptype, timings):
+    '''Records the phase timings reported by a capture.'''
+    for phase, seconds in timings.items():
+        CAPTURE_PHASE_DURATION.observe(seconds, exptype=exptype, phase=phase)
+
+
+def observe_camera_command(command, seconds, error=None):
+    '''Records a command run on the camera thread, as called by `camera_actor.CameraActor`.'''
+    CAMERA_COMMAND_DURATION.observe(seconds, command=command)
+    if error is not None:
+        CAMERA_COMMAND_ERRORS.inc(command=command)
+
+
+def observe_sdk_call(name, args, kwargs, start, duration, result, error):
+    '''Records one SDK call, as a listener of `evora.instrumentation`.'''
+    SDK_CALL_DURATION.observe(duration, function=name)
+    failure = instrumentation.error_name(result, error)
+    if failure is not None:
+        SDK_CALL_ERRORS.inc(function=name, error=failure)
+
+
+def observe_wheel_command(command, seconds, error=None):
+    '''Records a filter wheel command, as called by `filter_wheel.FilterWheel`.'''
+    WHEEL_COMMAND_DURATION.observe(
+        seconds, command=command.split()[0], result='error' if error is not None else 'ok'
+    )
+
+
+def register_gauge(name, documentation, function):
+    '''Exports the value ``function()`` returns when the metrics are scraped.'''
+    return registry.register(Gauge(name, documentation, function))
+
+
+def install(app):
+    '''Times every request handled by ``app`` and serves ``/metrics``.'''
+
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    def record(status):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            observe_request(
+                request.url_rule.rule if request.url_rule is not None else 'unmatched',
+                request.blueprint,
+                request.method,
+                status,
+                time.perf_counter() - start,
+            )
+
+    @app.after_request
+    def record_request(response):
+        record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(error):
+        # after_request is skipped when an unhandled exception propagates,
+        # as it does when testing or debugging
+        record(500)
+
+    @app.route('/metrics')
+    def route_metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,100 @@
+import os
+import re
+import threading
+
+
+class SequenceAllocator:
+    '''Allocates sequentially numbered file names without rescanning.
+
+    The directory is scanned once, the first time it is used (at startup and
+    after each date rollover), to find the highest sequence number in it.
+    After that the counter is kept in memory, so allocating a name costs the
+    same however many files the directory holds.
+
+    Names are reserved by creating the file exclusively, so two writers can
+    never be handed the same name, even if another process is also creating
+    files in the directory. The reserved file is empty until it is replaced
+    by the real one; a name whose frame will not be written, because the
+    capture was aborted or failed, must be given back with `release`.
+
+    Parameters
+    ----------
+    template
+        The format of the name, with a ``seq`` field.
+    pattern
+        A regular expression matching allocated names, whose first group is
+        the sequence number.
+
+    '''
+
+    def __init__(self, template='ecam-{seq:04d}.fits', pattern=r'^ecam-([0-9]+)\.fits$'):
+        self.template = template
+        self.pattern = re.compile(pattern)
+
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, directory):
+        '''Reserves the next sequence number in ``directory`` and returns its path.'''
+
+        with self._lock:
+            if directory not in self._last:
+                # only the current night's directory is ever written to
+                self._last = {directory: self._scan(directory)}
+
+            while True:
+                self._last[directory] += 1
+                path = os.path.join(directory, self.template.format(seq=self._last[directory]))
+                if self._create(path):
+                    return path
+
+    def reserve_name(self, directory, file):
+        '''Reserves ``file`` in ``directory``, or the first free ``name(n).ext``.'''
+
+        path = os.path.join(directory, file)
+        if self._create(path):
+            return path
+
+        stem, extension = os.path.splitext(file)
+        num = 0
+        while True:
+            path = os.path.join(directory, f'{stem}({num}){extension}')
+            if self._create(path):
+                return path
+            num += 1
+
+    def release(self, path):
+        '''Gives back a reserved name whose frame will not be written.
+
+        The reserved file is removed. If it holds the last sequence number
+        handed out in its directory, that number is handed out again next.
+
+        '''
+
+        with self._lock:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            directory, name = os.path.split(path)
+            match = self.pattern.match(name)
+            if match is not None and self._last.get(directory) == int(match.group(1)):
+                self._last[directory] -= 1
+
+    def _scan(self, directory):
+        last = 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = self.pattern.match(entry.name)
+                if match:
+                    last = max(last, int(match.group(1)))
+        return last
+
+    @staticmethod
+    def _create(path):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        except FileExistsError:
+            return False
+        return True
@@ -0,0 +1,338 @@
+import itertools
+import logging
+import threading
+import time
+
+# Seconds between repeats of an abort sent while a capture is setting up,
+# before there is an exposure to abort
+ABORT_RETRY = 0.1
+
+# Fields of a plan step, with their defaults
+STEP_DEFAULTS = {
+    'filter': None,
+    'imgtype': 'Object',
+    'exptime': None,
+    'count': 1,
+    'binning': 1,
+    'roi': None,
+    'readout': None,
+    'compression': None,
+    'comment': '',
+}
+
+
+class Step:
+    '''One block of a plan: ``count`` exposures through one filter.'''
+
+    def __init__(self, step_id, spec):
+        self.id = step_id
+        self.spec = spec
+
+        self.status = 'pending'
+        self.error = ''
+        self.frames = []
+        self.started_at = None
+        self.finished_at = None
+
+    def request(self):
+        '''Returns the capture request of one exposure of the step.'''
+
+        binning = self.spec['binning']
+        hbin, vbin = (binning, binning) if isinstance(binning, int) else binning
+
+        req = {
+            'exptype': 'Single',
+            'imgtype': self.spec['imgtype'],
+            'exptime': self.spec['exptime'],
+            'filter': self.spec['filter'],
+            'comment': self.spec['comment'],
+            'hbin': hbin,
+            'vbin': vbin,
+            # the next exposure starts while this one is being written
+            'wait_for_write': False,
+        }
+        for field in ('roi', 'readout', 'compression'):
+            if self.spec[field] is not None:
+                req[field] = self.spec[field]
+        return req
+
+    def serialize(self):
+        return {
+            'id': self.id,
+            'spec': self.spec,
+            'status': self.status,
+            'error': self.error,
+            'done': len(self.frames),
+            'count': self.spec['count'],
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            # time the first exposure waited for the wheel to reach the filter
+            'filter_wait': self.frames[0]['filter_wait'] if self.frames else None,
+            'frames': self.frames,
+        }
+
+
+class Sequencer:
+    '''Runs a plan of exposures back to back on the server.
+
+    A plan is a list of steps, each a dict with a ``filter``, ``imgtype``,
+    ``exptime``, ``count`` and optionally ``binning`` (an int or an
+    ``[hbin, vbin]`` pair), ``roi``, ``readout``, ``compression`` and
+    ``comment``. The steps run in order on a background thread, their
+    exposures taken one after the other, each starting as soon as the
+    previous one has been read out. The wheel starts moving to the filter of
+    the next step as soon as the last exposure of a step has ended, while
+    that frame is read out and written.
+
+    A running plan can be paused, which takes effect once the current
+    exposure has finished, resumed, and aborted, which also aborts the
+    current exposure. Steps that have not started can be reordered.
+
+    Parameters
+    ----------
+    capture
+        Takes one exposure from a capture request and returns the ``/capture``
+        reply, e.g. ``app.capture``.
+    validate
+        Returns why a capture request is invalid, or None.
+    abort
+        Aborts the exposure in progress.
+
+    '''
+
+    def __init__(self, capture, validate=None, abort=None):
+        self.capture = capture
+        self.validate = validate
+        self.abort_exposure = abort
+
+        self.status = 'idle'
+        self.steps = []
+        self.started_at = None
+        self.finished_at = None
+
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._resumed = threading.Event()
+        # clear while a capture is in progress
+        self._capture_done = threading.Event()
+        self._capture_done.set()
+        self._thread = None
+
+    @property
+    def running(self):
+        '''Whether a plan is in progress, including while paused.'''
+        return self.status in ('running', 'paused', 'aborting')
+
+    def submit(self, plan):
+        '''Validates a plan and starts running it.
+
+        Raises ValueError if the plan is invalid and RuntimeError if another
+        plan is still running.
+
+        '''
+
+        if not isinstance(plan, list) or not plan:
+            raise ValueError('A plan must be a non-empty list of steps.')
+
+        steps = []
+        for number, spec in enumerate(plan, start=1):
+            if not isinstance(spec, dict):
+                raise ValueError(f'Step {number} is not an object.')
+            unknown = set(spec) - set(STEP_DEFAULTS)
+            if unknown:
+                raise ValueError(f'Step {number} has unknown fields {sorted(unknown)}.')
+
+            spec = dict(STEP_DEFAULTS, **spec)
+            try:
+                spec['count'] = int(spec['count'])
+                binning = spec['binning']
+                if not isinstance(binning, int):
+                    binning = [int(value) for value in binning]
+                    if len(binning) != 2:
+                        raise ValueError
+                spec['binning'] = binning
+            except (TypeError, ValueError):
+                raise ValueError(f'Step {number} has an invalid count or binning.')
+            if spec['count'] < 1:
+                raise ValueError(f'Step {number} must take at least one exposure.')
+
+            step = Step(next(self._ids), spec)
+            if self.validate is not None:
+                try:
+                    error = self.validate(step.request())
+                except (TypeError, ValueError):
+                    error = 'Invalid exposure time.'
+                if error is not None:
+                    raise ValueError(f'Step {number}: {error}')
+            steps.append(step)
+
+        with self._lock:
+            if self.running:
+                raise RuntimeError('A sequence is already running.')
+            self.steps = steps
+            self.status = 'running'
+            self.started_at = time.time()
+            self.finished_at = None
+            self._resumed.set()
+
+        self._thread = threading.Thread(target=self._run, name='sequencer', daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        '''Pauses the plan once the current exposure has finished.'''
+        with self._lock:
+            if self.status != 'running':
+                return False
+            self.status = 'paused'
+            self._resumed.clear()
+            return True
+
+    def resume(self):
+        with self._lock:
+            if self.status != 'paused':
+                return False
+            self.status = 'running'
+            self._resumed.set()
+            return True
+
+    def abort(self):
+        '''Stops the plan, aborting the exposure in progress.'''
+        with self._lock:
+            if not self.running:
+                return False
+            self.status = 'aborting'
+            self._resumed.set()
+            capturing = not self._capture_done.is_set()
+
+        if self.abort_exposure is not None and capturing:
+            threading.Thread(target=self._abort_capture, name='sequencer-abort', daemon=True).start()
+        return True
+
+    def _abort_capture(self):
+        # The capture may still be setting up the camera or moving the wheel,
+        # when there is no exposure to abort yet, so the abort is repeated
+        # until the capture returns
+        while True:
+            self.abort_exposure()
+            if self._capture_done.wait(ABORT_RETRY):
+                return
+
+    def reorder(self, order):
+        '''Reorders the steps that have not started.
+
+        Parameters
+        ----------
+        order
+            The ids of every pending step, in the order they should run.
+
+        '''
+
+        with self._lock:
+            pending = [step for step in self.steps if step.status == 'pending']
+            by_id = {step.id: step for step in pending}
+            if sorted(order) != sorted(by_id):
+                raise ValueError('The order must list the id of every pending step once.')
+
+            started = [step for step in self.steps if step.status != 'pending']
+            self.steps = started + [by_id[step_id] for step_id in order]
+
+    def status_report(self):
+        '''Returns the state of the plan and of each of its steps.'''
+
+        with self._lock:
+            steps = [step.serialize() for step in self.steps]
+            done = sum(step['done'] for step in steps)
+            total = sum(step['count'] for step in steps)
+            return {
+                'status': self.status,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'done': done,
+                'count': total,
+                'steps': steps,
+            }
+
+    def _next_step(self):
+        with self._lock:
+            if self.status == 'aborting':
+                return None
+            for step in self.steps:
+                if step.status == 'pending':
+                    step.status = 'running'
+                    step.started_at = time.time()
+                    return step
+            return None
+
+    def _finish_step(self, step, status, error=''):
+        with self._lock:
+            step.status = status
+            step.error = error
+            step.finished_at = time.time()
+
+    def _run(self):
+        outcome = 'done'
+        while (step := self._next_step()) is not None:
+            try:
+                status, error = self._run_step(step)
+            except Exception as err:
+                logging.exception(f'Sequence step {step.id} failed')
+                status, error = 'failed', str(err)
+            self._finish_step(step, status, error)
+
+            if status != 'done':
+                # an exposure aborted through /abort stops the plan too
+                outcome = status
+                break
+
+        with self._lock:
+            for step in self.steps:
+                if step.status == 'pending':
+                    step.status = 'skipped'
+            self.status = 'aborted' if self.status == 'aborting' else outcome
+            self.finished_at = time.time()
+
+    def _next_filter(self):
+        with self._lock:
+            for pending in self.steps:
+                if pending.status == 'pending':
+                    return pending.spec['filter']
+        return None
+
+    def _run_step(self, step):
+        while len(step.frames) < step.spec['count']:
+            self._resumed.wait()
+
+            req = step.request()
+            if len(step.frames) == step.spec['count'] - 1:
+                next_filter = self._next_filter()
+                if next_filter is not None and next_filter != step.spec['filter']:
+                    req['next_filter'] = next_filter
+
+            # an abort either lands before this, or sees the capture and
+            # aborts it
+            with self._lock:
+                if self.status == 'aborting':
+                    return 'aborted', ''
+                self._capture_done.clear()
+
+            start_time = time.monotonic()
+            try:
+                reply = self.capture(req)
+            finally:
+                self._capture_done.set()
+            frame = {
+                'filename': reply.get('filename'),
+                'write_id': reply.get('write_id'),
+                'elapsed': reply.get('elapsed'),
+                'filter_wait': reply.get('filter_wait'),
+                'duration': time.monotonic() - start_time,
+            }
+
+            if reply['status'] == 1:
+                return 'aborted', reply['message']
+            if reply['status'] != 0:
+                return 'failed', reply['message']
+            with self._lock:
+                step.frames.append(frame)
+
+        return 'done', ''
@@ -6,30 +6,151 @@
 # @Filename: server.py
 # @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
 
+"""Simulated filter wheel controller.
 
+Speaks the wheel controller protocol, one command per line, so the network
+path of `filter_wheel.FilterWheel` can be exercised without the observatory
+network::
+
+    get       -> OK,<position>
+    move <n>  -> OK, once the wheel is at position n
+    home      -> OK, once the wheel is at position 0
+
+Invalid commands are answered with ``ERR,<message>``. Point the app at it with::
+
+    python server.py --port 9999 &
+    EVORA_WHEEL_HOST=127.0.0.1 EVORA_WHEEL_PORT=9999 python app.py
+
+"""
+
+import argparse
 import asyncio
+import logging
+import random
+
+
+class SimulatedWheel:
+    """The state of the simulated wheel, shared by every connection.
+
+    Parameters
+    ----------
+    positions
+        Number of filter slots.
+    travel_time
+        Seconds to move by one slot. The wheel turns whichever way is shorter.
+    home_time
+        Extra seconds a home takes to find the index mark.
+    latency
+        Seconds added before every reply.
+    fault_rate
+        Probability that a command is answered with an error.
+    drop_rate
+        Probability that the connection is closed instead of replying.
+
+    """
+
+    def __init__(
+        self,
+        positions=6,
+        travel_time=0.5,
+        home_time=1.0,
+        latency=0.0,
+        fault_rate=0.0,
+        drop_rate=0.0,
+    ):
+        self.positions = positions
+        self.travel_time = travel_time
+        self.home_time = home_time
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.drop_rate = drop_rate
+
+        self.position = 0
+        self.moving = asyncio.Lock()
+
+    async def travel(self, target, extra=0.0):
+        async with self.moving:
+            distance = abs(target - self.position)
+            distance = min(distance, self.positions - distance)
+            await asyncio.sleep(distance * self.travel_time + extra)
+            self.position = target
 
+    async def handle(self, command):
+        """Executes a command and returns the reply line."""
 
-async def server_handler(reader, writer):
-    while True:
-        data_bytes = await reader.readline()
-        data_str = data_bytes.decode().strip()
+        if random.random() < self.fault_rate:
+            return "ERR,Simulated fault"
 
-        if data_str == "":
-            continue
+        words = command.split()
+        if words == ["get"]:
+            if self.moving.locked():
+                return "ERR,Wheel is moving"
+            return f"OK,{self.position}"
 
-        if data_str == "hi":
-            writer.write(b"Greetings to you!\n")
-        elif data_str == "bye":
-            writer.write(b"Farewell\n")
-        else:
-            writer.write(b"I did not get that\n")
+        if words == ["home"]:
+            await self.travel(0, self.home_time)
+            return "OK"
 
-        writer.drain()
+        if len(words) == 2 and words[0] == "move":
+            try:
+                target = int(words[1])
+            except ValueError:
+                return f"ERR,Invalid position {words[1]}"
+            if not 0 <= target < self.positions:
+                return f"ERR,Invalid position {target}"
+            await self.travel(target)
+            return "OK"
 
+        return f"ERR,Unknown command {command}"
 
-async def main():
-    server = await asyncio.start_server(server_handler, host="0.0.0", port=4000)
+
+async def server_handler(wheel, reader, writer):
+    peer = writer.get_extra_info("peername")
+    logging.info(f"Connection from {peer}")
+
+    try:
+        while True:
+            data_bytes = await reader.readline()
+            if data_bytes == b"":
+                break
+
+            data_str = data_bytes.decode().strip()
+            if data_str == "":
+                continue
+
+            reply = await wheel.handle(data_str)
+            await asyncio.sleep(wheel.latency)
+
+            if random.random() < wheel.drop_rate:
+                logging.info(f"Dropping connection from {peer} on {data_str!r}")
+                break
+
+            logging.debug(f"{peer}: {data_str!r} -> {reply!r}")
+            writer.write((reply + "\n").encode())
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+    logging.info(f"Connection from {peer} closed")
+
+
+async def main(args):
+    wheel = SimulatedWheel(
+        positions=args.positions,
+        travel_time=args.travel_time,
+        home_time=args.home_time,
+        latency=args.latency,
+        fault_rate=args.fault_rate,
+        drop_rate=args.drop_rate,
+    )
+
+    server = await asyncio.start_server(
+        lambda reader, writer: server_handler(wheel, reader, writer),
+        host=args.host,
+        port=args.port,
+    )
 
     addrs = ", ".join(str(sock.getsockname()) for sock in server.sockets)
     print(f"Serving on {addrs}")
@@ -39,4 +160,21 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Simulated filter wheel controller")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--positions", type=int, default=6, help="number of filter slots")
+    parser.add_argument("--travel-time", type=float, default=0.5, help="seconds per slot")
+    parser.add_argument("--home-time", type=float, default=1.0, help="extra seconds to home")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each reply")
+    parser.add_argument(
+        "--fault-rate", type=float, default=0.0, help="probability of an ERR reply"
+    )
+    parser.add_argument(
+        "--drop-rate", type=float, default=0.0, help="probability of dropping the connection"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    asyncio.run(main(args))
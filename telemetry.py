@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+
+import numpy
+
+from camera_actor import PRIORITY_LOW
+
+# The wrapper reports this temperature when no reading could be made, e.g.
+# while acquiring or before the camera is initialized.
+NO_TEMPERATURE = -999.0
+
+SAMPLE_DTYPE = numpy.dtype([
+    ('time', 'f8'),
+    ('temperature', 'f4'),
+    ('tec_status', 'i4'),
+    ('status', 'i4'),
+    ('funcstatus', 'i4'),
+])
+
+
+class TelemetrySampler:
+    '''Samples the camera temperature and status in the background.
+
+    Every ``period`` seconds the TEC temperature and camera status are read
+    through the camera actor, at low priority so they never delay a capture,
+    and stored in a fixed-size ring buffer. Routes answer from the latest
+    sample instead of calling the SDK, so any number of polling clients cost
+    one SDK call per period. Samples without a temperature reading are stored
+    with a NaN temperature.
+
+    Parameters
+    ----------
+    camera
+        The `camera_actor.CameraActor` to sample.
+    period
+        Seconds between samples.
+    size
+        Number of samples kept. At the default period of 2 s, 43200 samples
+        cover a day.
+
+    '''
+
+    def __init__(self, camera, period=2.0, size=43200):
+        self.camera = camera
+        self.period = period
+
+        self._buffer = numpy.zeros(size, dtype=SAMPLE_DTYPE)
+        self._count = 0
+        self._last_temperature = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def sample(self):
+        '''Reads the camera once and records the result.'''
+
+        tec = self.camera.submit('getStatusTEC', priority=PRIORITY_LOW)
+        status = self.camera.submit('getStatus', priority=PRIORITY_LOW)
+        tec, status = tec.result(), status.result()
+
+        temperature = tec['temperature']
+        if temperature == NO_TEMPERATURE:
+            temperature = numpy.nan
+
+        now = time.time()
+        with self._lock:
+            self._buffer[self._count % len(self._buffer)] = (
+                now,
+                temperature,
+                tec['status'],
+                status['status'],
+                status['funcstatus'],
+            )
+            self._count += 1
+            if not numpy.isnan(temperature):
+                self._last_temperature = (now, float(temperature))
+
+    def latest(self):
+        '''Returns the most recent sample as a dict, or None if there is none.
+
+        The temperature is the most recent one read, which may be older than
+        the sample if the camera is acquiring; ``temperature_age`` gives its
+        age in seconds. It is None if no temperature has been read yet.
+
+        '''
+
+        with self._lock:
+            if self._count == 0:
+                return None
+            sample = self._buffer[(self._count - 1) % len(self._buffer)].copy()
+            last_temperature = self._last_temperature
+
+        now = time.time()
+        latest = {
+            'time': float(sample['time']),
+            'age': now - float(sample['time']),
+            'temperature': None,
+            'temperature_age': None,
+            'tec_status': int(sample['tec_status']),
+            'status': int(sample['status']),
+            'funcstatus': int(sample['funcstatus']),
+        }
+        if last_temperature is not None:
+            latest['temperature'] = last_temperature[1]
+            latest['temperature_age'] = now - last_temperature[0]
+
+        return latest
+
+    def history(self, start=None, end=None):
+        '''Returns the samples between two Unix times, oldest first.'''
+
+        with self._lock:
+            size = len(self._buffer)
+            if self._count <= size:
+                samples = self._buffer[:self._count].copy()
+            else:
+                # unroll the ring so samples are in time order
+                index = self._count % size
+                samples = numpy.concatenate((self._buffer[index:], self._buffer[:index]))
+
+        mask = numpy.ones(len(samples), dtype=bool)
+        if start is not None:
+            mask &= samples['time'] >= start
+        if end is not None:
+            mask &= samples['time'] <= end
+        return samples[mask]
+
+    def downsample(self, start=None, end=None, buckets=200):
+        '''Returns the temperature history reduced to at most ``buckets`` bins.
+
+        Each bucket spans an equal interval of time and reports the number of
+        samples and the minimum, maximum and mean temperature within it.
+        Empty buckets are omitted. There are never more buckets than samples,
+        however many are asked for.
+
+        '''
+
+        samples = self.history(start, end)
+        samples = samples[~numpy.isnan(samples['temperature'])]
+        if len(samples) == 0:
+            return {'time': [], 'count': [], 'min': [], 'max': [], 'mean': []}
+        buckets = min(buckets, len(samples))
+
+        times = samples['time']
+        temperatures = samples['temperature'].astype(numpy.float64)
+
+        edges = numpy.linspace(times[0], times[-1], buckets + 1)
+        index = numpy.clip(numpy.searchsorted(edges, times, side='right') - 1, 0, buckets - 1)
+
+        count = numpy.bincount(index, minlength=buckets)
+        total = numpy.bincount(index, weights=temperatures, minlength=buckets)
+
+        minimum = numpy.full(buckets, numpy.inf)
+        maximum = numpy.full(buckets, -numpy.inf)
+        numpy.minimum.at(minimum, index, temperatures)
+        numpy.maximum.at(maximum, index, temperatures)
+
+        filled = count > 0
+        centers = (edges[:-1] + edges[1:]) / 2
+        return {
+            'time': centers[filled].tolist(),
+            'count': count[filled].tolist(),
+            'min': minimum[filled].tolist(),
+            'max': maximum[filled].tolist(),
+            'mean': (total[filled] / count[filled]).tolist(),
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            start_time = time.monotonic()
+            try:
+                self.sample()
+            except Exception:
+                logging.exception('Failed to sample camera telemetry')
+            self._stop.wait(max(0.0, self.period - (time.monotonic() - start_time)))
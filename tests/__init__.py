@@ -0,0 +1,4 @@
+# The modules under test use the dummy camera
+import evora.debug
+
+evora.debug.DEBUGGING = True
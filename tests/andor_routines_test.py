@@ -0,0 +1,41 @@
+import pytest
+
+import andor_routines
+from andor_routines import image_geometry
+
+DETECTOR = (1024, 1024)
+
+
+def test_whole_detector_by_default():
+    geometry = image_geometry(DETECTOR)
+    assert geometry['dim'] == DETECTOR
+    assert (geometry['hstart'], geometry['hend'], geometry['vstart'], geometry['vend']) == (1, 1024, 1, 1024)
+
+
+def test_binned_region():
+    geometry = image_geometry(DETECTOR, 2, 4, {'hstart': 101, 'hend': 300, 'vstart': 1, 'vend': 100})
+    assert geometry['dim'] == (100, 25)
+    assert (geometry['hbin'], geometry['vbin']) == (2, 4)
+
+
+@pytest.mark.parametrize('hbin, vbin, roi', [
+    (0, 1, None),
+    (1, 2048, None),
+    (1, 1, {'hstart': 0}),
+    (1, 1, {'hend': 1025}),
+    (1, 1, {'vstart': 10, 'vend': 5}),
+    (1, 1, {'hstart': 'left'}),
+    (3, 1, None),
+])
+def test_invalid_geometry(hbin, vbin, roi):
+    with pytest.raises(ValueError):
+        image_geometry(DETECTOR, hbin, vbin, roi)
+
+
+def test_fast_readout_without_usable_gain(monkeypatch):
+    monkeypatch.setattr(
+        andor_routines.andor, 'isPreAmpGainAvailable',
+        lambda *args: {'available': False, 'status': 20002},
+    )
+    with pytest.raises(ValueError, match='No pre-amp gain is available at the fastest speed.'):
+        andor_routines.setReadout('fast')
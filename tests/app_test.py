@@ -0,0 +1,228 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy
+import pytest
+from astropy.io import fits
+
+from evora._error_codes import AndorCameraError
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # the app creates ./data where it starts
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    app.camera.call('initialize')
+    return app
+
+
+@pytest.fixture
+def data_dir(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DEFAULT_PATH', str(tmp_path))
+    return tmp_path
+
+
+def files_in(directory):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+def frames(*items):
+    frame_queue = queue.Queue()
+    for item in items + (None,):
+        frame_queue.put(item)
+    return frame_queue
+
+
+def test_cube_without_frames_leaves_no_file(app, data_dir):
+    header = fits.Header({'DATE-OBS': '2024-01-01T00:00:00'})
+    assert app.write_series(frames(), header, 3, 1.0, cube=True) == []
+    assert files_in(data_dir) == []
+
+
+def test_failed_cube_is_removed(app, data_dir):
+    header = fits.Header({'DATE-OBS': '2024-01-01T00:00:00'})
+    good = numpy.zeros((4, 4), dtype=numpy.uint16)
+    # a plane of another shape cannot be streamed into the cube
+    bad = numpy.zeros((5, 5), dtype=numpy.uint16)
+    written = app.write_series(frames((0, good), (1, bad)), header, 2, 1.0, cube=True)
+
+    assert written == []
+    assert files_in(data_dir) == []
+
+
+def capture_request(**fields):
+    return dict(
+        {'exptype': 'Single', 'imgtype': 'Object', 'exptime': 0.1, 'filtype': 'r', 'comment': ''},
+        **fields,
+    )
+
+
+def test_capture_writes_one_file(app, data_dir):
+    reply = app.capture(capture_request())
+    assert reply['status'] == 0
+    assert files_in(data_dir) == [os.path.relpath(reply['url'], data_dir)]
+
+
+def test_aborted_capture_leaves_no_file(app, data_dir):
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.update(app.capture(capture_request(exptime=2)))
+    )
+    thread.start()
+    while not app.camera.snapshot()['acquiring']:
+        time.sleep(0.01)
+    app.camera.abort().result()
+    thread.join()
+
+    assert result['status'] == 1
+    assert files_in(data_dir) == []
+
+
+def test_failed_write_leaves_no_file(app, data_dir, monkeypatch):
+    def fail(*args):
+        raise OSError('Disk full')
+
+    monkeypatch.setattr('fits_writer.os.replace', fail)
+    reply = app.capture(capture_request())
+    app.fits_writer.join()
+
+    assert reply['status'] == 2
+    assert files_in(data_dir) == []
+
+
+def test_failed_readout_leaves_no_file(app, data_dir, monkeypatch):
+    def fail(dim):
+        # as the SDK raises for a readout that lost a race with an abort
+        raise AndorCameraError(20024)
+
+    monkeypatch.setattr(app.andor, 'getAcquiredData16', fail)
+    reply = app.capture(capture_request())
+
+    assert reply == {'message': str(AndorCameraError(20024)), 'status': 2}
+    assert files_in(data_dir) == []
+
+
+@pytest.mark.parametrize('fields', [{}, {'exptype': 'Series', 'expnum': 2}])
+def test_capture_reports_acquisition_started_meanwhile(app, data_dir, monkeypatch, fields):
+    def busy(wait):
+        future = Future()
+        future.set_exception(RuntimeError('Acquisition already in progress.'))
+        return future
+
+    monkeypatch.setattr(app.camera, 'start_acquisition', busy)
+    reply = app.capture(capture_request(**fields))
+
+    assert reply == {'message': 'Acquisition already in progress.', 'status': 2}
+    assert files_in(data_dir) == []
+
+
+@pytest.fixture
+def wheel(app, monkeypatch):
+    wheel = app.DummyFilterWheel(travel_time=0.3)
+    monkeypatch.setattr(app, 'filter_wheel', wheel)
+    monkeypatch.setattr(app, '_filter_move', None)
+    return wheel
+
+
+def test_filter_move_reused(app, wheel):
+    moving = app.start_filter_move('g')
+    assert app.start_filter_move('g') is moving
+    moving.result()
+
+    # already there
+    assert app.start_filter_move('g').done()
+    assert wheel.position == app.FILTER_DICT['g']
+
+
+def test_capture_waits_for_filter(app, data_dir, wheel):
+    reply = app.capture(capture_request(filter='g'))
+
+    assert reply['status'] == 0
+    assert reply['filter_wait'] > 0.1
+    assert wheel.position == app.FILTER_DICT['g']
+
+
+def test_next_filter_moves_during_readout(app, data_dir, wheel):
+    app.start_filter_move('r').result()
+    reply = app.capture(capture_request(filter='r', next_filter='i'))
+
+    assert reply['status'] == 0 and reply['filter_wait'] < 0.1
+    # the move was started once the exposure ended, and is reused
+    moving = app._filter_move[1]
+    assert app._filter_move[0] == 'i'
+    assert app.start_filter_move('i') is moving
+    moving.result()
+    assert wheel.position == app.FILTER_DICT['i']
+
+
+def test_series_writes_every_frame(app, data_dir):
+    reply = app.capture(capture_request(exptype='Series', expnum=3))
+    app.fits_writer.join()
+
+    assert reply['status'] == 0
+    assert len(reply['filenames']) == 3
+    written = files_in(data_dir)
+    assert [os.path.basename(name) for name in written] == reply['filenames']
+    dates = {fits.getheader(os.path.join(data_dir, name))['DATE-OBS'] for name in written}
+    assert len(dates) == 3
+
+
+def test_binned_region_captured(app, data_dir):
+    roi = {'hstart': 1, 'hend': 200, 'vstart': 1, 'vend': 100}
+    reply = app.capture(capture_request(hbin=2, vbin=2, roi=roi))
+    app.fits_writer.join()
+
+    assert reply['status'] == 0
+    header = fits.getheader(reply['url'])
+    assert fits.getdata(reply['url']).shape == (50, 100)
+    assert (header['XBINNING'], header['YBINNING']) == (2, 2)
+
+
+def test_invalid_region_refused(app, data_dir):
+    reply = app.capture(capture_request(hbin=3))
+    assert reply['status'] == 2 and 'multiple of the binning' in reply['message']
+    assert files_in(data_dir) == []
+
+
+def test_readout_modes_listed(app):
+    reply = app.app.test_client().get('/readoutModes').get_json()
+    assert reply['channels'] == [[5.0, 3.0, 1.0, 0.05]]
+    assert reply['preamp_gains'] == [1.0, 2.0, 4.0]
+
+
+@pytest.mark.parametrize('readout, mode, hsspeed_mhz, preamp_gain', [
+    (None, 'slow', 0.05, 1.0),
+    ('fast', 'fast', 5.0, 2.0),
+    ({'hsspeed': 1, 'preamp': 2}, 'custom', 3.0, 4.0),
+])
+def test_readout_of_capture(app, data_dir, readout, mode, hsspeed_mhz, preamp_gain):
+    fields = {} if readout is None else {'readout': readout}
+    settings = app.camera.call(
+        app.setup_capture, 'Object', 'Single', 0.1, readout=fields.get('readout')
+    )
+    assert settings['readout']['mode'] == mode
+    assert settings['readout']['hsspeed_mhz'] == hsspeed_mhz
+    assert settings['readout']['preamp_gain'] == preamp_gain
+
+    reply = app.capture(capture_request(**fields))
+    app.fits_writer.join()
+    assert fits.getheader(reply['url'])['READOUT'] == mode
+
+
+@pytest.mark.parametrize('readout', ['medium', {'hsspeed': 4}, {'hsspeed': 0, 'preamp': 2}])
+def test_invalid_readout_refused(app, data_dir, readout):
+    reply = app.capture(capture_request(readout=readout))
+    assert reply['status'] == 2
+    assert files_in(data_dir) == []
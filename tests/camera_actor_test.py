@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from andor_routines import AcquisitionWait
+from camera_actor import CameraActor
+from evora.dummy import Dummy
+
+
+@pytest.fixture
+def actor():
+    Dummy.initialize()
+    return CameraActor(Dummy)
+
+
+def test_calls_run_in_order(actor):
+    results = [actor.submit(lambda n=n: n) for n in range(5)]
+    assert [future.result() for future in results] == list(range(5))
+
+
+def test_cached_reads_share_one_queued_call(actor):
+    first = actor.cached('getStatus')
+
+    release = threading.Event()
+    busy = actor.submit(release.wait)
+    try:
+        # answered from memory while the camera thread is busy
+        for _ in range(3):
+            assert actor.cached('getStatus', timeout=0.01) == first
+        assert actor._queue.qsize() == 1
+    finally:
+        release.set()
+    busy.result()
+
+
+def test_second_acquisition_is_refused(actor):
+    Dummy.setAcquisitionMode(1)
+    Dummy.setExposureTime(0.5)
+    started = actor.start_acquisition(AcquisitionWait())
+    with pytest.raises(RuntimeError):
+        actor.start_acquisition(AcquisitionWait()).result(timeout=5)
+
+    actor.abort().result()
+    assert started.result(timeout=5)['aborted']
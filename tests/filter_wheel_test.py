@@ -0,0 +1,132 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from filter_wheel import FilterWheel, FilterWheelError
+from server import SimulatedWheel, server_handler
+
+
+class Controller:
+    '''The simulated controller of server.py, served on its own thread.'''
+
+    def __init__(self, **options):
+        self.wheel = SimulatedWheel(travel_time=0.01, home_time=0.01, **options)
+        self.connections = 0
+        self._writers = []
+        self._handlers = set()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._server = self._call(asyncio.start_server(self._handle, '127.0.0.1', 0))
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(5)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.append(writer)
+        self._handlers.add(asyncio.current_task())
+        await server_handler(self.wheel, reader, writer)
+
+    def drop_connections(self):
+        '''Closes every open connection, as a restart of the controller would.'''
+        async def drop():
+            for writer in self._writers:
+                writer.close()
+            self._writers.clear()
+
+        self._call(drop())
+
+    def stop(self):
+        async def close():
+            # including a handler still waiting to reply
+            for handler in self._handlers:
+                handler.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            self._server.close()
+            await self._server.wait_closed()
+
+        self.drop_connections()
+        self._call(close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+
+@pytest.fixture
+def controller():
+    controller = Controller()
+    yield controller
+    controller.stop()
+
+
+@pytest.fixture
+def commands():
+    return []
+
+
+@pytest.fixture
+def wheel(controller, commands):
+    wheel = FilterWheel(
+        '127.0.0.1', controller.port, timeout=2,
+        on_command=lambda command, seconds, error: commands.append((command, error)),
+    )
+    yield wheel
+    wheel.close()
+
+
+def test_move_and_cached_position(wheel, controller, commands):
+    assert wheel.get_position() == 0
+    wheel.move(3)
+    assert wheel.position == 3 and not wheel.moving
+    assert controller.wheel.position == 3
+
+    # cached, without a round trip
+    assert wheel.get_position() == 3
+    assert [command for command, _ in commands] == ['get', 'move 3']
+
+    wheel.home()
+    assert wheel.get_position(refresh=True) == 0
+    # every command went over one connection
+    assert controller.connections == 1
+
+
+def test_reconnects_after_connection_dropped(wheel, controller):
+    wheel.get_position()
+    controller.drop_connections()
+
+    wheel.move(2)
+    assert controller.wheel.position == 2
+    assert controller.connections == 2
+
+
+def test_refused_move_clears_position(wheel, commands):
+    wheel.get_position()
+    with pytest.raises(FilterWheelError, match='Invalid position 9'):
+        wheel.move(9)
+
+    # the wheel may have stopped anywhere
+    assert wheel.position is None
+    assert isinstance(commands[-1][1], FilterWheelError)
+
+
+def test_unreachable():
+    with socket.socket() as listener:
+        # a port nothing listens on once closed
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+
+    with pytest.raises(FilterWheelError, match='unreachable|did not answer'):
+        FilterWheel('127.0.0.1', port, timeout=1).get_position()
+
+
+def test_timed_out_command_not_retried(controller):
+    controller.wheel.latency = 0.5
+    wheel = FilterWheel('127.0.0.1', controller.port, timeout=0.1)
+    with pytest.raises(FilterWheelError, match='did not answer'):
+        wheel.get_position()
+    wheel.close()
+    assert controller.connections == 1
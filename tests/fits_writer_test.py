@@ -0,0 +1,107 @@
+import os
+import queue
+import threading
+import time
+
+import numpy
+import pytest
+from astropy.io import fits
+
+import fits_writer
+from fits_writer import COMPRESSION_TYPES, FitsWriter
+
+FRAME = (1000 + numpy.arange(256 * 256) % 16).astype(numpy.uint16).reshape(256, 256)
+
+
+@pytest.fixture
+def writer():
+    return FitsWriter(fsync=False)
+
+
+def header():
+    return fits.Header({'EXPTIME': 1.5, 'IMAGETYP': 'Object'})
+
+
+def test_written_uncompressed(writer, tmp_path):
+    file_name = str(tmp_path / 'frame.fits')
+    job = writer.submit(file_name, FRAME, header())
+    assert job.future.result(10) == file_name
+
+    with fits.open(file_name) as hdul:
+        assert len(hdul) == 1
+        assert numpy.array_equal(hdul[0].data, FRAME)
+        assert hdul[0].header['EXPTIME'] == 1.5
+    assert writer.status(job.id)['status'] == 'written'
+    assert writer.status(job.id)['size'] == os.path.getsize(file_name)
+    assert os.listdir(tmp_path) == ['frame.fits']
+
+
+@pytest.mark.parametrize('compression', sorted(COMPRESSION_TYPES))
+def test_compression_round_trip(writer, tmp_path, compression):
+    file_name = str(tmp_path / 'frame.fits')
+    job = writer.submit(file_name, FRAME, header(), compression=compression)
+    job.future.result(10)
+
+    with fits.open(file_name) as hdul:
+        assert isinstance(hdul[1], fits.CompImageHDU)
+        assert hdul[1].compression_type == COMPRESSION_TYPES[compression]
+        # lossless for integer frames
+        assert numpy.array_equal(hdul[1].data, FRAME)
+        assert hdul[1].header['IMAGETYP'] == 'Object'
+    assert job.compression_ratio > 1
+
+
+def test_writer_compression_is_default(tmp_path):
+    writer = FitsWriter(fsync=False, compression='rice')
+    compressed = writer.submit(str(tmp_path / 'a.fits'), FRAME)
+    uncompressed = writer.submit(str(tmp_path / 'b.fits'), FRAME, compression=None)
+    writer.join()
+
+    assert compressed.compression == 'rice' and uncompressed.compression is None
+    with pytest.raises(ValueError):
+        writer.submit(str(tmp_path / 'c.fits'), FRAME, compression='gzip')
+
+
+def test_failed_write_leaves_no_file(writer, tmp_path, monkeypatch):
+    def fail(*args):
+        raise OSError('Disk full')
+
+    monkeypatch.setattr(fits_writer.os, 'replace', fail)
+    job = writer.submit(str(tmp_path / 'frame.fits'), FRAME)
+
+    with pytest.raises(OSError, match='Disk full'):
+        job.future.result(10)
+    assert job.status == 'failed' and job.error == 'Disk full'
+    # the partial file is removed too
+    assert os.listdir(tmp_path) == []
+
+
+def test_existing_file_kept(writer, tmp_path):
+    file_name = tmp_path / 'frame.fits'
+    file_name.write_bytes(b'kept')
+    job = writer.submit(str(file_name), FRAME)
+
+    with pytest.raises(FileExistsError):
+        job.future.result(10)
+    assert file_name.read_bytes() == b'kept'
+
+
+def test_full_queue_raises(tmp_path, monkeypatch):
+    # the only writer thread blocks on the first frame
+    release = threading.Event()
+    write = FitsWriter._write
+    monkeypatch.setattr(FitsWriter, '_write', lambda self, job: release.wait() and write(self, job))
+    writer = FitsWriter(max_queued=1, fsync=False)
+    try:
+        first = writer.submit(str(tmp_path / 'a.fits'), FRAME)
+        while writer.queue_depth:
+            time.sleep(0.01)
+        writer.submit(str(tmp_path / 'b.fits'), FRAME)
+        with pytest.raises(queue.Full):
+            writer.submit(str(tmp_path / 'c.fits'), FRAME, timeout=0.01)
+    finally:
+        release.set()
+    writer.join()
+
+    assert first.status == 'written'
+    assert [job['status'] for job in writer.status()['jobs']] == ['written', 'written', 'failed']
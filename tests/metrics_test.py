@@ -0,0 +1,88 @@
+import pytest
+from flask import Flask
+
+import metrics
+from evora import instrumentation
+
+
+def series(metric, **labels):
+    return metric._series.get(metric._key(labels))
+
+
+def observations(histogram, **labels):
+    counts = series(histogram, **labels)
+    # a count per bucket, then the sum
+    return 0 if counts is None else sum(counts[:-1])
+
+
+def test_render_histogram_and_counter():
+    registry = metrics.Registry()
+    latency = registry.register(metrics.Histogram('latency', 'Latency.', ('route',), buckets=(0.1, 1.0)))
+    calls = registry.register(metrics.Counter('calls', 'Calls.', ('route',)))
+    latency.observe(0.5, route='/a')
+    latency.observe(2.0, route='/a')
+    calls.inc(route='/"a"')
+
+    lines = registry.render().splitlines()
+    assert 'latency_bucket{route="/a",le="0.1"} 0' in lines
+    assert 'latency_bucket{route="/a",le="1.0"} 1' in lines
+    assert 'latency_bucket{route="/a",le="+Inf"} 2' in lines
+    assert 'latency_count{route="/a"} 2' in lines
+    assert 'latency_sum{route="/a"} 2.5' in lines
+    assert 'calls{route="/\\"a\\""} 1' in lines
+
+
+def test_sdk_calls_counted_by_wrapper(monkeypatch):
+    # without the listener app.py adds, if imported
+    monkeypatch.setattr(instrumentation, '_listeners', ())
+    codes = iter([20002, 20072])
+    call = instrumentation.instrument('metricsTestCall', lambda: next(codes))
+    instrumentation.add_listener(metrics.observe_sdk_call)
+    call()
+    call()
+
+    assert observations(metrics.SDK_CALL_DURATION, function='metricsTestCall') == 2
+    assert series(metrics.SDK_CALL_ERRORS, function='metricsTestCall', error='DRV_ACQUIRING') == 1
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    metrics.install(app)
+
+    @app.route('/metrics-test/<int:code>')
+    def respond(code):
+        if code == 500:
+            raise RuntimeError('unhandled')
+        return '', code
+
+    return app.test_client()
+
+
+def requests_of(code):
+    return observations(metrics.REQUEST_DURATION, route='/metrics-test/<int:code>',
+                        blueprint='', method='GET', status=code)
+
+
+def test_requests_counted_once(client):
+    before = requests_of(204)
+    assert client.get('/metrics-test/204').status_code == 204
+    assert requests_of(204) == before + 1
+
+
+@pytest.mark.parametrize('propagate', [False, True])
+def test_unhandled_exception_counted(client, propagate):
+    client.application.config['PROPAGATE_EXCEPTIONS'] = propagate
+    before = requests_of(500)
+    if propagate:
+        with pytest.raises(RuntimeError):
+            client.get('/metrics-test/500')
+    else:
+        assert client.get('/metrics-test/500').status_code == 500
+    assert requests_of(500) == before + 1
+
+
+def test_metrics_route(client):
+    body = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE evora_sdk_call_duration_seconds histogram' in body
+    assert '# TYPE evora_camera_command_duration_seconds histogram' in body
@@ -0,0 +1,55 @@
+import os
+
+from sequence_allocator import SequenceAllocator
+
+
+def test_reserve_continues_after_existing_files(tmp_path):
+    (tmp_path / 'ecam-0007.fits').write_bytes(b'frame')
+    allocator = SequenceAllocator()
+
+    first = allocator.reserve(str(tmp_path))
+    second = allocator.reserve(str(tmp_path))
+
+    assert os.path.basename(first) == 'ecam-0008.fits'
+    assert os.path.basename(second) == 'ecam-0009.fits'
+    assert os.path.getsize(first) == 0
+
+
+def test_reserve_skips_names_taken_meanwhile(tmp_path):
+    allocator = SequenceAllocator()
+    allocator.reserve(str(tmp_path))
+    # created by another process after the directory was scanned
+    (tmp_path / 'ecam-0002.fits').write_bytes(b'frame')
+
+    assert os.path.basename(allocator.reserve(str(tmp_path))) == 'ecam-0003.fits'
+
+
+def test_reserve_name_adds_a_suffix(tmp_path):
+    allocator = SequenceAllocator()
+    first = allocator.reserve_name(str(tmp_path), 'm31.fits')
+    second = allocator.reserve_name(str(tmp_path), 'm31.fits')
+
+    assert os.path.basename(first) == 'm31.fits'
+    assert os.path.basename(second) == 'm31(0).fits'
+
+
+def test_release_removes_the_reservation(tmp_path):
+    allocator = SequenceAllocator()
+    path = allocator.reserve(str(tmp_path))
+
+    allocator.release(path)
+
+    assert not os.path.exists(path)
+    # the last number is handed out again
+    assert allocator.reserve(str(tmp_path)) == path
+
+
+def test_release_keeps_later_numbers(tmp_path):
+    allocator = SequenceAllocator()
+    first = allocator.reserve(str(tmp_path))
+    second = allocator.reserve(str(tmp_path))
+
+    allocator.release(first)
+
+    assert os.path.exists(second)
+    assert os.path.basename(allocator.reserve(str(tmp_path))) == 'ecam-0003.fits'
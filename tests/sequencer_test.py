@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+from sequencer import Sequencer
+
+
+class FakeCamera:
+    '''Captures that set up for ``setup`` seconds, then expose for
+    ``exptime`` unless aborted, like ``app.capture``.'''
+
+    def __init__(self, setup=0.0):
+        self.setup = setup
+        self.requests = []
+        self.exposing = threading.Event()
+        self._aborted = threading.Event()
+        self._exposing = False
+
+    def capture(self, req):
+        self.requests.append(req)
+        time.sleep(self.setup)
+        self._aborted.clear()
+        self._exposing = True
+        self.exposing.set()
+        aborted = self._aborted.wait(req['exptime'])
+        self._exposing = False
+        self.exposing.clear()
+        if aborted:
+            return {'status': 1, 'message': 'Acquisition aborted.'}
+        return {'status': 0, 'filename': f'{len(self.requests)}.fits'}
+
+    def abort(self):
+        # like the camera, aborts only an exposure that has started
+        if self._exposing:
+            self._aborted.set()
+
+
+def run(sequencer, timeout=5):
+    sequencer._thread.join(timeout)
+    assert not sequencer._thread.is_alive()
+    return sequencer.status_report()
+
+
+def test_plan_runs_in_order():
+    camera = FakeCamera()
+    sequencer = Sequencer(camera.capture, abort=camera.abort)
+    sequencer.submit([
+        {'filter': 'r', 'exptime': 0.01, 'count': 2},
+        {'filter': 'g', 'exptime': 0.01},
+    ])
+    report = run(sequencer)
+
+    assert report['status'] == 'done' and report['done'] == 3
+    assert [req['filter'] for req in camera.requests] == ['r', 'r', 'g']
+    # the wheel moves on after the last exposure of a step only
+    assert [req.get('next_filter') for req in camera.requests] == [None, 'g', None]
+
+
+def test_pause_waits_for_current_exposure():
+    camera = FakeCamera()
+    sequencer = Sequencer(camera.capture, abort=camera.abort)
+    sequencer.submit([{'filter': 'r', 'exptime': 0.2, 'count': 3}])
+    camera.exposing.wait(1)
+    assert sequencer.pause()
+
+    time.sleep(0.4)
+    report = sequencer.status_report()
+    assert report['status'] == 'paused' and report['done'] == 1
+    assert len(camera.requests) == 1
+
+    assert sequencer.resume()
+    assert run(sequencer)['status'] == 'done'
+    assert len(camera.requests) == 3
+
+
+def test_abort_stops_exposure_and_skips_steps():
+    camera = FakeCamera()
+    sequencer = Sequencer(camera.capture, abort=camera.abort)
+    sequencer.submit([{'filter': 'r', 'exptime': 5}, {'filter': 'g', 'exptime': 5}])
+    camera.exposing.wait(1)
+    assert sequencer.abort()
+
+    report = run(sequencer, timeout=2)
+    assert report['status'] == 'aborted'
+    assert [step['status'] for step in report['steps']] == ['aborted', 'skipped']
+    assert len(camera.requests) == 1
+
+
+def test_abort_during_setup_stops_exposure():
+    # the abort lands before the exposure has started, so the first attempt
+    # to abort it does nothing
+    camera = FakeCamera(setup=0.2)
+    sequencer = Sequencer(camera.capture, abort=camera.abort)
+    sequencer.submit([{'filter': 'r', 'exptime': 5}])
+    while not camera.requests:
+        time.sleep(0.01)
+    assert sequencer.abort()
+
+    report = run(sequencer, timeout=2)
+    assert report['status'] == 'aborted' and report['done'] == 0
+
+
+def test_abort_while_paused_takes_no_exposure():
+    camera = FakeCamera()
+    sequencer = Sequencer(camera.capture, abort=camera.abort)
+    sequencer.submit([{'filter': 'r', 'exptime': 0.2, 'count': 2}])
+    camera.exposing.wait(1)
+    sequencer.pause()
+    time.sleep(0.4)
+    sequencer.abort()
+
+    assert run(sequencer)['status'] == 'aborted'
+    assert len(camera.requests) == 1
+
+
+def test_reorder_pending_steps():
+    camera = FakeCamera()
+    sequencer = Sequencer(camera.capture, abort=camera.abort)
+    sequencer.submit([
+        {'filter': 'r', 'exptime': 0.2},
+        {'filter': 'g', 'exptime': 0.01},
+        {'filter': 'i', 'exptime': 0.01},
+    ])
+    camera.exposing.wait(1)
+    first, g, i = (step['id'] for step in sequencer.status_report()['steps'])
+
+    with pytest.raises(ValueError):
+        # a started step cannot be moved
+        sequencer.reorder([first, i, g])
+    sequencer.reorder([i, g])
+
+    assert run(sequencer)['status'] == 'done'
+    assert [req['filter'] for req in camera.requests] == ['r', 'i', 'g']
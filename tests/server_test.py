@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from server import SimulatedWheel
+
+
+def handle(wheel, *commands):
+    async def run():
+        return [await wheel.handle(command) for command in commands]
+
+    return asyncio.run(run())
+
+
+def test_protocol():
+    wheel = SimulatedWheel(travel_time=0, home_time=0)
+    assert handle(wheel, 'get', 'move 4', 'get', 'home', 'get') == ['OK,0', 'OK', 'OK,4', 'OK', 'OK,0']
+    assert handle(wheel, 'move 6', 'move x', 'spin') == [
+        'ERR,Invalid position 6', 'ERR,Invalid position x', 'ERR,Unknown command spin',
+    ]
+
+
+def test_moves_the_shorter_way():
+    wheel = SimulatedWheel(positions=6, travel_time=0.05)
+    start_time = time.monotonic()
+    # one slot back rather than five forward
+    handle(wheel, 'move 5')
+    assert time.monotonic() - start_time < 0.2
+    assert wheel.position == 5
+
+
+def test_get_refused_while_moving():
+    wheel = SimulatedWheel(travel_time=0.05)
+
+    async def run():
+        move = asyncio.create_task(wheel.handle('move 2'))
+        await asyncio.sleep(0.01)
+        reply = await wheel.handle('get')
+        await move
+        return reply
+
+    assert asyncio.run(run()) == 'ERR,Wheel is moving'
+
+
+def test_faults():
+    wheel = SimulatedWheel(fault_rate=1)
+    assert handle(wheel, 'get') == ['ERR,Simulated fault']
@@ -0,0 +1,40 @@
+import math
+
+import pytest
+
+from camera_actor import CameraActor
+from evora.dummy import Dummy
+from telemetry import TelemetrySampler
+
+
+@pytest.fixture
+def sampler():
+    Dummy.initialize()
+    # samples are taken by the test rather than the background thread
+    sampler = TelemetrySampler(CameraActor(Dummy), period=3600, size=8)
+    sampler.stop()
+    return sampler
+
+
+def test_latest_sample(sampler):
+    sampler.sample()
+    latest = sampler.latest()
+    assert latest['temperature'] == Dummy.current_temp
+    assert latest['status'] == 20073
+
+
+def test_history_wraps_in_time_order(sampler):
+    for _ in range(12):
+        sampler.sample()
+    history = sampler.history()
+    assert len(history) == 8
+    assert (history['time'][1:] >= history['time'][:-1]).all()
+
+
+def test_downsample_has_no_more_buckets_than_samples(sampler):
+    for _ in range(5):
+        sampler.sample()
+    summary = sampler.downsample(buckets=10 ** 9)
+    assert sum(summary['count']) == len(sampler.history())
+    assert len(summary['time']) <= len(sampler.history())
+    assert all(math.isclose(value, Dummy.current_temp) for value in summary['mean'])
@@ -0,0 +1,48 @@
+import pytest
+
+from weather import FakeAmbientAPI, WeatherPoller
+
+
+class Device:
+    def __init__(self, data):
+        self.last_data = data
+
+
+class Client:
+    def __init__(self, data):
+        self.devices = [Device(data)]
+
+    def get_devices(self):
+        return self.devices
+
+
+def poller(client):
+    # polled by hand rather than by its thread
+    weather = WeatherPoller(lambda: client, period=3600)
+    weather.stop()
+    weather._thread.join()
+    weather._history.clear()
+    weather.poll()
+    return weather
+
+
+def test_history_of_fake_station():
+    weather = poller(FakeAmbientAPI(seed=1))
+    weather.poll()
+
+    readings = weather.history()
+    assert len(readings) == 2
+    assert readings[0]['time'] <= readings[1]['time']
+    # only numeric fields are kept
+    assert set(readings[0]) >= {'time', 'tempf', 'humidity'}
+    assert weather.history(fields=['tempf'])[0].keys() == {'time', 'tempf'}
+    assert weather.history(start=readings[1]['time']) == readings[1:]
+
+
+def test_field_named_time_does_not_collide():
+    weather = poller(Client({'time': 12, 'tempf': 50.5}))
+
+    readings = weather.history()
+    assert readings[0]['tempf'] == 50.5
+    assert readings[0]['time'] == pytest.approx(weather.latest()['time'])
+    assert weather.history(fields=['time'])[0]['time'] == readings[0]['time']
@@ -0,0 +1,185 @@
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+
+
+def ambient_client():
+    '''Creates the Ambient Weather API client, configured from the environment.'''
+    from ambient_api.ambientapi import AmbientAPI
+
+    return AmbientAPI()
+
+
+class WeatherPoller:
+    '''Polls the weather station in the background.
+
+    The station is read every ``period`` seconds on a background thread and
+    the last good reading is served from memory, so routes never wait on the
+    weather API. Failed reads are logged and the previous reading kept; it
+    is reported as stale once older than ``ttl``. The numeric fields of each
+    reading are also kept in a bounded history.
+
+    The API client is only created on the first poll, so importing the app
+    does not need the API to be configured or reachable.
+
+    Parameters
+    ----------
+    client_factory
+        Returns the API client, an object whose ``get_devices()`` returns the
+        stations, each with a ``last_data`` dict.
+    period
+        Seconds between polls. The Ambient API allows one request per second.
+    ttl
+        Seconds after which a reading is reported as stale.
+    history
+        Number of readings kept in the history.
+
+    '''
+
+    def __init__(self, client_factory=ambient_client, period=60.0, ttl=300.0, history=1440):
+        self.client_factory = client_factory
+        self.period = period
+        self.ttl = ttl
+
+        self._client = None
+        self._data = None
+        self._time = None
+        self._error = ''
+        self._history = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name='weather', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def poll(self):
+        '''Reads the station once and records the reading.'''
+
+        if self._client is None:
+            self._client = self.client_factory()
+
+        devices = self._client.get_devices()
+        if not devices:
+            raise RuntimeError('No weather station found')
+        data = dict(devices[0].last_data)
+
+        now = time.time()
+        with self._lock:
+            self._data = data
+            self._time = now
+            self._error = ''
+            self._history.append((now, {
+                key: value
+                for key, value in data.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            }))
+
+    def latest(self):
+        '''Returns the last good reading with its age, or None if there is none.
+
+        The returned dict has the reading as ``data``, its ``time`` and ``age``
+        in seconds, whether it is ``stale`` and the ``error`` of the last
+        failed poll since, if any.
+
+        '''
+
+        with self._lock:
+            if self._data is None:
+                return {'data': None, 'time': None, 'age': None, 'stale': True, 'error': self._error}
+            age = time.time() - self._time
+            return {
+                'data': dict(self._data),
+                'time': self._time,
+                'age': age,
+                'stale': age > self.ttl,
+                'error': self._error,
+            }
+
+    def history(self, start=None, end=None, fields=None):
+        '''Returns the readings between two Unix times, oldest first.
+
+        Each reading is a dict of its ``time`` and numeric fields, or only
+        the given ``fields``. A field of the station named ``time`` is
+        replaced by the time of the reading.
+
+        '''
+
+        with self._lock:
+            readings = list(self._history)
+
+        return [
+            {
+                **(values if fields is None else {key: values.get(key) for key in fields}),
+                'time': reading_time,
+            }
+            for reading_time, values in readings
+            if (start is None or reading_time >= start) and (end is None or reading_time <= end)
+        ]
+
+    def _run(self):
+        while not self._stop.is_set():
+            start_time = time.monotonic()
+            try:
+                self.poll()
+            except Exception as err:
+                logging.warning(f'Failed to read the weather station: {err}')
+                with self._lock:
+                    self._error = str(err)
+            self._stop.wait(max(0.0, self.period - (time.monotonic() - start_time)))
+
+
+class FakeDevice:
+    '''A weather station returning plausible, slowly varying readings.'''
+
+    def __init__(self, seed=None):
+        self._random = random.Random(seed)
+
+    @property
+    def last_data(self):
+        now = time.time()
+        # a daily temperature cycle with some noise
+        phase = 2 * math.pi * (now % 86400) / 86400
+        tempf = 50 + 10 * math.sin(phase) + self._random.gauss(0, 0.5)
+        return {
+            'dateutc': int(now * 1000),
+            'tempf': round(tempf, 1),
+            'humidity': int(min(100, max(0, 50 - 20 * math.sin(phase) + self._random.gauss(0, 2)))),
+            'windspeedmph': round(abs(self._random.gauss(5, 2)), 1),
+            'windgustmph': round(abs(self._random.gauss(9, 3)), 1),
+            'winddir': self._random.randrange(360),
+            'baromrelin': round(29.9 + self._random.gauss(0, 0.02), 2),
+            'dewPoint': round(tempf - 15, 1),
+        }
+
+
+class FakeAmbientAPI:
+    '''Stand-in for ``AmbientAPI`` when debugging or testing.
+
+    Parameters
+    ----------
+    latency
+        Seconds each ``get_devices`` call takes.
+    failure_rate
+        Probability that a call raises, to exercise outages.
+    seed
+        Seeds the readings and failures.
+
+    '''
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._devices = [FakeDevice(seed)]
+
+    def get_devices(self):
+        time.sleep(self.latency)
+        if self._random.random() < self.failure_rate:
+            raise ConnectionError('Simulated weather API outage')
+        return self._devices